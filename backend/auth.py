@@ -1,6 +1,10 @@
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict
+from typing import Optional, Dict, Any
+from collections import OrderedDict
+import hashlib
 import random # For generating 6-digit codes
+import time
+import uuid
 
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -30,7 +34,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "type": "access"})
+    to_encode.setdefault("jti", uuid.uuid4().hex) # Token ID used for revocation
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
@@ -38,12 +43,81 @@ def decode_access_token(token: str) -> Optional[TokenData]:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         email: Optional[str] = payload.get("sub")
-        if email is None:
+        if email is None or payload.get("type", "access") != "access":
             return None
         return TokenData(email=email)
     except JWTError:
         return None
 
+def get_token_claims(token: str) -> Optional[Dict[str, Any]]:
+    """Returns the verified payload of any token issued by this app, or None if invalid."""
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
+
+# Refresh tokens: long-lived JWTs whose jti must also be present (and not yet rotated)
+# in the refresh token store. Renewing costs one signature check plus one store lookup.
+def create_refresh_token(email: str) -> Dict[str, Any]:
+    """Creates a signed refresh token. Returns {"token", "jti", "expires_at"}; the caller persists jti."""
+    jti = uuid.uuid4().hex
+    expires_at = datetime.now(timezone.utc) + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+    to_encode = {"sub": email, "jti": jti, "exp": expires_at, "type": "refresh"}
+    token = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    return {"token": token, "jti": jti, "expires_at": expires_at}
+
+def decode_refresh_token(token: str) -> Optional[Dict[str, Any]]:
+    """Returns the refresh token payload if the signature, expiry and type are valid."""
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("type") != "refresh" or not payload.get("sub") or not payload.get("jti"):
+        return None
+    return payload
+
+# --- Verified token cache ---
+# Maps sha256(token) -> {"user": User, "user_id": str, "jti": str, "exp": unix_timestamp}.
+# Bounded LRU so clients that reuse a token skip jwt.decode and the user lookup.
+# Entries are dropped when the token expires or the owning user record changes.
+TOKEN_CACHE_MAX_ENTRIES = 1024
+token_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+def _token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def get_cached_token_user(token: str) -> Optional[Any]:
+    """Returns the cached user for a previously validated token, or None on miss/expiry."""
+    key = _token_cache_key(token)
+    entry = token_cache.get(key)
+    if entry is None:
+        return None
+    if entry["exp"] <= time.time():
+        token_cache.pop(key, None)
+        return None
+    token_cache.move_to_end(key)
+    return entry["user"]
+
+def cache_token_user(token: str, user: Any, exp: float, jti: Optional[str] = None) -> None:
+    """Caches a validated token's user until the token's `exp` (unix timestamp)."""
+    key = _token_cache_key(token)
+    token_cache[key] = {"user": user, "user_id": user.user_id, "jti": jti, "exp": exp}
+    token_cache.move_to_end(key)
+    while len(token_cache) > TOKEN_CACHE_MAX_ENTRIES:
+        token_cache.popitem(last=False)
+
+def invalidate_cached_tokens_for_user(user_id: str) -> None:
+    """Drops every cached token belonging to a user (call on any user record change)."""
+    stale_keys = [key for key, entry in token_cache.items() if entry["user_id"] == user_id]
+    for key in stale_keys:
+        del token_cache[key]
+
+def invalidate_cached_token_jti(jti: str) -> None:
+    """Drops the cached entry for a revoked token so the fast path cannot serve it."""
+    stale_keys = [key for key, entry in token_cache.items() if entry["jti"] == jti]
+    for key in stale_keys:
+        del token_cache[key]
+
 # Two-Factor Authentication (2FA) using TOTP (for authenticator apps)
 def generate_2fa_secret_key() -> str:
     return pyotp.random_base32()
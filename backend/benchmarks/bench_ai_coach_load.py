@@ -0,0 +1,129 @@
+"""
+Offline load test of the AI coach upstream path against the mock LLM server.
+
+USAGE:
+    python -m backend.benchmarks.bench_ai_coach_load --requests 200 --concurrency 50 --latency-ms 1500
+    python -m backend.benchmarks.bench_ai_coach_load --stream --tokens-per-second 30
+
+Starts backend/benchmarks/mock_llm_server.py on a local port (latency, error and token-rate
+flags are passed through), points DEEPSEEK_API_URL at it and fires `--requests` coach calls
+with `--concurrency` in flight, spread over `--users` users. Uncached calls only, so every
+request goes through LLM admission (LLM_MAX_CONCURRENT, queue limits) and the latency budget.
+
+Reports end-to-end latency percentiles (time to first delta as well with --stream), how many
+calls were answered locally or rejected by admission, and the mock's peak concurrency.
+"""
+import argparse
+import asyncio
+import socket
+import threading
+import time
+
+import httpx
+import uvicorn
+
+from backend.config import settings
+from backend.benchmarks.mock_llm_server import MockLLMConfig, create_app
+from backend.services import ai_coach_service, http_clients
+from backend.services.llm_admission import llm_admission, AdmissionRejected
+
+LOCAL_ANSWER = "local"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_mock(config: MockLLMConfig, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def _percentile(samples, p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+
+async def _one_call(i: int, args, outcomes, latencies, first_deltas) -> None:
+    messages = [{"role": "user", "content": f"Give me a training tip #{i}"}]
+    user_id = f"user-{i % args.users}"
+    start = time.perf_counter()
+    try:
+        if args.stream:
+            first = None
+            async for _ in ai_coach_service.stream_ai_coach_response(messages, use_cache=False, user_id=user_id):
+                if first is None:
+                    first = time.perf_counter() - start
+            first_deltas.append(first or 0.0)
+            outcomes["ok"] += 1
+        else:
+            reply = await ai_coach_service.get_ai_coach_response(
+                messages, use_cache=False, user_id=user_id, fallback=lambda: LOCAL_ANSWER,
+            )
+            outcomes["local" if reply == LOCAL_ANSWER else "ok"] += 1
+    except AdmissionRejected:
+        outcomes["rejected"] += 1
+    except Exception:
+        outcomes["failed"] += 1
+    latencies.append(time.perf_counter() - start)
+
+
+async def _run(args) -> None:
+    outcomes = {"ok": 0, "local": 0, "rejected": 0, "failed": 0}
+    latencies, first_deltas = [], []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(i: int) -> None:
+        async with semaphore:
+            await _one_call(i, args, outcomes, latencies, first_deltas)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(bounded(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    await http_clients.shutdown()
+
+    print(f"{args.requests} calls, {args.concurrency} concurrent, {elapsed:.2f}s ({args.requests / elapsed:.1f} calls/s)")
+    print("outcomes:", outcomes)
+    for label, samples in (("latency", latencies), ("first delta", first_deltas)):
+        if samples:
+            print(f"{label:<12} p50 {_percentile(samples, 0.50):.3f}s  p95 {_percentile(samples, 0.95):.3f}s  "
+                  f"p99 {_percentile(samples, 0.99):.3f}s  max {max(samples):.3f}s")
+    print("llm_admission:", llm_admission.stats())
+
+
+def main() -> None:
+    defaults = MockLLMConfig()
+    parser = argparse.ArgumentParser(description="Load-test the AI coach upstream path against the mock LLM")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--hang-rate", type=float, default=defaults.hang_rate)
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--reply-tokens", type=int, default=defaults.reply_tokens)
+    args = parser.parse_args()
+
+    config = MockLLMConfig(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, error_rate=args.error_rate,
+        hang_rate=args.hang_rate, tokens_per_second=args.tokens_per_second, reply_tokens=args.reply_tokens, seed=42,
+    )
+    port = _free_port()
+    server = _start_mock(config, port)
+    settings.DEEPSEEK_API_URL = f"http://127.0.0.1:{port}/v1/chat/completions"
+    try:
+        asyncio.run(_run(args))
+        print("mock:", httpx.get(f"http://127.0.0.1:{port}/stats").json())
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Microbenchmark for fuzzy Places-to-gym name matching (backend/services/gym_name_index.py).
+
+USAGE:
+    python -m backend.benchmarks.bench_gym_name_index
+
+For growing catalogs of generated gym names, compares the full scan the matcher used to run
+(fuzz.ratio against every gym, keep the first best score >= threshold) with
+GymNameIndex.best_match(), checks both return the same gym for every query, and reports the
+fraction of the catalog that survives pruning.
+"""
+import random
+import time
+
+from fuzzywuzzy import fuzz
+
+from backend.models import Gym
+from backend.services.gym_name_index import GymNameIndex, FUZZY_MATCH_THRESHOLD
+
+WORDS = [
+    "gold's", "gym", "fitness", "first", "iron", "temple", "power", "house", "zen", "yoga",
+    "crossfit", "cairo", "nile", "club", "24/7", "elite", "strength", "studio", "box", "maadi",
+    "zamalek", "heliopolis", "pro", "body", "art", "sports", "center", "muscle", "factory", "core",
+    "athletic", "flex", "pulse", "titan", "olympia", "arena", "fit", "lab", "spartan", "x",
+]
+QUERIES = 200
+
+
+def _name(rng: random.Random) -> str:
+    return " ".join(rng.sample(WORDS, rng.randint(1, 4))).title()
+
+
+def _full_scan(gyms, place_name):
+    matched, best_score = None, -1
+    for gym in gyms:
+        score = fuzz.ratio(place_name.lower(), gym.name.lower())
+        if score > best_score and score >= FUZZY_MATCH_THRESHOLD:
+            best_score, matched = score, gym
+    return matched
+
+
+def main() -> None:
+    rng = random.Random(42)
+    print(f"{'gyms':>6} {'full scan':>12} {'index':>12} {'speedup':>8} {'survivors':>10}")
+    for n in (100, 1_000, 5_000, 20_000):
+        gyms = [Gym(name=_name(rng), location="x") for _ in range(n)]
+        queries = [_name(rng) for _ in range(QUERIES)]
+        index = GymNameIndex(threshold=FUZZY_MATCH_THRESHOLD)
+        index.rebuild(gyms)
+
+        start = time.perf_counter()
+        expected = [_full_scan(gyms, query) for query in queries]
+        scan = (time.perf_counter() - start) / QUERIES
+        start = time.perf_counter()
+        actual = [index.best_match(query) for query in queries]
+        indexed = (time.perf_counter() - start) / QUERIES
+        assert all(a is b for a, b in zip(actual, expected)), "index disagrees with the full scan"
+
+        survivors = sum(len(index.candidates(query)) for query in queries) / (QUERIES * n)
+        print(f"{n:>6} {scan * 1e3:>10.3f}ms {indexed * 1e3:>10.3f}ms {scan / indexed:>7.1f}x {survivors:>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Microbenchmark for nearby-result distance computation (backend/services/geo_utils.py).
+
+USAGE:
+    python -m backend.benchmarks.bench_haversine
+
+Compares, for growing candidate counts, the scalar loop the nearby paths used to run
+(calculate_distance_haversine per point, filter, sort) with one nearest_within() call
+(vectorized distances, radius filter and top-N selection).
+"""
+import random
+import time
+
+from backend.services.geo_utils import calculate_distance_haversine, nearest_within
+
+CENTER = (30.0444, 31.2357) # Cairo
+RADIUS_KM = 5.0
+LIMIT = 20
+
+
+def _scalar(latitudes, longitudes):
+    results = []
+    for position, (lat, lon) in enumerate(zip(latitudes, longitudes)):
+        dist_km = calculate_distance_haversine(CENTER[0], CENTER[1], lat, lon)
+        if dist_km <= RADIUS_KM:
+            results.append((position, dist_km))
+    results.sort(key=lambda pair: pair[1])
+    return results[:LIMIT]
+
+
+def _vectorized(latitudes, longitudes):
+    return nearest_within(CENTER[0], CENTER[1], latitudes, longitudes, RADIUS_KM, LIMIT)
+
+
+def _time(fn, *args) -> float:
+    repeats = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn(*args)
+        elapsed = time.perf_counter() - start
+        if elapsed > 0.2:
+            return elapsed / repeats
+        repeats *= 2
+
+
+def main() -> None:
+    rng = random.Random(42)
+    print(f"{'points':>8} {'scalar':>12} {'vectorized':>12} {'speedup':>8}")
+    for n in (20, 200, 2_000, 20_000, 200_000):
+        latitudes = [CENTER[0] + rng.uniform(-0.2, 0.2) for _ in range(n)]
+        longitudes = [CENTER[1] + rng.uniform(-0.2, 0.2) for _ in range(n)]
+        assert _scalar(latitudes, longitudes) == _vectorized(latitudes, longitudes)
+        scalar = _time(_scalar, latitudes, longitudes)
+        vectorized = _time(_vectorized, latitudes, longitudes)
+        print(f"{n:>8} {scalar * 1e3:>10.3f}ms {vectorized * 1e3:>10.3f}ms {scalar / vectorized:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Microbenchmark for the in-process rate limiter (backend/rate_limiter.py).
+
+USAGE:
+    python -m backend.benchmarks.bench_rate_limiter
+
+Measures the cost of one TokenBucketLimiter.hit() call for:
+- a hot key (the common case: the same client hitting an endpoint repeatedly)
+- many distinct keys within max_keys (LRU move-to-end on every hit)
+- key churn beyond max_keys (a new bucket plus an LRU eviction on every hit)
+"""
+import time
+
+from backend.rate_limiter import TokenBucketLimiter
+
+ITERATIONS = 200_000
+
+
+def _bench(label: str, limiter: TokenBucketLimiter, keys) -> None:
+    n = len(keys)
+    start = time.perf_counter()
+    for i in range(ITERATIONS):
+        limiter.hit(keys[i % n])
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed / ITERATIONS * 1e6:8.3f} us/check  ({len(limiter.buckets)} buckets)")
+
+
+def main() -> None:
+    print(f"TokenBucketLimiter.hit() over {ITERATIONS} iterations")
+    _bench("hot key", TokenBucketLimiter("hot", capacity=10**9, refill_per_second=1.0), ["203.0.113.7"])
+    _bench("5,000 keys (fits in max_keys)", TokenBucketLimiter("warm", capacity=60, refill_per_second=1.0), [f"user-{i}" for i in range(5000)])
+    _bench("50,000 keys (evicting, max_keys=10,000)", TokenBucketLimiter("churn", capacity=60, refill_per_second=1.0, max_keys=10000), [f"ip-{i}" for i in range(50000)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Local OpenAI-compatible chat-completions server for load testing the AI coach offline.
+
+USAGE:
+    python -m backend.benchmarks.mock_llm_server --port 8081 --latency-ms 800 --error-rate 0.02
+    DEEPSEEK_API_URL=http://127.0.0.1:8081/v1/chat/completions uv run uvicorn backend.main:app
+
+Serves POST /v1/chat/completions, both plain JSON replies and `"stream": true` SSE chunks
+ending in `data: [DONE]`, like DeepSeek/OpenAI. Each request:
+
+1. waits a time-to-first-byte drawn from a lognormal distribution (median --latency-ms,
+   spread --latency-sigma; 0 gives a fixed latency),
+2. fails with --error-status for a --error-rate fraction of requests, or hangs for
+   --hang-seconds for a --hang-rate fraction (to exercise client timeouts and budgets),
+3. otherwise generates --reply-tokens words at --tokens-per-second (streamed one per chunk,
+   or all at once after the same total time without streaming).
+
+GET /stats returns request/error counters and the peak number of concurrent requests, which
+shows whether the app's LLM admission cap held. POST /stats/reset clears them.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLY_WORDS = (
+    "Great question! Start with three short sessions a week, keep most of them easy, and add a "
+    "little more time each week. Eat enough protein, drink water through the day and sleep well "
+    "so your body can recover between workouts."
+).split()
+
+
+@dataclass
+class MockLLMConfig:
+    latency_ms: float = 800.0 # median time to first byte
+    latency_sigma: float = 0.5 # lognormal spread of the latency; 0 = fixed
+    error_rate: float = 0.0
+    error_status: int = 500
+    hang_rate: float = 0.0
+    hang_seconds: float = 60.0
+    tokens_per_second: float = 50.0
+    reply_tokens: int = 120
+    seed: Optional[int] = None
+
+
+def create_app(config: MockLLMConfig) -> FastAPI:
+    app = FastAPI(title="Mock LLM")
+    rng = random.Random(config.seed)
+    stats = {"requests": 0, "streamed": 0, "errors": 0, "hangs": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def first_byte_delay() -> float:
+        if config.latency_sigma <= 0:
+            return config.latency_ms / 1000
+        return rng.lognormvariate(0.0, config.latency_sigma) * config.latency_ms / 1000
+
+    def reply_words():
+        return [REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(config.reply_tokens)]
+
+    def token_delay() -> float:
+        return 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+    def envelope(model: str, **choice: Any) -> Dict[str, Any]:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion.chunk" if "delta" in choice else "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, **choice}],
+        }
+
+    def track_start() -> None:
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock-chat")
+        track_start()
+        streaming = False
+        try:
+            await asyncio.sleep(first_byte_delay())
+            roll = rng.random()
+            if roll < config.error_rate:
+                stats["errors"] += 1
+                return JSONResponse({"error": {"message": "mock upstream error"}}, status_code=config.error_status)
+            if roll < config.error_rate + config.hang_rate:
+                stats["hangs"] += 1
+                await asyncio.sleep(config.hang_seconds)
+            words = reply_words()
+            if not body.get("stream"):
+                await asyncio.sleep(len(words) * token_delay())
+                reply = envelope(model, message={"role": "assistant", "content": " ".join(words)}, finish_reason="stop")
+                reply["usage"] = {"prompt_tokens": len(json.dumps(body.get("messages", []))) // 4, "completion_tokens": len(words)}
+                return reply
+            streaming = True # The chunk generator now owns the in-flight count
+        finally:
+            if not streaming:
+                stats["in_flight"] -= 1
+
+        stats["streamed"] += 1
+
+        async def chunks() -> AsyncIterator[str]:
+            try:
+                yield f"data: {json.dumps(envelope(model, delta={'role': 'assistant'}, finish_reason=None))}\n\n"
+                for i, word in enumerate(words):
+                    await asyncio.sleep(token_delay())
+                    content = word if i == 0 else f" {word}"
+                    yield f"data: {json.dumps(envelope(model, delta={'content': content}, finish_reason=None))}\n\n"
+                yield f"data: {json.dumps(envelope(model, delta={}, finish_reason='stop'))}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                stats["in_flight"] -= 1
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/stats/reset")
+    async def reset_stats():
+        for key in stats:
+            if key != "in_flight":
+                stats[key] = 0
+        stats["max_in_flight"] = stats["in_flight"]
+        return stats
+
+    return app
+
+
+def main() -> None:
+    defaults = MockLLMConfig()
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock chat-completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--hang-rate", type=float, default=defaults.hang_rate)
+    parser.add_argument("--hang-seconds", type=float, default=defaults.hang_seconds)
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--reply-tokens", type=int, default=defaults.reply_tokens)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = MockLLMConfig(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate, error_status=args.error_status,
+        hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+        tokens_per_second=args.tokens_per_second, reply_tokens=args.reply_tokens, seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,82 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 14 # Rotating refresh tokens; renewals skip bcrypt + email 2FA
     DATABASE_URL: str
     GOOGLE_API_KEY: str
 
     # DeepSeek (OpenAI-compatible) API key for AI Coach feature
     DEEPSEEK_API_KEY: str
+    # Chat-completions endpoint; point at backend/benchmarks/mock_llm_server.py for offline load tests
+    DEEPSEEK_API_URL: str = "https://api.deepseek.com/v1/chat/completions"
+
+    # Per-key request budgets for expensive endpoints (bcrypt, outbound email, paid LLM calls)
+    RATE_LIMIT_LOGIN_PER_MINUTE: int = 10 # per email
+    RATE_LIMIT_LOGIN_IP_PER_MINUTE: int = 60 # per client IP, across all emails
+    RATE_LIMIT_2FA_PER_MINUTE: int = 10 # per email
+    RATE_LIMIT_AI_COACH_PER_MINUTE: int = 20 # per user_id
+    RATE_LIMIT_TRUSTED_PROXIES: str = "" # comma-separated proxy IPs whose X-Forwarded-For is trusted for per-IP limits
+
+    # Outbound HTTP (Google Places, DeepSeek). HTTP/2 also needs the `h2` package installed.
+    OUTBOUND_HTTP2: bool = False
+
+    # Google Places nearby-search cache (keyed by geohash cell + radius bucket)
+    PLACES_CACHE_TTL_SECONDS: int = 600
+    PLACES_CACHE_MAX_ENTRIES: int = 2048
+
+    # Google Places circuit breaker: slow (over budget) or failed calls count as errors
+    PLACES_LATENCY_BUDGET_SECONDS: float = 2.0
+    PLACES_BREAKER_WINDOW: int = 20 # most recent calls considered
+    PLACES_BREAKER_MIN_CALLS: int = 5 # calls in the window before the breaker may open
+    PLACES_BREAKER_ERROR_RATE: float = 0.5
+    PLACES_BREAKER_OPEN_SECONDS: float = 30.0 # how long to skip Google before a probe call
+
+    # Bounded AI coach latency: "budget" answers from the local rule-based coach when DeepSeek misses
+    # the budget or fails; "hedged" also sends a second upstream request after AI_COACH_HEDGE_AFTER_SECONDS
+    # and uses whichever answers first; "off" waits for the upstream timeout
+    AI_COACH_FALLBACK_MODE: str = "budget"
+    AI_COACH_LATENCY_BUDGET_SECONDS: float = 8.0
+    AI_COACH_HEDGE_AFTER_SECONDS: float = 3.0
+
+    # AI coach prompt size (estimated tokens): system prompt + as many recent turns as fit
+    AI_COACH_CONTEXT_TOKEN_BUDGET: int = 3000
+    AI_COACH_MAX_MESSAGE_TOKENS: int = 1000 # longer messages are truncated
+
+    # Cache of AI coach replies for identical prompts (per-request opt-out with use_cache=false)
+    AI_COACH_CACHE_TTL_SECONDS: int = 3600
+    AI_COACH_CACHE_MAX_ENTRIES: int = 1000
+    # True: cacheable turns send a coarse profile (no name, ranges instead of exact age/totals) so users share entries
+    AI_COACH_CACHE_SHARED_PROFILE: bool = False
+
+    # Admission control for outbound LLM calls (fair-share across users)
+    LLM_MAX_CONCURRENT: int = 8 # upstream calls in flight at once
+    LLM_MAX_QUEUE_DEPTH: int = 64 # waiting calls before new ones get 503
+    LLM_MAX_QUEUE_PER_USER: int = 4
+    LLM_MAX_QUEUE_WAIT_SECONDS: float = 10.0
+    LLM_BACKGROUND_RESERVED_SLOTS: int = 4 # slots batch jobs never take, kept for interactive chats
+
+    # Nightly batch generation of personalised daily tips (GET /ai-coach/daily-tip)
+    DAILY_TIPS_ENABLED: bool = False # run the job from the app process once a day
+    DAILY_TIPS_RUN_HOUR_UTC: int = 3
+    DAILY_TIPS_BATCH_SIZE: int = 50 # users per chunk; progress is checkpointed after each chunk
+    DAILY_TIPS_WORKERS: int = 2
+    DAILY_TIPS_PER_MINUTE: int = 30 # upstream calls per minute for the whole job
+
+    # Server-side AI coach sessions (in memory, LRU + idle expiry)
+    AI_COACH_MAX_SESSIONS: int = 5000
+    AI_COACH_MAX_SESSIONS_PER_USER: int = 5 # creating another evicts the user's least recently used session
+    AI_COACH_SESSION_MAX_TURNS: int = 10 # user+assistant pairs kept per session
+    AI_COACH_SESSION_TTL_MINUTES: int = 60
+    # Fold older session turns into a running summary: "off", "llm" or "local" (no-network stub)
+    AI_COACH_SUMMARIZER: str = "off"
+    AI_COACH_SUMMARIZE_AFTER_TURNS: int = 6 # exchanges in a session before folding starts
+    AI_COACH_SUMMARY_KEEP_TURNS: int = 2 # most recent exchanges always kept verbatim
+    AI_COACH_SUMMARY_MAX_TOKENS: int = 300
+
+    # Team photo uploads (bigger uploads get 413; only JPEG/PNG/GIF/WebP content is accepted)
+    TEAM_PHOTO_MAX_BYTES: int = 5 * 1024 * 1024
+    TEAM_PHOTO_RENDITION_FORMAT: str = "webp" # "webp" or "jpeg"
+    TEAM_PHOTO_WORKERS: int = 2 # processes rendering thumbnails/resized copies
 
     # Email settings for Gmail
     MAIL_USERNAME: str
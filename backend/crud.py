@@ -1,10 +1,14 @@
 from typing import List, Optional, Dict, Any
 from tinydb import Query
-from .database import UserTable, GymTable, GroupActivityTeamTable
+from .database import UserTable, GymTable, GroupActivityTeamTable, RefreshTokenTable, RevokedTokenTable, PlaceMatchTable, DailyTipTable, BatchJobTable, PhotoRefTable
 from .models import User, Gym, GroupActivityTeam, ActivityLog
 from .schemas import UserCreate # For type hinting where appropriate
-from .auth import get_password_hash # For user creation
-from datetime import datetime, date
+from .auth import get_password_hash, invalidate_cached_tokens_for_user # For user creation / token cache upkeep
+from .services.gym_geo_index import gym_geo_index # Kept current on gym writes
+from .services.gym_name_index import gym_name_index
+from .services.places_cache import places_cache # Cached Places results embed their gym match
+from .services import photo_storage # Team photos are stored as files, not inside documents
+from datetime import datetime, date, timezone
 import uuid
 
 # ===== User CRUD Operations =====
@@ -60,16 +64,25 @@ def update_user_db(user_id: str, user_update_data: Dict[str, Any]) -> Optional[U
         return get_user_by_id(user_id)
         
     updated_ids = UserTable.update(update_data_cleaned, Query().user_id == user_id)
+    invalidate_cached_tokens_for_user(user_id) # Cached principals must reflect the new record (e.g. password reset)
     if len(updated_ids) > 0:
         return get_user_by_id(user_id)
     return None
 
+def get_users_after_db(after_user_id: Optional[str], limit: int) -> List[User]:
+    """Up to `limit` users ordered by user_id, starting after `after_user_id` (for resumable batch jobs)."""
+    user_docs = sorted(UserTable.all(), key=lambda doc: doc["user_id"])
+    if after_user_id is not None:
+        user_docs = [doc for doc in user_docs if doc["user_id"] > after_user_id]
+    return [User(**doc) for doc in user_docs[:limit]]
+
 def add_activity_log_db(user_id: str, activity_log: ActivityLog) -> Optional[User]:
     user = get_user_by_id(user_id)
     if not user:
         return None
     user.tracked_activities.append(activity_log)
     UserTable.update({'tracked_activities': [act.model_dump() for act in user.tracked_activities]}, Query().user_id == user_id)
+    invalidate_cached_tokens_for_user(user_id)
     return user
 
 def update_daily_activity_log_db(user_id: str, activity_type: str, activity_date: date, value: float, unit: str) -> Optional[User]:
@@ -101,6 +114,7 @@ def update_daily_activity_log_db(user_id: str, activity_type: str, activity_date
     
     # Update database
     UserTable.update({'tracked_activities': [act.model_dump() for act in user.tracked_activities]}, Query().user_id == user_id)
+    invalidate_cached_tokens_for_user(user_id)
     return user
 
 # ===== Gym CRUD Operations =====
@@ -109,6 +123,9 @@ def create_gym_db(gym_data: Gym) -> Gym:
     if GymTable.get(Query().name == gym_data.name): # Basic check, might need more robust duplicate checks
         return None # Or raise exception
     GymTable.insert(gym_data.model_dump())
+    gym_geo_index.upsert(gym_data)
+    gym_name_index.invalidate()
+    clear_place_matches_db() # The new gym may be a better match for already resolved places
     return gym_data
 
 def get_gym_by_id(gym_id: str) -> Optional[Gym]:
@@ -128,13 +145,25 @@ def update_gym_db(gym_id: str, gym_update_data: Dict[str, Any]) -> Optional[Gym]
 
     updated_ids = GymTable.update(update_data_cleaned, Query().gym_id == gym_id)
     if len(updated_ids) > 0:
-        return get_gym_by_id(gym_id)
+        updated_gym = get_gym_by_id(gym_id)
+        gym_geo_index.upsert(updated_gym)
+        gym_name_index.invalidate()
+        if "name" in update_data_cleaned:
+            clear_place_matches_db() # Matching only depends on gym names
+        return updated_gym
     return None
 
 # ===== Group Activity Team CRUD Operations =====
 def create_group_activity_team_db(team_data: GroupActivityTeam) -> GroupActivityTeam:
     # team_id is auto-generated by model default factory
-    GroupActivityTeamTable.insert(team_data.model_dump())
+    if team_data.photo_base64:
+        # Move inline photo data into the photo store; the document keeps only its URL
+        filename = photo_storage.store_photo_bytes(photo_storage.decode_base64_photo(team_data.photo_base64))
+        team_data = team_data.model_copy(update={"photo_url": photo_storage.photo_url(filename), "photo_base64": None})
+    photo_filename = photo_storage.filename_from_url(team_data.photo_url)
+    if photo_filename:
+        acquire_photo_ref_db(photo_filename)
+    GroupActivityTeamTable.insert(team_data.model_dump(exclude={"photo_base64"}))
     return team_data
 
 def get_group_activity_team_by_id(team_id: str) -> Optional[GroupActivityTeam]:
@@ -181,6 +210,9 @@ def delete_group_activity_team_db(team_id: str, lister_id: str) -> bool:
         return False # Or raise Forbidden/Not Found
     
     deleted_ids = GroupActivityTeamTable.remove(Query().team_id == team_id)
+    photo_filename = photo_storage.filename_from_url(team.photo_url)
+    if deleted_ids and photo_filename:
+        release_photo_ref_db(photo_filename) # The caller removes the file once no team uses it (photo_storage.collect_photo)
     return len(deleted_ids) > 0
 
 # Booking related CRUD (simplified, might need its own table or more complex logic)
@@ -202,6 +234,7 @@ def add_booking_to_user_and_team(user_id: str, team_id: str) -> bool:
     # Update User
     user.bookings.append(team_id)
     UserTable.update({'bookings': user.bookings}, Query().user_id == user_id)
+    invalidate_cached_tokens_for_user(user_id)
 
     # Update Team
     team.players_enrolled.append(user_id)
@@ -273,6 +306,7 @@ def remove_booking_from_user_and_team(user_id: str, team_id: str) -> bool:
     # Update user record
     user.bookings.remove(team_id)
     UserTable.update({"bookings": user.bookings}, Query().user_id == user_id)
+    invalidate_cached_tokens_for_user(user_id)
 
     # Update team record
     team.players_enrolled.remove(user_id)
@@ -291,4 +325,124 @@ def remove_booking_from_user_and_team(user_id: str, team_id: str) -> bool:
         Query().team_id == team_id,
     )
 
-    return True 
\ No newline at end of file
+    return True 
+
+# ===== Refresh Token Store =====
+def _expired():
+    now = datetime.now(timezone.utc)
+    return Query().expires_at.test(lambda value: datetime.fromisoformat(str(value)) <= now)
+
+def create_refresh_token_record_db(
+    jti: str, email: str, expires_at: datetime,
+    access_jti: Optional[str] = None, access_expires_at: Optional[datetime] = None
+) -> None:
+    # Expired records (rotated or not) are dead weight: the JWT exp check already rejects those tokens
+    users_expired = (Query().email == email) & _expired()
+    if RefreshTokenTable.search(users_expired): # Read first: a remove always rewrites the file
+        RefreshTokenTable.remove(users_expired)
+    # The paired access token's jti is kept so it can be revoked together with the session
+    RefreshTokenTable.insert({
+        "jti": jti, "email": email, "expires_at": expires_at, "rotated": False,
+        "access_jti": access_jti, "access_expires_at": access_expires_at,
+    })
+
+def get_refresh_token_record_db(jti: str) -> Optional[Dict[str, Any]]:
+    record = RefreshTokenTable.get(Query().jti == jti)
+    if record and isinstance(record.get("expires_at"), str):
+        record["expires_at"] = datetime.fromisoformat(record["expires_at"])
+    return record
+
+def mark_refresh_token_rotated_db(jti: str) -> bool:
+    """Marks a refresh token as used. Returns False if it was unknown or already rotated."""
+    updated_ids = RefreshTokenTable.update({"rotated": True}, (Query().jti == jti) & (Query().rotated == False))
+    return len(updated_ids) > 0
+
+def delete_refresh_token_record_db(jti: str) -> bool:
+    removed_ids = RefreshTokenTable.remove(Query().jti == jti)
+    return len(removed_ids) > 0
+
+def purge_expired_refresh_tokens_db() -> int:
+    """Removes every expired refresh token record (run at startup). Returns how many were removed."""
+    return len(RefreshTokenTable.remove(_expired()))
+
+def revoke_refresh_tokens_for_user_db(email: str) -> List[Dict[str, Any]]:
+    """Removes every refresh token issued to a user (password reset, token reuse). Returns the removed records."""
+    records = RefreshTokenTable.search(Query().email == email)
+    RefreshTokenTable.remove(Query().email == email)
+    return records
+
+# ===== Revoked Token Store =====
+def add_revoked_token_db(jti: str, expires_at: datetime) -> None:
+    if not RevokedTokenTable.contains(Query().jti == jti):
+        RevokedTokenTable.insert({"jti": jti, "expires_at": expires_at})
+
+def is_token_revoked_db(jti: str) -> bool:
+    return RevokedTokenTable.contains(Query().jti == jti)
+
+def get_all_revoked_token_ids_db(purge_expired: bool = True) -> List[str]:
+    """Returns every revoked jti. Expired entries are purged first: the JWT exp check already rejects them."""
+    if purge_expired:
+        now = datetime.now(timezone.utc)
+        RevokedTokenTable.remove(Query().expires_at.test(lambda value: datetime.fromisoformat(str(value)) <= now))
+    return [doc["jti"] for doc in RevokedTokenTable.all()]
+
+# ===== Place Match Store =====
+# One record per Google place_id: {"place_id", "place_name", "gym_id"}; gym_id is None when the
+# place matched no registered gym. The place name is kept so a renamed place is matched again.
+def get_all_place_matches_db() -> Dict[str, Dict[str, Any]]:
+    return {doc["place_id"]: doc for doc in PlaceMatchTable.all()}
+
+def save_place_matches_db(matches: List[Dict[str, Any]]) -> None:
+    """Stores newly resolved matches in one write, replacing older records for the same place_ids."""
+    if not matches:
+        return
+    place_ids = {match["place_id"] for match in matches}
+    PlaceMatchTable.remove(Query().place_id.one_of(list(place_ids)))
+    PlaceMatchTable.insert_multiple(matches)
+
+def clear_place_matches_db() -> None:
+    PlaceMatchTable.truncate()
+    places_cache.clear() # Its entries carry matches resolved before the change
+
+# ===== Daily Tips =====
+def save_daily_tip_db(user_id: str, tip_date: date, tip: str) -> None:
+    """Stores the user's tip for `tip_date`, replacing their previous one (one row per user)."""
+    current = DailyTipTable.get(Query().user_id == user_id)
+    if current and current["date"] > tip_date.isoformat():
+        return # A rerun for an earlier day must not replace a newer tip
+    DailyTipTable.upsert(
+        {"user_id": user_id, "date": tip_date.isoformat(), "tip": tip, "generated_at": datetime.now(timezone.utc)},
+        Query().user_id == user_id,
+    )
+
+def get_daily_tip_user_ids_db(tip_date: date) -> List[str]:
+    return [doc["user_id"] for doc in DailyTipTable.search(Query().date == tip_date.isoformat())]
+
+def get_latest_daily_tip_db(user_id: str) -> Optional[Dict[str, Any]]:
+    return DailyTipTable.get(Query().user_id == user_id)
+
+# ===== Batch Job Checkpoints =====
+def get_batch_job_state_db(job: str) -> Optional[Dict[str, Any]]:
+    return BatchJobTable.get(Query().job == job)
+
+def save_batch_job_state_db(job: str, state: Dict[str, Any]) -> None:
+    BatchJobTable.upsert({"job": job, **state}, Query().job == job)
+
+# ===== Team Photo References =====
+def get_photo_ref_count_db(filename: str) -> int:
+    ref = PhotoRefTable.get(Query().filename == filename)
+    return ref["count"] if ref else 0
+
+def acquire_photo_ref_db(filename: str) -> int:
+    count = get_photo_ref_count_db(filename) + 1
+    PhotoRefTable.upsert({"filename": filename, "count": count}, Query().filename == filename)
+    return count
+
+def release_photo_ref_db(filename: str) -> int:
+    """Drops one team's reference and returns how many remain (0 also for untracked files)."""
+    count = get_photo_ref_count_db(filename) - 1
+    if count <= 0:
+        PhotoRefTable.remove(Query().filename == filename)
+        return 0
+    PhotoRefTable.update({"count": count}, Query().filename == filename)
+    return count
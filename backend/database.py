@@ -24,8 +24,18 @@ db = TinyDB(settings.DATABASE_URL, storage=CustomJSONStorage)
 UserTable = db.table('users')
 GymTable = db.table('gyms')
 GroupActivityTeamTable = db.table('group_activity_teams')
-# Potentially a table for Revoked Tokens if using a blacklist strategy for JWT logout
-# RevokedTokenTable = db.table('revoked_tokens')
+# Issued refresh tokens, keyed by their jti (see auth.create_refresh_token)
+RefreshTokenTable = db.table('refresh_tokens')
+# Revoked token IDs (jti) for logout / password reset, fronted by the Bloom filter in revocation.py
+RevokedTokenTable = db.table('revoked_tokens')
+# Resolved Google place_id -> gym_id (None = no registered gym) fuzzy matches, see gcloud_service.fetch_places
+PlaceMatchTable = db.table('place_matches')
+# One personalised coaching tip per user per day, generated by the daily tips batch job
+DailyTipTable = db.table('daily_tips')
+# Progress checkpoints of resumable batch jobs, keyed by job name
+BatchJobTable = db.table('batch_jobs')
+# Number of teams referencing each content-addressed team photo file, see crud photo reference helpers
+PhotoRefTable = db.table('photo_refs')
 
 # You can also get a table instance dynamically if needed:
 # def get_table(table_name: str) -> table.Table:
@@ -28,7 +28,7 @@ FIELD EXPLANATIONS:
 - current_players_count: int - Current number of enrolled participants (starts at 0)
 - players_enrolled: List[str] - List of user IDs who joined (empty initially)
 - status: str - "active", "filled", "cancelled"
-- photo_base64: Optional[str] - Base64 encoded photo data
+- photo_base64: Optional[str] - Base64 encoded photo data (saved as a file; the document keeps photo_url)
 
 ACTIVITY TYPES:
 - Cardio: "Running", "Cycling", "Swimming", "HIIT"
@@ -56,6 +56,7 @@ PHOTO DATA:
 - Use small images for demo purposes (large images increase database size)
 - Format: "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAAB..."
 - Can be None if no photo is provided
+- Never stored in the database: crud writes it to backend/static/uploads/team_photos and sets photo_url
 
 DO NOT:
 - Use duplicate team names for same activity type
@@ -19,6 +19,7 @@ FIELD EXPLANATIONS:
 - name: str - Name of the gym (must be descriptive)
 - location: str - Physical address or location description
 - location_url: Optional[HttpUrl] - Google Maps URL or website URL
+- latitude / longitude: Optional[float] - Coordinates used by the local "around you" index
 - token_per_visit: Optional[float] - Cost per visit in tokens/currency
 - genders_accepted: List[str] - ["Male", "Female", "Unisex"] - can have multiple
 - subscriptions: List[Subscription] - List of subscription plans
@@ -71,6 +72,7 @@ def create_comprehensive_gyms():
         name="FitLife Premium Fitness Center",                    # str: Gym name
         location="123 Main Street, Downtown, City Center",        # str: Physical address
         location_url="https://maps.google.com/place/fitlife",     # Optional[str]: Google Maps link (will be converted to HttpUrl)
+        latitude=30.0444, longitude=31.2357,                      # Optional[float]: Coordinates for the local geo index
         token_per_visit=15.50,                                    # Optional[float]: Cost per visit
         
         # genders_accepted: List[str] - Who can use this gym
@@ -149,6 +151,7 @@ def create_comprehensive_gyms():
         name="Her Strength Women's Fitness Studio",
         location="456 Oak Avenue, Uptown District",
         location_url="https://maps.google.com/place/herstrength",
+        latitude=30.0561, longitude=31.2394,
         token_per_visit=12.00,
         
         genders_accepted=["Female"],                              # Women only
@@ -214,6 +217,7 @@ def create_comprehensive_gyms():
         name="24/7 Fitness Express",
         location="789 Industrial Blvd, Suburb Area",
         location_url="https://maps.google.com/place/247fitness",
+        latitude=30.0131, longitude=31.2089,
         token_per_visit=8.99,                                     # Budget pricing
         
         genders_accepted=["Unisex"],                              # Fully integrated
@@ -271,6 +275,7 @@ def create_comprehensive_gyms():
         name="Iron Fist Combat Academy",
         location="321 Fighter's Way, Sports District",
         location_url="https://maps.google.com/place/ironfist",
+        latitude=30.0626, longitude=31.2497,
         token_per_visit=20.00,                                    # Specialized pricing
         
         genders_accepted=["Male", "Female"],                      # Mixed with separate training areas
@@ -339,6 +344,7 @@ def create_comprehensive_gyms():
         name="Zenith Wellness & Spa",
         location="555 Luxury Lane, Elite District",
         location_url="https://maps.google.com/place/zenithwellness",
+        latitude=30.0276, longitude=31.2101,
         token_per_visit=35.00,                                    # Premium pricing
         
         genders_accepted=["Male", "Female"],                      # Luxury mixed facility
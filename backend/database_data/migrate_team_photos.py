@@ -0,0 +1,66 @@
+"""
+Migrate Team Photos Script for Sportify Backend
+
+Moves base64 photo data out of group activity team documents into the team photo store
+(backend/static/uploads/team_photos), leaving only a `photo_url` reference in each document.
+
+USAGE:
+    python -m backend.database_data.migrate_team_photos
+
+WHAT THIS SCRIPT DOES:
+- Finds every team document that still has a `photo_base64` value
+- Decodes it (with or without a "data:image/...;base64," prefix) and stores the image file
+  (content-addressed: teams with the same photo share one file) with a reference for the team
+- Sets `photo_url` (unless the team already has one) and removes `photo_base64`
+- Leaves documents whose data is not a valid JPEG/PNG/GIF/WebP image unchanged, and lists them
+
+Safe to run more than once: migrated documents no longer have `photo_base64`.
+Back up the database file before running it against real data.
+"""
+
+import sys
+import os
+import binascii
+from typing import Dict
+
+# Add the parent directory to the path to import backend modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.database import GroupActivityTeamTable
+from backend import crud
+from backend.services import photo_storage
+
+
+def migrate_team_photos() -> Dict[str, int]:
+    """Migrates every team document with inline photo data; returns counts per outcome."""
+    counts = {"migrated": 0, "failed": 0}
+    for doc in GroupActivityTeamTable.all():
+        if "photo_base64" not in doc:
+            continue
+        photo_url = doc.get("photo_url")
+        if doc["photo_base64"] and not photo_url:
+            try:
+                filename = photo_storage.store_photo_bytes(photo_storage.decode_base64_photo(doc["photo_base64"]))
+            except (binascii.Error, ValueError) as e:
+                counts["failed"] += 1
+                print(f"❌ Team {doc.get('team_id')} ({doc.get('name')}): {e}")
+                continue
+            photo_url = photo_storage.photo_url(filename)
+            crud.acquire_photo_ref_db(filename)
+
+        def move_photo(document, photo_url=photo_url):
+            document.pop("photo_base64", None)
+            document["photo_url"] = photo_url
+
+        GroupActivityTeamTable.update(move_photo, doc_ids=[doc.doc_id])
+        counts["migrated"] += 1
+    return counts
+
+
+if __name__ == "__main__":
+    print("="*60)
+    print("MIGRATING TEAM PHOTOS OUT OF TEAM DOCUMENTS")
+    print("="*60)
+    counts = migrate_team_photos()
+    print(f"Teams migrated: {counts['migrated']}")
+    print(f"Teams left unchanged (invalid photo data): {counts['failed']}")
@@ -2,7 +2,7 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from pydantic import ValidationError
-from . import crud, schemas, models
+from . import crud, schemas, models, auth, revocation
 from .config import settings
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login") # Adjusted tokenUrl to match potential router prefix
@@ -13,18 +13,30 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> models.User:
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # Fast path: token already validated and its user still unchanged
+    cached_user = auth.get_cached_token_user(token)
+    if cached_user is not None:
+        return cached_user
+
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        if email is None or payload.get("type", "access") != "access": # Refresh tokens are not bearer credentials
             raise credentials_exception
         token_data = schemas.TokenData(email=email)
     except (JWTError, ValidationError):
         raise credentials_exception
+
+    # Bloom filter answers "not revoked" in a few hashes; only possible hits touch the table
+    jti = payload.get("jti")
+    if jti and revocation.is_token_revoked(jti):
+        raise credentials_exception
     
     user = crud.get_user_by_email(email=token_data.email)
     if user is None:
         raise credentials_exception
+    if payload.get("exp") is not None:
+        auth.cache_token_user(token, user, exp=payload["exp"], jti=jti)
     return user
 
 async def get_current_active_user(current_user: models.User = Depends(get_current_user)) -> models.User:
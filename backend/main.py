@@ -1,9 +1,15 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles # Import StaticFiles
 import os # For path joining
 
-from .routers import auth_router, users_router, gyms_router, activity_teams_router, leaderboard_router, ai_coach_router
+from .routers import auth_router, users_router, gyms_router, activity_teams_router, leaderboard_router, ai_coach_router, metrics_router
+from . import revocation, crud
+from .services import http_clients, coach_summarizer, daily_tips, photo_renditions, gcloud_service
+from .config import settings
+from .services.gym_geo_index import gym_geo_index
 
 # Potentially, define app metadata
 app_metadata = {
@@ -13,7 +19,28 @@ app_metadata = {
     # Add other metadata like contact, license_info if desired
 }
 
-app = FastAPI(**app_metadata)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Rebuild the in-memory Bloom filter of revoked token IDs from the persistent table
+    revocation.rebuild_revocation_filter()
+    # Rotated refresh tokens are kept for reuse detection only until they expire
+    crud.purge_expired_refresh_tokens_db()
+    # Spatial index of registered gyms for /gyms/around-you
+    gym_geo_index.rebuild(crud.get_all_gyms_db())
+    # Warm, pooled outbound HTTP clients shared by all requests
+    await http_clients.startup()
+    # Nightly personalised tips (resumes today's run from its checkpoint if it was interrupted)
+    daily_tips_task = asyncio.create_task(daily_tips.daily_tips_scheduler()) if settings.DAILY_TIPS_ENABLED else None
+    yield
+    if daily_tips_task:
+        daily_tips_task.cancel()
+    await coach_summarizer.drain() # Let in-flight session summaries finish before closing clients
+    await photo_renditions.drain()
+    photo_renditions.shutdown()
+    await gcloud_service.drain() # Background Places searches need the shared HTTP client
+    await http_clients.shutdown()
+
+app = FastAPI(**app_metadata, lifespan=lifespan)
 
 # CORS (Cross-Origin Resource Sharing) Middleware
 # Allow all origins for development. For production, restrict this to your frontend domain(s).
@@ -60,6 +87,7 @@ app.include_router(gyms_router.router)
 app.include_router(activity_teams_router.router)
 app.include_router(leaderboard_router.router)
 app.include_router(ai_coach_router.router)
+app.include_router(metrics_router.router)
 
 @app.get("/", tags=["Root"])
 async def read_root():
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, HttpUrl, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime, date
 import uuid
 
@@ -46,7 +46,8 @@ class Gym(BaseModel):
     genders_accepted: Optional[List[str]] = Field(default_factory=list) # e.g., ["Male", "Female", "Unisex"]
     subscriptions: List[Subscription] = Field(default_factory=list)
     services: List[str] = Field(default_factory=list)
-    # geo_coordinates: Optional[Tuple[float, float]] = None # (latitude, longitude) for GCloud
+    latitude: Optional[float] = None # Used by the local "around you" geo index
+    longitude: Optional[float] = None
 
 class GroupActivityTeam(BaseModel):
     team_id: str = Field(default_factory=default_uuid)
@@ -62,8 +63,9 @@ class GroupActivityTeam(BaseModel):
     current_players_count: int = 0
     players_enrolled: List[str] = Field(default_factory=list) # List of user_ids
     status: str = "active"  # e.g., "active", "filled", "cancelled"
-    photo_base64: Optional[str] = None # Base64 encoded photo data
-    # photo_url: Optional[HttpUrl] = None # URL to the photo, if uploaded to a service
+    photo_base64: Optional[str] = None # Accepted on create only: stored as a file and replaced by photo_url
+    photo_url: Optional[str] = None # e.g. /static/uploads/team_photos/<file>, served by StaticFiles
+    photo_renditions: Dict[str, str] = Field(default_factory=dict) # "thumb"/"card"/"full" -> URL, once rendered
 
 # For TinyDB, we might not need explicit "Table" models if we use Pydantic for validation
 # and structure within the list of documents each table holds. 
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""
+In-process token-bucket rate limiting for expensive endpoints.
+
+Each limiter keeps one bucket per key (client IP, email, user_id) in an OrderedDict used
+as an LRU: a bucket is just [tokens, last_refill_timestamp], and the least recently seen
+keys are evicted once `max_keys` is reached, so memory stays bounded under key churn.
+An evicted key simply starts again with a full bucket.
+
+See backend/benchmarks/bench_rate_limiter.py for the per-check overhead.
+"""
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from fastapi import HTTPException, Request, status
+
+from .config import settings
+
+
+class TokenBucketLimiter:
+    def __init__(self, name: str, capacity: int, refill_per_second: float, max_keys: int = 10000):
+        self.name = name
+        self.capacity = float(capacity)
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def hit(self, key: str, cost: float = 1.0) -> float:
+        """Consumes `cost` tokens for `key`. Returns 0.0 if allowed, else seconds until it would be."""
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = [self.capacity, now]
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill_per_second)
+            bucket[1] = now
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+        return (cost - bucket[0]) / self.refill_per_second
+
+    def reset(self) -> None:
+        self.buckets.clear()
+
+
+def per_minute(name: str, requests_per_minute: int, max_keys: int = 10000) -> TokenBucketLimiter:
+    """A limiter allowing bursts of `requests_per_minute`, refilled evenly over a minute."""
+    return TokenBucketLimiter(name, capacity=requests_per_minute, refill_per_second=requests_per_minute / 60.0, max_keys=max_keys)
+
+
+login_email_limiter = per_minute("login_email", settings.RATE_LIMIT_LOGIN_PER_MINUTE)
+login_ip_limiter = per_minute("login_ip", settings.RATE_LIMIT_LOGIN_IP_PER_MINUTE)
+verify_2fa_limiter = per_minute("verify_2fa_email", settings.RATE_LIMIT_2FA_PER_MINUTE)
+ai_coach_limiter = per_minute("ai_coach_user", settings.RATE_LIMIT_AI_COACH_PER_MINUTE)
+
+limiters: Dict[str, TokenBucketLimiter] = {
+    limiter.name: limiter
+    for limiter in (login_email_limiter, login_ip_limiter, verify_2fa_limiter, ai_coach_limiter)
+}
+
+
+def enforce_rate_limit(limiter: TokenBucketLimiter, key: str) -> None:
+    """Raises 429 with a Retry-After header if `key` has exhausted its budget."""
+    retry_after = limiter.hit(key)
+    if retry_after > 0:
+        print(f"Rate limit '{limiter.name}' exceeded for key {key}. Retry after {retry_after:.1f}s.")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests. Please try again later.",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+def client_ip(request: Request) -> str:
+    """The address per-IP limits are keyed on.
+
+    X-Forwarded-For is only honoured when the direct peer is one of RATE_LIMIT_TRUSTED_PROXIES;
+    the right-most entry not added by a trusted proxy is the client (entries further left are
+    client-supplied and can be spoofed). Without trusted proxies the peer address is used as is.
+    """
+    peer = request.client.host if request.client else "unknown"
+    trusted = {proxy.strip() for proxy in settings.RATE_LIMIT_TRUSTED_PROXIES.split(",") if proxy.strip()}
+    if peer not in trusted:
+        return peer
+    forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(forwarded):
+        if hop not in trusted:
+            return hop
+    return forwarded[0] if forwarded else peer
+
+
+def reset_rate_limiters() -> None:
+    for limiter in limiters.values():
+        limiter.reset()
@@ -0,0 +1,79 @@
+"""
+Token revocation for logout and password reset.
+
+Revoked token IDs (jti) are persisted in the `revoked_tokens` table. Every authenticated
+request would otherwise pay a table lookup, so the table is fronted by an in-memory Bloom
+filter: a token that is not in the filter is definitely not revoked (a few hash operations,
+no I/O). Only filter hits, i.e. revoked tokens and rare false positives, consult the table.
+The filter is rebuilt from the table on startup (and lazily on first use).
+"""
+import hashlib
+import math
+from datetime import datetime
+from typing import Iterable, Optional
+
+from . import crud, auth
+
+REVOCATION_FILTER_CAPACITY = 10000 # Expected revoked tokens alive at once; the filter doubles when exceeded
+REVOCATION_FILTER_ERROR_RATE = 0.001 # Target false-positive rate (a false positive costs one table lookup)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings using double hashing of a single blake2b digest."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size_bits = max(8, math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.size_bits / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> Iterable[int]:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size_bits for i in range(self.num_hashes))
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+revocation_filter: Optional[BloomFilter] = None
+
+def rebuild_revocation_filter() -> BloomFilter:
+    """Reloads all live revoked jtis from the table into a freshly sized filter."""
+    global revocation_filter
+    revoked_ids = crud.get_all_revoked_token_ids_db()
+    capacity = REVOCATION_FILTER_CAPACITY
+    while capacity < len(revoked_ids) * 2:
+        capacity *= 2
+    new_filter = BloomFilter(capacity=capacity, error_rate=REVOCATION_FILTER_ERROR_RATE)
+    for jti in revoked_ids:
+        new_filter.add(jti)
+    revocation_filter = new_filter
+    return new_filter
+
+def _get_filter() -> BloomFilter:
+    if revocation_filter is None:
+        return rebuild_revocation_filter()
+    return revocation_filter
+
+def revoke_token(jti: str, expires_at: datetime) -> None:
+    """Persists a revoked jti (kept until the token would have expired anyway) and adds it to the filter."""
+    crud.add_revoked_token_db(jti=jti, expires_at=expires_at)
+    bloom = _get_filter()
+    bloom.add(jti)
+    auth.invalidate_cached_token_jti(jti)
+    if bloom.count > bloom.capacity: # Keep the false-positive rate near target as revocations accumulate
+        rebuild_revocation_filter()
+
+def is_token_revoked(jti: str) -> bool:
+    if jti not in _get_filter():
+        return False
+    return crud.is_token_revoked_db(jti)
@@ -1,41 +1,28 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
 from typing import List, Optional
-import shutil
-import uuid
-import os
 
 from .. import crud, schemas, models
 from ..dependencies import get_current_active_user
+from ..services import photo_storage, photo_renditions
 
 router = APIRouter(
     prefix="/api/v1/activity-teams",
     tags=["Group Activity Teams"]
 )
 
-# Define the upload directory path
-UPLOAD_DIR = "backend/static/uploads/team_photos"
-# Ensure the UPLOAD_DIR exists (though we created it via terminal, good to have here too)
-# os.makedirs(UPLOAD_DIR, exist_ok=True) # This would be an issue if backend/static doesn't exist first
-
-# Helper for photo: Saves photo to local static dir and returns relative URL.
+# Helper for photo: Streams the photo into backend/static/uploads/team_photos and returns its file name.
 async def save_team_photo(photo: UploadFile) -> Optional[str]:
     if photo and photo.filename:
-        # Create a unique filename to prevent collisions and handle non-standard filenames
-        _, extension = os.path.splitext(photo.filename)
-        unique_filename = f"{uuid.uuid4()}{extension}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-        
         try:
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(photo.file, buffer)
-            # Return a relative URL that can be served by StaticFiles
-            return f"/static/uploads/team_photos/{unique_filename}"
-        except Exception as e:
+            filename = await photo_storage.save_upload(photo)
+        except photo_storage.PhotoTooLarge as e:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+        except photo_storage.UnsupportedPhotoType as e:
+            raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+        except OSError as e:
             print(f"Error saving photo: {e}")
-            # Optionally raise an HTTPException or handle error appropriately
             return None
-        finally:
-            photo.file.close() # Ensure the file is closed
+        return filename
     return None
 
 @router.post("/", response_model=schemas.GroupActivityTeamResponse, status_code=status.HTTP_201_CREATED)
@@ -70,25 +57,28 @@ async def create_activity_team(
     except Exception as e: # Catch Pydantic validation error for date_and_time etc.
         raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid form data: {e}")
 
-    photo_url_str = None
+    photo_filename = None
     if photo:
-        photo_url_str = await save_team_photo(photo)
-        if not photo_url_str: # Handle save failure
+        photo_filename = await save_team_photo(photo)
+        if not photo_filename: # Handle save failure
             print("Warning: Photo upload was provided but failed to save.")
             # Decide if this should be a critical error or just a warning
 
+    # No await from here until the team (and its photo reference) is stored: see photo_storage
     team_model_data = models.GroupActivityTeam(
         **team_create_data.model_dump(),
         lister_id=current_user.user_id,
         status="active", # Default status
         current_players_count=0,
         players_enrolled=[],
-        photo_url=photo_url_str
+        photo_url=photo_storage.photo_url(photo_filename) if photo_filename else None
     )
     
     created_team = crud.create_group_activity_team_db(team_data=team_model_data)
     if not created_team:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not create activity team.")
+    if photo_filename:
+        photo_renditions.schedule_renditions(created_team.team_id, photo_filename) # Fills photo_renditions later
     return created_team
 
 @router.put("/{team_id}", response_model=schemas.GroupActivityTeamResponse)
@@ -140,6 +130,9 @@ async def delete_activity_team(
         # So the 404 above handles if team not found first.
         # If found, and still fails, it means lister_id was wrong.
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to delete this team or team not found.")
+    photo_filename = photo_storage.filename_from_url(team.photo_url)
+    if photo_filename and crud.get_photo_ref_count_db(photo_filename) == 0:
+        await photo_storage.collect_photo(photo_filename) # Last team using this photo: garbage-collect it
     return # FastAPI handles 204 No Content response automatically
 
 @router.get("/", response_model=List[schemas.GroupActivityTeamResponse])
@@ -1,11 +1,19 @@
-from typing import List, Dict
+import json
+from typing import AsyncIterator, Callable, List, Dict, Optional, Tuple
 
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 from ..dependencies import get_current_active_user
-from .. import models, crud
-from ..services.ai_coach_service import get_ai_coach_response
+from .. import models, crud, rate_limiter
+from ..config import settings
+from ..services.ai_coach_service import get_ai_coach_response, stream_ai_coach_response, FALLBACK_REPLY
+from ..services.coach_sessions import coach_sessions, CoachSession
+from ..services.coach_context import build_coach_messages
+from ..services.fallback_coach import fallback_reply
+from ..services import coach_summarizer
+from ..services.llm_admission import AdmissionRejected
 
 router = APIRouter(
     prefix="/api/v1/ai-coach",
@@ -14,6 +22,7 @@ router = APIRouter(
 
 MAX_TURNS = 10  # user+assistant pairs
 MAX_MSG_CHARS = 50000
+BUSY_DETAIL = "The AI coach is busy right now. Please try again in a moment."
 
 class ChatMessage(BaseModel):
     role: str = Field(..., pattern="^(user|assistant)$")
@@ -21,50 +30,188 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     messages: List[ChatMessage] = Field(..., max_items=MAX_TURNS * 2)
+    use_cache: bool = True # False skips the response cache and always asks the model
 
 class ChatResponse(BaseModel):
     assistant_response: str
 
+class SessionMessageRequest(BaseModel):
+    content: str = Field(..., min_length=1, max_length=MAX_MSG_CHARS)
+    use_cache: bool = True
+
+class DailyTipResponse(BaseModel):
+    date: str # ISO date the tip was generated for
+    tip: str
+
+class SessionCreatedResponse(BaseModel):
+    session_id: str
+
+class SessionResponse(BaseModel):
+    session_id: str
+    summary: str = "" # Earlier turns folded out of `messages`, if summarizing is enabled
+    messages: List[ChatMessage]
+
+def _sse_event(data: Dict, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _shared_profile(use_cache: bool) -> bool:
+    """Whether the prompt carries the coarse shared profile (opt-in via AI_COACH_CACHE_SHARED_PROFILE)."""
+    return use_cache and settings.AI_COACH_CACHE_SHARED_PROFILE
+
+async def _coach_reply(messages: List[Dict[str, str]], use_cache: bool, current_user: models.User) -> Tuple[str, bool]:
+    """
+    get_ai_coach_response with the local rule-based coach as fallback, also for admission
+    rejections unless AI_COACH_FALLBACK_MODE is "off" (then 503 + Retry-After).
+    Returns (reply, whether it was answered locally).
+    """
+    local_replies = []
+
+    def answer_locally() -> str:
+        local_replies.append(fallback_reply(current_user, messages[-1]["content"]))
+        return local_replies[-1]
+
+    try:
+        reply = await get_ai_coach_response(
+            messages=messages, use_cache=use_cache, user_id=current_user.user_id, fallback=answer_locally,
+        )
+    except AdmissionRejected as exc:
+        if settings.AI_COACH_FALLBACK_MODE != "off":
+            return answer_locally(), True
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=BUSY_DETAIL,
+            headers={"Retry-After": str(max(1, int(exc.retry_after_seconds)))},
+        )
+    return reply, bool(local_replies)
+
+def _stream_reply(
+    messages: List[Dict[str, str]], use_cache: bool, user_id: str,
+    on_complete: Optional[Callable[[str], None]] = None,
+) -> StreamingResponse:
+    """SSE response relaying the reply's deltas. `on_complete` receives the full reply if the stream finished."""
+
+    async def events() -> AsyncIterator[str]:
+        reply_parts = [] if on_complete else None
+        try:
+            async for delta in stream_ai_coach_response(messages=messages, use_cache=use_cache, user_id=user_id):
+                if reply_parts is not None:
+                    reply_parts.append(delta)
+                yield _sse_event({"delta": delta})
+        except AdmissionRejected:
+            yield _sse_event({"detail": BUSY_DETAIL}, event="error")
+            return
+        except Exception as exc:
+            print(f"AI coach stream failed: {exc}")
+            yield _sse_event({"detail": FALLBACK_REPLY}, event="error")
+            return
+        if on_complete:
+            on_complete("".join(reply_parts))
+        yield _sse_event({}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, # Don't let proxies buffer the stream
+    )
+
+def _get_session_or_404(session_id: str, current_user: models.User) -> CoachSession:
+    session = coach_sessions.get(session_id, current_user.user_id)
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found or expired")
+    return session
+
 @router.post("/", response_model=ChatResponse)
 async def chat_with_ai(
     payload: ChatRequest,
     current_user: models.User = Depends(get_current_active_user),
 ):
     """Return an AI-generated reply based on the conversation so far plus user context."""
-    # Enforce turn limit (client should also trim but server double-checks)
-    if len(payload.messages) > MAX_TURNS * 2:
-        payload.messages = payload.messages[-MAX_TURNS * 2 :]
-
-    # Build dynamic user context
-    context_fragments = []
-    context_fragments.append(f"User name: {current_user.name}")
-    if current_user.age:
-        context_fragments.append(f"Age: {current_user.age}")
-    if current_user.gender:
-        context_fragments.append(f"Gender: {current_user.gender}")
-    if current_user.fitness_goals:
-        context_fragments.append(f"Goals: {', '.join(current_user.fitness_goals)}")
-
-    # Totals from activity logs
-    running_km = sum(a.value for a in current_user.tracked_activities if a.activity_type == "running")
-    steps = sum(a.value for a in current_user.tracked_activities if a.activity_type == "steps")
-    gym_minutes = sum(a.value for a in current_user.tracked_activities if a.activity_type == "gym_time")
-    context_fragments.append(f"Lifetime running km: {running_km:.1f}")
-    context_fragments.append(f"Lifetime steps: {int(steps)}")
-    context_fragments.append(f"Lifetime gym minutes: {int(gym_minutes)}")
-
-    system_prompt = (
-        "You are an AI personal coach specialising in sports, nutrition and gym training. "
-        "When the user's last message is written mainly in Arabic characters, respond in Arabic; otherwise respond in English. "
-        "Ask the user at most 2 clarifying questions before giving advice; Only if the user's message is sports related. "
-        "If the user's message is not about his/her personal information (name,age,gender,goals) or sports related, DO NOT answer the question, just say 'I'm here to help with sports and fitness questions only.' "
-        "Always keep answers clear and concise (≤50 words) and feel free to use basic Markdown (lists, **bold**, etc.) to structure the reply. "
-        "If advice could be unsafe, ask clarifying questions first.\n\n" + "\n".join(context_fragments)
-    )
+    rate_limiter.enforce_rate_limit(rate_limiter.ai_coach_limiter, current_user.user_id)
+
+    messages = build_coach_messages(current_user, [m.model_dump() for m in payload.messages], shared=_shared_profile(payload.use_cache))
+    assistant_reply, _ = await _coach_reply(messages, payload.use_cache, current_user)
+    return ChatResponse(assistant_response=assistant_reply)
+
+@router.post("/stream")
+async def stream_chat_with_ai(
+    payload: ChatRequest,
+    current_user: models.User = Depends(get_current_active_user),
+):
+    """
+    Same as POST /ai-coach/ but streams the reply as Server-Sent Events while DeepSeek generates it:
+    `data: {"delta": "..."}` per chunk, then `event: done`. If the upstream fails or the coach
+    is too busy to admit the call, an `event: error` with a user-facing message is sent instead of `done`.
+    """
+    rate_limiter.enforce_rate_limit(rate_limiter.ai_coach_limiter, current_user.user_id)
+
+    messages = build_coach_messages(current_user, [m.model_dump() for m in payload.messages], shared=_shared_profile(payload.use_cache))
+    return _stream_reply(messages, use_cache=payload.use_cache, user_id=current_user.user_id)
+
+@router.get("/daily-tip", response_model=DailyTipResponse)
+async def get_daily_tip(current_user: models.User = Depends(get_current_active_user)):
+    """Return the user's most recent tip from the nightly batch job (no LLM call)."""
+    tip = crud.get_latest_daily_tip_db(current_user.user_id)
+    if tip is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No daily tip has been generated yet")
+    return DailyTipResponse(date=tip["date"], tip=tip["tip"])
+
+# --- Server-side sessions: the client sends only its new message each turn ---
+
+def _session_prompt(current_user: models.User, session: CoachSession, content: str, use_cache: bool) -> List[Dict[str, str]]:
+    history = session.history() + [{"role": "user", "content": content}]
+    return build_coach_messages(current_user, history, session.summary, shared=_shared_profile(use_cache))
+
+def _record_turn(session: CoachSession, content: str, reply: str) -> None:
+    coach_sessions.append_turn(session, content, reply)
+    coach_summarizer.schedule_summary(session) # Folds older turns in the background when enabled
+
+@router.post("/sessions", response_model=SessionCreatedResponse, status_code=status.HTTP_201_CREATED)
+async def create_chat_session(current_user: models.User = Depends(get_current_active_user)):
+    """Start a chat session whose history is kept on the server."""
+    rate_limiter.enforce_rate_limit(rate_limiter.ai_coach_limiter, current_user.user_id)
+    session = coach_sessions.create(current_user.user_id)
+    return SessionCreatedResponse(session_id=session.session_id)
 
-    messages: List[Dict[str, str]] = [
-        {"role": "system", "content": system_prompt}
-    ] + [m.model_dump() for m in payload.messages][-MAX_TURNS * 2 :]
+@router.get("/sessions/{session_id}", response_model=SessionResponse)
+async def get_chat_session(session_id: str, current_user: models.User = Depends(get_current_active_user)):
+    """Return the turns the server still holds for a session (the last MAX_TURNS pairs)."""
+    session = _get_session_or_404(session_id, current_user)
+    return SessionResponse(session_id=session.session_id, summary=session.summary, messages=session.history())
+
+@router.delete("/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_chat_session(session_id: str, current_user: models.User = Depends(get_current_active_user)):
+    if not coach_sessions.delete(session_id, current_user.user_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found or expired")
+
+@router.post("/sessions/{session_id}/messages", response_model=ChatResponse)
+async def send_session_message(
+    session_id: str,
+    payload: SessionMessageRequest,
+    current_user: models.User = Depends(get_current_active_user),
+):
+    """Add a user message to the session and return the coach's reply. Turns the model did not answer are not stored."""
+    rate_limiter.enforce_rate_limit(rate_limiter.ai_coach_limiter, current_user.user_id)
+    session = _get_session_or_404(session_id, current_user)
+
+    messages = _session_prompt(current_user, session, payload.content, payload.use_cache)
+    assistant_reply, answered_locally = await _coach_reply(messages, payload.use_cache, current_user)
+    if not answered_locally:
+        _record_turn(session, payload.content, assistant_reply)
+    return ChatResponse(assistant_response=assistant_reply)
+
+@router.post("/sessions/{session_id}/messages/stream")
+async def stream_session_message(
+    session_id: str,
+    payload: SessionMessageRequest,
+    current_user: models.User = Depends(get_current_active_user),
+):
+    """Streaming variant of POST /sessions/{session_id}/messages (same SSE events as /ai-coach/stream)."""
+    rate_limiter.enforce_rate_limit(rate_limiter.ai_coach_limiter, current_user.user_id)
+    session = _get_session_or_404(session_id, current_user)
 
-    assistant_reply = await get_ai_coach_response(messages=messages)
-    return ChatResponse(assistant_response=assistant_reply) 
\ No newline at end of file
+    messages = _session_prompt(current_user, session, payload.content, payload.use_cache)
+    return _stream_reply(
+        messages, use_cache=payload.use_cache, user_id=current_user.user_id,
+        on_complete=lambda reply: _record_turn(session, payload.content, reply),
+    ) 
\ No newline at end of file
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, HTTPException, status, BackgroundTasks, Body
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Body, Request
 from pydantic import EmailStr, BaseModel # BaseModel for local schemas
 from typing import Optional
-from datetime import timedelta 
+from datetime import datetime, timedelta, timezone
+import uuid
 
-from .. import crud, schemas, auth
+from .. import crud, schemas, auth, models, revocation, rate_limiter
+from ..dependencies import oauth2_scheme, get_current_active_user
 from ..services import email_service
 from ..config import settings
 
@@ -17,6 +19,9 @@ router = APIRouter(
 # class PasswordResetConfirmPayload(BaseModel):
 #     new_password: str
 
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
 class SignupResponse(BaseModel):
     user_id: str
     email: EmailStr
@@ -73,8 +78,13 @@ async def signup(user_data: schemas.UserCreate):
 @router.post("/login", response_model=schemas.MessageResponse) # Changed response model
 async def login_for_2fa_email_code(
     form_data: schemas.TwoFALoginRequest, 
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    request: Request,
 ):
+    # Throttle before bcrypt and the outbound email
+    rate_limiter.enforce_rate_limit(rate_limiter.login_ip_limiter, rate_limiter.client_ip(request))
+    rate_limiter.enforce_rate_limit(rate_limiter.login_email_limiter, form_data.email.lower())
+
     user = crud.get_user_by_email(email=form_data.email)
     if not user or not auth.verify_password(form_data.password, user.hashed_password):
         print(f"Login failed: Incorrect email or password for {form_data.email}")
@@ -100,6 +110,7 @@ async def login_for_2fa_email_code(
 
 @router.post("/verify-2fa-code", response_model=schemas.Token) # Renamed endpoint, accepts code in body
 async def verify_2fa_login_code(payload: schemas.VerifyCodeRequest = Body(...)):
+    rate_limiter.enforce_rate_limit(rate_limiter.verify_2fa_limiter, payload.email.lower()) # Also caps 6-digit code guessing
     is_valid_code = auth.verify_stored_code(email=payload.email, code=payload.code, expected_type="2fa_login_code")
     if not is_valid_code:
         print(f"2FA code verification failed for {payload.email}.")
@@ -116,11 +127,71 @@ async def verify_2fa_login_code(payload: schemas.VerifyCodeRequest = Body(...)):
             detail="User not found after code verification.",
         )
 
+    return _issue_token_pair(user.email)
+
+
+def _issue_token_pair(email: str) -> schemas.Token:
+    """Issues a fresh access token plus a rotating refresh token and records the refresh jti."""
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_jti = uuid.uuid4().hex
     access_token = auth.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": email, "jti": access_jti}, expires_delta=access_token_expires
     )
-    return schemas.Token(access_token=access_token, token_type="bearer")
+    refresh = auth.create_refresh_token(email=email)
+    crud.create_refresh_token_record_db(
+        jti=refresh["jti"], email=email, expires_at=refresh["expires_at"],
+        access_jti=access_jti, access_expires_at=datetime.now(timezone.utc) + access_token_expires,
+    )
+    return schemas.Token(access_token=access_token, token_type="bearer", refresh_token=refresh["token"])
+
+
+@router.post("/refresh", response_model=schemas.Token)
+async def refresh_access_token(payload: schemas.RefreshTokenRequest = Body(...)):
+    """Exchange a refresh token for a new access/refresh pair without repeating password + 2FA."""
+    invalid_refresh_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid or expired refresh token.",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    token_payload = auth.decode_refresh_token(payload.refresh_token)
+    if token_payload is None:
+        raise invalid_refresh_exception
+
+    email = token_payload["sub"]
+    record = crud.get_refresh_token_record_db(jti=token_payload["jti"])
+    if record is None or record["email"] != email:
+        raise invalid_refresh_exception
+
+    # Rotation: each refresh token is single-use. Presenting a rotated token again means it
+    # leaked, so the whole family for that user is revoked and the client must log in again.
+    if record["rotated"] or not crud.mark_refresh_token_rotated_db(jti=token_payload["jti"]):
+        print(f"Refresh token reuse detected for {email}. Revoking all refresh tokens.")
+        crud.revoke_refresh_tokens_for_user_db(email=email)
+        raise invalid_refresh_exception
+
+    return _issue_token_pair(email)
+
+
+@router.post("/logout", response_model=schemas.MessageResponse)
+async def logout(
+    payload: Optional[LogoutRequest] = Body(None),
+    token: str = Depends(oauth2_scheme),
+    current_user: models.User = Depends(get_current_active_user),
+):
+    """Revoke the presented access token and, if supplied, its refresh token."""
+    claims = auth.get_token_claims(token)
+    if claims and claims.get("jti"):
+        revocation.revoke_token(
+            jti=claims["jti"],
+            expires_at=datetime.fromtimestamp(claims["exp"], tz=timezone.utc),
+        )
+
+    if payload and payload.refresh_token:
+        refresh_claims = auth.decode_refresh_token(payload.refresh_token)
+        if refresh_claims and refresh_claims["sub"] == current_user.email:
+            crud.delete_refresh_token_record_db(jti=refresh_claims["jti"])
+
+    return schemas.MessageResponse(message="Logged out successfully.")
 
 
 @router.post("/request-password-reset", response_model=schemas.MessageResponse)
@@ -177,6 +248,16 @@ async def confirm_password_reset_with_code(
             detail="Could not update password."
         )
     
+    # Existing sessions must log in again with the new password: drop their refresh
+    # tokens and revoke every access token that was issued alongside them.
+    for record in crud.revoke_refresh_tokens_for_user_db(email=user.email):
+        access_expires_at = record.get("access_expires_at")
+        if record.get("access_jti") and access_expires_at:
+            if isinstance(access_expires_at, str):
+                access_expires_at = datetime.fromisoformat(access_expires_at)
+            if access_expires_at > datetime.now(timezone.utc):
+                revocation.revoke_token(jti=record["access_jti"], expires_at=access_expires_at)
+
     # Optionally, clear the code from the store after successful reset
     if payload.email in auth.temp_code_store and auth.temp_code_store[payload.email]["type"] == "password_reset_code":
         del auth.temp_code_store[payload.email]
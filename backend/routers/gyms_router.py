@@ -27,7 +27,8 @@ async def find_gyms_around_you(
     # current_user: models.User = Depends(get_current_active_user) # If this needs to be protected
 ):
     """
-    Find gyms near the user's provided latitude and longitude using GCloud (mocked).
+    Find gyms near the user's provided latitude and longitude.
+    Registered gyms come from the local geo index; Google Places adds unregistered venues.
     Returns a list of gyms with their details and distance.
     """
     if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
@@ -55,9 +56,12 @@ async def find_gyms_around_you(
     
     response_gyms = []
     for gym_data in nearby_gym_data_list:
-        # Assuming gym_data is a dict that can initialize GymNearbyResponse
+        # The service returns GymNearbyResponse objects; plain dicts (e.g. from mocks) are parsed.
         # This includes fields from GymCreate, gym_id, and distance.
-        response_gyms.append(schemas.GymNearbyResponse(**gym_data))
+        if isinstance(gym_data, schemas.GymNearbyResponse):
+            response_gyms.append(gym_data)
+        else:
+            response_gyms.append(schemas.GymNearbyResponse(**gym_data))
         
     return response_gyms
 
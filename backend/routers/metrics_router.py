@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+from typing import Any, Dict
+
+from ..services import places_cache, gcloud_service, ai_coach_service, photo_storage
+from ..services.coach_sessions import coach_sessions
+from ..services.coach_response_cache import coach_response_cache
+from ..services.llm_admission import llm_admission
+
+router = APIRouter(
+    prefix="/api/v1/metrics",
+    tags=["Metrics"],
+)
+
+@router.get("/", response_model=Dict[str, Any])
+async def get_metrics():
+    """Runtime counters for in-process caches and upstream protection."""
+    return {
+        "places_cache": places_cache.places_cache.stats(),
+        "single_flight": {
+            flight.name: flight.stats()
+            for flight in (gcloud_service.places_flight, ai_coach_service.completion_flight)
+        },
+        "coach_sessions": coach_sessions.stats(),
+        "coach_response_cache": coach_response_cache.stats(),
+        "llm_admission": llm_admission.stats(),
+        "photo_store": photo_storage.stats(),
+        "circuit_breakers": {
+            gcloud_service.places_breaker.name: gcloud_service.places_breaker.stats(),
+        },
+    }
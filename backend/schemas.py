@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, HttpUrl
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime, date
 from .models import ActivityLog, Subscription # Import base structures from models
 
@@ -46,6 +46,10 @@ class UserProfileEdit(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     email: Optional[str] = None
@@ -79,6 +83,8 @@ class GymCreate(BaseModel):
     genders_accepted: Optional[List[str]] = []
     subscriptions: Optional[List[Subscription]] = []
     services: Optional[List[str]] = []
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
 class GymResponse(GymCreate):
     gym_id: str
@@ -122,7 +128,8 @@ class GroupActivityTeamResponse(GroupActivityTeamCreate):
     current_players_count: int
     players_enrolled: List[str] = []
     status: str
-    photo_url: Optional[HttpUrl] = None
+    photo_url: Optional[str] = None # Relative /static/... URL for uploaded photos
+    photo_renditions: Dict[str, str] = {} # Resized copies (thumb/card/full); empty until rendered
 
     class Config:
         from_attributes = True
@@ -1,39 +1,165 @@
 from __future__ import annotations
 
-import httpx
-from typing import List, Dict
+import asyncio
+import hashlib
+import json
+from typing import AsyncIterator, Awaitable, Callable, List, Dict, Optional
 from ..config import settings
+from . import http_clients
+from .single_flight import SingleFlight
+from .coach_response_cache import coach_response_cache, response_cache_key
+from .llm_admission import llm_admission, AdmissionRejected
 
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"  # Example; adjust if different
+FALLBACK_REPLY = "Sorry, I couldn't process that right now. Please try again later."
 
-async def get_ai_coach_response(messages: List[Dict[str, str]]) -> str:
-    """Send chat messages to DeepSeek and return the assistant's reply.
+# Identical payloads in flight at the same time (double submits, retries) share one completion
+completion_flight = SingleFlight("deepseek")
 
-    Args:
-        messages: OpenAI-compatible chat messages, each with keys ``role`` and ``content``.
+ANONYMOUS_USER = "anonymous" # Admission queue key for calls made without a user
 
-    Returns:
-        Assistant reply text. Falls back to a generic error string if request fails.
-    """
-    headers = {
+def payload_key(payload: Dict) -> str:
+    """Canonical hash of a chat completion payload."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _headers() -> Dict[str, str]:
+    return {
         "Authorization": f"Bearer {settings.DEEPSEEK_API_KEY}",
         "Content-Type": "application/json",
     }
 
-    payload = {
+def _payload(messages: List[Dict[str, str]]) -> Dict:
+    return {
         "model": "deepseek-chat",  # DeepSeek supports the OpenAI schema; change if required
         "messages": messages,
         "temperature": 0.6,
         "max_tokens": 1024,
     }
 
+async def _hedged(primary: Awaitable[str], hedge: Callable[[], Awaitable[str]]) -> str:
+    """
+    Awaits `primary`; if it has not answered within AI_COACH_HEDGE_AFTER_SECONDS, also starts
+    `hedge()` and returns whichever succeeds first. The loser is cancelled.
+    """
+    pending = {asyncio.ensure_future(primary)}
     try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            resp = await client.post(DEEPSEEK_API_URL, json=payload, headers=headers)
-            resp.raise_for_status()
-            data = resp.json()
-            return data["choices"][0]["message"]["content"].strip()
+        done, pending = await asyncio.wait(pending, timeout=settings.AI_COACH_HEDGE_AFTER_SECONDS)
+        if done:
+            return done.pop().result()
+        pending.add(asyncio.ensure_future(hedge()))
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def get_ai_coach_response(
+    messages: List[Dict[str, str]], use_cache: bool = True, user_id: Optional[str] = None,
+    background: bool = False, fallback: Optional[Callable[[], str]] = None,
+) -> str:
+    """Send chat messages to DeepSeek and return the assistant's reply.
+
+    Args:
+        messages: OpenAI-compatible chat messages, each with keys ``role`` and ``content``.
+        use_cache: Serve/store the reply from the response cache; False always asks the model.
+        user_id: Whose fair share of the LLM admission queue the upstream call uses.
+        background: Batch work: admitted only when interactive calls leave room (never rejected).
+        fallback: Local answer (see fallback_coach) used when the upstream fails or, unless
+            AI_COACH_FALLBACK_MODE is "off", misses AI_COACH_LATENCY_BUDGET_SECONDS. The
+            abandoned upstream call keeps running to fill the response cache, or is cancelled
+            (freeing its admission slot) when use_cache is False.
+
+    Returns:
+        Assistant reply text. Falls back to ``fallback()`` or ``FALLBACK_REPLY`` if the request fails.
+
+    Raises:
+        AdmissionRejected: if the LLM queue is full or the wait for a slot ran out.
+    """
+    headers = _headers()
+    payload = _payload(messages)
+    cache_key = response_cache_key(payload) if use_cache else None
+    if cache_key:
+        cached_reply = coach_response_cache.get(cache_key)
+        if cached_reply is not None:
+            return cached_reply
+
+    async def complete() -> str:
+        client = http_clients.get_client("deepseek")
+        admission = llm_admission.background_slot() if background else llm_admission.slot(user_id or ANONYMOUS_USER)
+        async with admission:
+            resp = await client.post(settings.DEEPSEEK_API_URL, json=payload, headers=headers)
+        resp.raise_for_status()
+        data = resp.json()
+        reply = data["choices"][0]["message"]["content"].strip()
+        if cache_key:
+            coach_response_cache.put(cache_key, reply)
+        return reply
+
+    mode = settings.AI_COACH_FALLBACK_MODE if fallback else "off"
+    # An uncached result is useless once every caller has given up on it: don't let it hold a slot
+    upstream = completion_flight.do(payload_key(payload), complete, keep_running=cache_key is not None)
+    if mode == "hedged":
+        upstream = _hedged(upstream, complete) # The hedge bypasses single-flight on purpose
+    try:
+        if mode == "off":
+            return await upstream
+        return await asyncio.wait_for(upstream, timeout=settings.AI_COACH_LATENCY_BUDGET_SECONDS)
+    except AdmissionRejected:
+        raise
+    except asyncio.TimeoutError:
+        print(f"AI coach request missed the {settings.AI_COACH_LATENCY_BUDGET_SECONDS}s budget; answering locally")
+        return fallback()
     except Exception as exc:
         # Log the error server-side; return user-friendly message
         print(f"AI coach request failed: {exc}")
-        return "Sorry, I couldn't process that right now. Please try again later." 
\ No newline at end of file
+        return fallback() if fallback else FALLBACK_REPLY
+
+async def stream_ai_coach_response(
+    messages: List[Dict[str, str]], use_cache: bool = True, user_id: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """Stream the assistant's reply from DeepSeek as text deltas, as they arrive.
+
+    Requests ``stream: true`` and parses the upstream's OpenAI-style SSE lines
+    (``data: {json}`` ... ``data: [DONE]``) one at a time. A cached reply is yielded as a
+    single delta; with ``use_cache`` the streamed deltas are also collected so a completed
+    reply can be cached (otherwise nothing is buffered beyond the current line).
+
+    The LLM admission slot is held for the whole stream.
+
+    Raises:
+        AdmissionRejected: if the LLM queue is full or the wait for a slot ran out.
+        httpx.HTTPError: if the upstream cannot be reached or answers with an error status.
+    """
+    payload = _payload(messages)
+    cache_key = response_cache_key(payload) if use_cache else None
+    if cache_key:
+        cached_reply = coach_response_cache.get(cache_key)
+        if cached_reply is not None:
+            yield cached_reply
+            return
+    reply_parts = [] if cache_key else None
+
+    client = http_clients.get_client("deepseek")
+    async with llm_admission.slot(user_id or ANONYMOUS_USER):
+        async with client.stream("POST", settings.DEEPSEEK_API_URL, json={**payload, "stream": True}, headers=_headers()) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue # Blank separators and SSE comments / keep-alives
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    if reply_parts is not None:
+                        reply_parts.append(delta)
+                    yield delta
+    if reply_parts:
+        coach_response_cache.put(cache_key, "".join(reply_parts).strip())
@@ -0,0 +1,123 @@
+"""
+Circuit breaker with a latency budget for upstream calls.
+
+Every call through `CircuitBreaker.call` must finish within `latency_budget_seconds`; a call
+that errors or overruns the budget counts as a failure. The breaker looks at the last
+`window_size` calls and opens once at least `min_calls` were made and the failure rate reaches
+`error_rate_threshold`. While open, calls fail immediately with CircuitOpenError so callers
+can serve a fallback (local data, stale cache) without waiting on the upstream.
+
+After `open_seconds` the breaker goes half-open and lets a single probe call through: success
+closes it, failure re-opens it for another `open_seconds`.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, TypeVar
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the circuit is open."""
+
+
+class CircuitBreaker:
+    def __init__(
+        self, name: str, latency_budget_seconds: float, window_size: int,
+        min_calls: int, error_rate_threshold: float, open_seconds: float,
+    ):
+        self.name = name
+        self.latency_budget_seconds = latency_budget_seconds
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.open_seconds = open_seconds
+        self.window: Deque[bool] = deque(maxlen=window_size) # True = failure
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def _allow(self) -> bool:
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        return False
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        print(f"Circuit breaker '{self.name}' opened for {self.open_seconds}s")
+
+    def _record(self, failed: bool) -> None:
+        if failed:
+            self.failures += 1
+        if self.state == HALF_OPEN:
+            self.probe_in_flight = False
+            if failed:
+                self._open()
+            else:
+                self.state = CLOSED
+                self.window.clear()
+            return
+        self.window.append(failed)
+        if self.state == CLOSED and len(self.window) >= self.min_calls and self.error_rate() >= self.error_rate_threshold:
+            self._open()
+
+    def error_rate(self) -> float:
+        return sum(self.window) / len(self.window) if self.window else 0.0
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """Runs fn() within the latency budget, or raises CircuitOpenError without calling it."""
+        if not self._allow():
+            self.rejected += 1
+            raise CircuitOpenError(f"Circuit '{self.name}' is open")
+        self.calls += 1
+        try:
+            result = await asyncio.wait_for(fn(), timeout=self.latency_budget_seconds)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._record(failed=True)
+            raise
+        except asyncio.CancelledError:
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = False # Let the next caller probe instead
+            raise
+        except Exception:
+            self._record(failed=True)
+            raise
+        self._record(failed=False)
+        return result
+
+    def reset(self) -> None:
+        """Closes the circuit and clears the window and counters."""
+        self.window.clear()
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.calls = self.failures = self.timeouts = self.rejected = self.times_opened = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "error_rate": round(self.error_rate(), 4),
+            "window_calls": len(self.window),
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+        }
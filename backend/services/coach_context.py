@@ -0,0 +1,133 @@
+"""
+Prompt assembly for the AI coach under a token budget.
+
+The upstream model's latency and cost grow with prompt size, so instead of trimming history
+by message count only, `build_coach_messages` packs:
+
+1. the system prompt with the user's profile context and, for long sessions, the running
+   summary of earlier turns (always sent),
+2. the newest message (always sent, truncated to AI_COACH_MAX_MESSAGE_TOKENS if oversized),
+3. as many of the preceding turns as still fit AI_COACH_CONTEXT_TOKEN_BUDGET, newest first,
+   each truncated to AI_COACH_MAX_MESSAGE_TOKENS. Packing stops at the first turn that does
+   not fit, so the history sent is always a contiguous recent window.
+
+Tokens are estimated locally (no tokenizer dependency) as UTF-8 bytes / 4, which is close
+for English and errs on the generous side for Arabic; each message also costs a small
+fixed overhead for its role/formatting.
+
+With AI_COACH_CACHE_SHARED_PROFILE enabled, turns whose reply may be cached use the shared
+form of the profile context: no name, and age and lifetime totals as ranges, so users with
+similar profiles send identical prompts and share response cache entries (a cached reply
+never carries another user's details). By default the exact profile is sent.
+"""
+import math
+from typing import Dict, List, Sequence
+
+from ..config import settings
+from .. import models
+
+BYTES_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+TRUNCATION_MARKER = " …[truncated]"
+
+# Range bounds for the shared profile context
+AGE_BOUNDS = (18, 25, 35, 45, 55, 65)
+RUNNING_KM_BOUNDS = (10, 50, 100, 250, 500, 1000)
+STEPS_BOUNDS = (10_000, 100_000, 500_000, 1_000_000, 5_000_000)
+GYM_MINUTES_BOUNDS = (60, 600, 1500, 3000, 6000)
+
+SYSTEM_PROMPT = (
+    "You are an AI personal coach specialising in sports, nutrition and gym training. "
+    "When the user's last message is written mainly in Arabic characters, respond in Arabic; otherwise respond in English. "
+    "Ask the user at most 2 clarifying questions before giving advice; Only if the user's message is sports related. "
+    "If the user's message is not about his/her personal information (name,age,gender,goals) or sports related, DO NOT answer the question, just say 'I'm here to help with sports and fitness questions only.' "
+    "Always keep answers clear and concise (≤50 words) and feel free to use basic Markdown (lists, **bold**, etc.) to structure the reply. "
+    "If advice could be unsafe, ask clarifying questions first.\n\n"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text.encode("utf-8")) / BYTES_PER_TOKEN)
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts `text` so that it (plus a truncation marker) fits `max_tokens`. Short text is returned as is."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_bytes = max(0, max_tokens * BYTES_PER_TOKEN - len(TRUNCATION_MARKER.encode("utf-8")))
+    # errors="ignore" drops a multi-byte character cut in half at the boundary
+    return text.encode("utf-8")[:max_bytes].decode("utf-8", errors="ignore") + TRUNCATION_MARKER
+
+
+def value_range(value: float, bounds: Sequence[int]) -> str:
+    """Label of the range of `bounds` that holds `value`, e.g. "10-50" or "1000+"."""
+    lower = 0
+    for upper in bounds:
+        if value < upper:
+            return f"{lower}-{upper}"
+        lower = upper
+    return f"{lower}+"
+
+
+def build_user_context(user: models.User, shared: bool = False) -> str:
+    """Profile lines for the system prompt; `shared` leaves out the name and gives ranges instead of exact numbers."""
+    context_fragments = []
+    if not shared:
+        context_fragments.append(f"User name: {user.name}")
+    if user.age:
+        context_fragments.append(f"Age: {value_range(user.age, AGE_BOUNDS) if shared else user.age}")
+    if user.gender:
+        context_fragments.append(f"Gender: {user.gender}")
+    if user.fitness_goals:
+        context_fragments.append(f"Goals: {', '.join(user.fitness_goals)}")
+
+    # Totals from activity logs
+    running_km = sum(a.value for a in user.tracked_activities if a.activity_type == "running")
+    steps = sum(a.value for a in user.tracked_activities if a.activity_type == "steps")
+    gym_minutes = sum(a.value for a in user.tracked_activities if a.activity_type == "gym_time")
+    if shared:
+        context_fragments.append(f"Lifetime running km: {value_range(running_km, RUNNING_KM_BOUNDS)}")
+        context_fragments.append(f"Lifetime steps: {value_range(steps, STEPS_BOUNDS)}")
+        context_fragments.append(f"Lifetime gym minutes: {value_range(gym_minutes, GYM_MINUTES_BOUNDS)}")
+    else:
+        context_fragments.append(f"Lifetime running km: {running_km:.1f}")
+        context_fragments.append(f"Lifetime steps: {int(steps)}")
+        context_fragments.append(f"Lifetime gym minutes: {int(gym_minutes)}")
+    return "\n".join(context_fragments)
+
+
+def pack_history(history: List[Dict[str, str]], token_budget: int, max_message_tokens: int) -> List[Dict[str, str]]:
+    """The newest messages of `history` that fit `token_budget` (the last one is always kept)."""
+    packed: List[Dict[str, str]] = []
+    used = 0
+    for position, message in enumerate(reversed(history)):
+        content = truncate_to_tokens(message["content"], max_message_tokens)
+        cost = estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        if position > 0 and used + cost > token_budget:
+            break
+        packed.append({"role": message["role"], "content": content})
+        used += cost
+    packed.reverse()
+    # Start on a user turn so the window never opens with an orphaned assistant reply
+    while len(packed) > 1 and packed[0]["role"] == "assistant":
+        packed.pop(0)
+    return packed
+
+
+def build_coach_messages(
+    user: models.User, history: List[Dict[str, str]], summary: str = "", shared: bool = False,
+) -> List[Dict[str, str]]:
+    """
+    System prompt with the user's context (and conversation summary), then the recent turns that fit the token budget.
+    Pass shared=True when the reply may be cached (see build_user_context).
+    """
+    system_content = SYSTEM_PROMPT + build_user_context(user, shared)
+    if summary:
+        system_content += "\n\nSummary of the earlier conversation:\n" + summary
+    system_message = {"role": "system", "content": system_content}
+    remaining = settings.AI_COACH_CONTEXT_TOKEN_BUDGET - message_tokens(system_message)
+    return [system_message] + pack_history(history, remaining, settings.AI_COACH_MAX_MESSAGE_TOKENS)
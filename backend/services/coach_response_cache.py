@@ -0,0 +1,84 @@
+"""
+Cache of AI coach replies for repeated prompts.
+
+Keyed on a canonical hash of everything that determines the completion: model, temperature,
+max_tokens and the messages, with whitespace in message contents normalized (stripped,
+runs collapsed) so trivially different spellings of the same prompt share an entry.
+The system prompt carries the user's profile context, so by default entries are only shared
+between requests whose profile is identical too. With AI_COACH_CACHE_SHARED_PROFILE, cacheable
+turns carry a coarse shared profile instead (no name, ranges instead of exact age and totals;
+see coach_context), so users with similar profiles and the same goals share entries.
+
+Entries expire after AI_COACH_CACHE_TTL_SECONDS and the least recently used entry is
+evicted beyond AI_COACH_CACHE_MAX_ENTRIES. Only successful replies are stored.
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from ..config import settings
+
+
+def _normalize_content(content: str) -> str:
+    return " ".join(content.split())
+
+
+def response_cache_key(payload: Dict[str, Any]) -> str:
+    canonical = {
+        "model": payload["model"],
+        "temperature": payload["temperature"],
+        "max_tokens": payload["max_tokens"],
+        "messages": [[m["role"], _normalize_content(m["content"])] for m in payload["messages"]],
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, reply: str) -> None:
+        self.entries[key] = (time.monotonic() + self.ttl_seconds, reply)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def reset(self) -> None:
+        """Clears entries and counters."""
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.entries),
+            "evictions": self.evictions,
+        }
+
+
+coach_response_cache = ResponseCache(
+    max_entries=settings.AI_COACH_CACHE_MAX_ENTRIES, ttl_seconds=settings.AI_COACH_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,107 @@
+"""
+Server-side AI coach chat sessions.
+
+Instead of resending the whole conversation every turn, a client creates a session once and
+then sends only its new message; the server keeps the history. Each session stores at most
+`max_turns` user/assistant pairs as compact (role, content) tuples in a bounded deque, so
+older turns fall off automatically. Optionally, older turns are folded into a running
+`summary` first (see coach_summarizer).
+
+Sessions live in memory, in an OrderedDict used as an LRU: idle sessions expire after
+`ttl_seconds`, and the least recently used session is evicted beyond `max_sessions`. Each
+user holds at most `max_sessions_per_user`; creating one more evicts that user's least
+recently used session, so one user cannot push everyone else's conversations out. A client
+whose session is gone gets a 404 and simply starts a new one.
+"""
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+from ..config import settings
+
+Turn = Tuple[str, str] # (role, content)
+
+
+@dataclass
+class CoachSession:
+    session_id: str
+    user_id: str
+    messages: Deque[Turn]
+    last_used: float = field(default_factory=time.monotonic)
+    summary: str = "" # Running summary of turns folded out of `messages`
+
+    def history(self) -> List[Dict[str, str]]:
+        """Messages in the OpenAI chat format, oldest first."""
+        return [{"role": role, "content": content} for role, content in self.messages]
+
+
+class CoachSessionStore:
+    def __init__(self, max_sessions: int, max_turns: int, ttl_seconds: float, max_sessions_per_user: int):
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions_per_user = max_sessions_per_user
+        self.sessions: "OrderedDict[str, CoachSession]" = OrderedDict()
+        self.user_sessions: Dict[str, "OrderedDict[str, None]"] = {} # user_id -> their session ids, LRU order
+        self.evictions = 0
+
+    def create(self, user_id: str) -> CoachSession:
+        own = self.user_sessions.get(user_id)
+        while own and len(own) >= self.max_sessions_per_user:
+            self._remove(next(iter(own)))
+            self.evictions += 1
+        session = CoachSession(session_id=uuid.uuid4().hex, user_id=user_id, messages=deque(maxlen=self.max_turns * 2))
+        self.sessions[session.session_id] = session
+        self.user_sessions.setdefault(user_id, OrderedDict())[session.session_id] = None
+        while len(self.sessions) > self.max_sessions:
+            self._remove(next(iter(self.sessions)))
+            self.evictions += 1
+        return session
+
+    def _remove(self, session_id: str) -> None:
+        session = self.sessions.pop(session_id)
+        own = self.user_sessions[session.user_id]
+        del own[session_id]
+        if not own:
+            del self.user_sessions[session.user_id]
+
+    def get(self, session_id: str, user_id: str) -> Optional[CoachSession]:
+        """The user's session, or None if it does not exist, expired, or belongs to someone else."""
+        session = self.sessions.get(session_id)
+        if session is None or session.user_id != user_id:
+            return None
+        if time.monotonic() - session.last_used > self.ttl_seconds:
+            self._remove(session_id)
+            return None
+        session.last_used = time.monotonic()
+        self.sessions.move_to_end(session_id)
+        self.user_sessions[user_id].move_to_end(session_id)
+        return session
+
+    def append_turn(self, session: CoachSession, user_message: str, assistant_reply: str) -> None:
+        session.messages.append(("user", user_message))
+        session.messages.append(("assistant", assistant_reply))
+
+    def delete(self, session_id: str, user_id: str) -> bool:
+        if self.get(session_id, user_id) is None:
+            return False
+        self._remove(session_id)
+        return True
+
+    def clear(self) -> None:
+        self.sessions.clear()
+        self.user_sessions.clear()
+        self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"sessions": len(self.sessions), "evictions": self.evictions}
+
+
+coach_sessions = CoachSessionStore(
+    max_sessions=settings.AI_COACH_MAX_SESSIONS,
+    max_turns=settings.AI_COACH_SESSION_MAX_TURNS,
+    ttl_seconds=settings.AI_COACH_SESSION_TTL_MINUTES * 60,
+    max_sessions_per_user=settings.AI_COACH_MAX_SESSIONS_PER_USER,
+)
@@ -0,0 +1,116 @@
+"""
+Rolling summaries of long AI coach sessions.
+
+Once a session holds AI_COACH_SUMMARIZE_AFTER_TURNS exchanges, a background task folds all
+but the last AI_COACH_SUMMARY_KEEP_TURNS of them into the session's running `summary` and
+drops the folded turns. The prompt then carries the summary (in the system message) plus
+only the recent turns, so its size stays roughly constant however long the chat gets,
+without forgetting what was said early on.
+
+The summarizer is pluggable via AI_COACH_SUMMARIZER:
+- "off" (default): no summaries; old turns simply fall off the bounded session history.
+- "llm": asks the coach model for the summary, in an LLM background slot (see llm_admission),
+  so summaries never take capacity from interactive chats.
+- "local": LocalStubSummarizer, a deterministic no-network summarizer for tests and dev.
+
+Summarizing never blocks a chat reply; if it fails, the raw turns are kept and folding is
+retried after the next turn.
+"""
+import asyncio
+from typing import Dict, List, Optional, Protocol, Set
+
+from ..config import settings
+from .coach_context import truncate_to_tokens
+from .coach_sessions import CoachSession
+
+SUMMARY_PROMPT = (
+    "Summarise this coaching conversation for your own future reference in at most 120 words. "
+    "Keep facts about the user (injuries, goals, schedule, equipment, preferences) and any advice already given. "
+    "Write plain sentences, no preamble."
+)
+
+
+class Summarizer(Protocol):
+    async def summarize(self, previous_summary: str, turns: List[Dict[str, str]], user_id: str) -> Optional[str]:
+        """Returns the new running summary, or None if summarizing failed."""
+        ...
+
+
+class LLMSummarizer:
+    async def summarize(self, previous_summary: str, turns: List[Dict[str, str]], user_id: str) -> Optional[str]:
+        from .ai_coach_service import get_ai_coach_response, FALLBACK_REPLY # Avoids a circular import
+
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+        if previous_summary:
+            transcript = f"Earlier summary: {previous_summary}\n\n{transcript}"
+        reply = await get_ai_coach_response(
+            [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+            use_cache=False, background=True,
+        )
+        return None if reply == FALLBACK_REPLY else reply
+
+
+class LocalStubSummarizer:
+    """Keeps the first sentence of each folded user message. Deterministic, no network."""
+
+    async def summarize(self, previous_summary: str, turns: List[Dict[str, str]], user_id: str) -> Optional[str]:
+        points = [turn["content"].split(".")[0].strip() for turn in turns if turn["role"] == "user"]
+        return " | ".join(part for part in [previous_summary, *points] if part)
+
+
+SUMMARIZERS = {"llm": LLMSummarizer, "local": LocalStubSummarizer}
+
+# Background folding tasks; referenced here so they are not garbage collected mid-run
+pending: Set[asyncio.Task] = set()
+_running_sessions: Set[str] = set()
+
+
+def get_summarizer() -> Optional[Summarizer]:
+    summarizer_class = SUMMARIZERS.get(settings.AI_COACH_SUMMARIZER)
+    return summarizer_class() if summarizer_class else None
+
+
+async def fold_old_turns(session: CoachSession, summarizer: Summarizer) -> bool:
+    """Folds all but the most recent AI_COACH_SUMMARY_KEEP_TURNS exchanges into session.summary."""
+    keep_messages = settings.AI_COACH_SUMMARY_KEEP_TURNS * 2
+    to_fold = list(session.messages)[:-keep_messages] if keep_messages else list(session.messages)
+    if not to_fold:
+        return False
+    turns = [{"role": role, "content": content} for role, content in to_fold]
+    summary = await summarizer.summarize(session.summary, turns, session.user_id)
+    if not summary:
+        return False
+    session.summary = truncate_to_tokens(summary, settings.AI_COACH_SUMMARY_MAX_TOKENS)
+    # New turns may have been appended meanwhile; the folded ones are still the oldest
+    for turn in to_fold:
+        if session.messages and session.messages[0] is turn:
+            session.messages.popleft()
+    return True
+
+
+def schedule_summary(session: CoachSession) -> None:
+    """Starts folding in the background once the session is long enough (no-op when disabled)."""
+    summarizer = get_summarizer()
+    if summarizer is None or session.session_id in _running_sessions:
+        return
+    if len(session.messages) < settings.AI_COACH_SUMMARIZE_AFTER_TURNS * 2:
+        return
+
+    async def run() -> None:
+        try:
+            await fold_old_turns(session, summarizer)
+        except Exception as exc:
+            print(f"AI coach summary failed for session {session.session_id}: {exc}")
+        finally:
+            _running_sessions.discard(session.session_id)
+
+    _running_sessions.add(session.session_id)
+    task = asyncio.get_running_loop().create_task(run())
+    pending.add(task)
+    task.add_done_callback(pending.discard)
+
+
+async def drain() -> None:
+    """Waits for every running summary task (tests, shutdown)."""
+    while pending:
+        await asyncio.gather(*list(pending), return_exceptions=True)
@@ -0,0 +1,135 @@
+"""
+Nightly batch generation of personalised daily coaching tips.
+
+Users mostly open the coach for one tip a day, so instead of an interactive LLM call per
+visit, this job walks all users in chunks of DAILY_TIPS_BATCH_SIZE (ordered by user_id),
+builds each user's prompt from their goals and activity totals with the same context
+builder as the chat endpoints, and stores the tip for instant retrieval via
+GET /api/v1/ai-coach/daily-tip.
+
+- Resumable: after every chunk the last processed user_id is checkpointed in the batch_jobs
+  table; a restarted job for the same day continues from there and skips users that already
+  have today's tip. A completed day is not run again.
+- Retried: users whose tip failed are kept in the checkpoint, and the day stays "incomplete"
+  until a later run for the same day (restart, cron) has generated their tips.
+- Rate-limited: DAILY_TIPS_WORKERS workers share a DAILY_TIPS_PER_MINUTE token bucket.
+- Low priority: calls go through the LLM admission controller's background slots, which are
+  only granted while no interactive chat is waiting (see llm_admission).
+
+Run it from the app process with DAILY_TIPS_ENABLED=true (once a day at
+DAILY_TIPS_RUN_HOUR_UTC), or once from cron with `python -m backend.services.daily_tips`.
+"""
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from .. import crud, models
+from ..config import settings
+from ..rate_limiter import TokenBucketLimiter
+from .ai_coach_service import get_ai_coach_response, FALLBACK_REPLY
+from .coach_context import build_coach_messages
+
+JOB_NAME = "daily_tips"
+DAILY_TIP_REQUEST = (
+    "Give me one short, specific coaching tip for today based on my goals and my activity so far. "
+    "No questions, just the tip."
+)
+
+
+async def generate_tip(user: models.User) -> Optional[str]:
+    messages = build_coach_messages(user, [{"role": "user", "content": DAILY_TIP_REQUEST}])
+    reply = await get_ai_coach_response(messages, use_cache=False, user_id=user.user_id, background=True)
+    return None if reply == FALLBACK_REPLY else reply
+
+
+async def _generate_chunk(
+    users: List[models.User], tip_date: date, limiter: TokenBucketLimiter, counters: Dict[str, int], failed_user_ids: List[str],
+) -> None:
+    queue: "asyncio.Queue[models.User]" = asyncio.Queue()
+    for user in users:
+        queue.put_nowait(user)
+
+    async def worker() -> None:
+        while not queue.empty():
+            user = queue.get_nowait()
+            while (delay := limiter.hit(JOB_NAME)) > 0:
+                await asyncio.sleep(delay)
+            tip = await generate_tip(user)
+            if tip is None:
+                counters["failed"] += 1
+                failed_user_ids.append(user.user_id)
+                continue
+            crud.save_daily_tip_db(user.user_id, tip_date, tip)
+            counters["generated"] += 1
+
+    await asyncio.gather(*(worker() for _ in range(max(1, settings.DAILY_TIPS_WORKERS))))
+
+
+async def run_daily_tips_job(tip_date: Optional[date] = None) -> Dict[str, int]:
+    """Generates `tip_date`'s (default: today, UTC) tips, resuming from the last checkpoint. Returns counters."""
+    tip_date = tip_date or datetime.now(timezone.utc).date()
+    counters = {"generated": 0, "skipped": 0, "failed": 0}
+    state = crud.get_batch_job_state_db(JOB_NAME)
+    cursor = None
+    retry_user_ids: List[str] = []
+    if state and state.get("date") == tip_date.isoformat():
+        if state.get("status") == "completed":
+            return counters
+        cursor = state.get("cursor")
+        retry_user_ids = state.get("failed_user_ids", [])
+
+    done_user_ids = set(crud.get_daily_tip_user_ids_db(tip_date))
+    failed_user_ids: List[str] = []
+
+    def checkpoint(status: str, **extra) -> None:
+        crud.save_batch_job_state_db(JOB_NAME, {
+            "date": tip_date.isoformat(), "cursor": cursor, "status": status, "failed_user_ids": failed_user_ids, **extra,
+        })
+
+    per_minute = settings.DAILY_TIPS_PER_MINUTE
+    limiter = TokenBucketLimiter(JOB_NAME, capacity=1, refill_per_second=per_minute / 60.0)
+    print(f"Daily tips job for {tip_date}: starting{f' after user {cursor}' if cursor else ''}")
+
+    if retry_user_ids:
+        retry_users = [user for user_id in retry_user_ids
+                       if user_id not in done_user_ids and (user := crud.get_user_by_id(user_id)) is not None]
+        print(f"Daily tips job for {tip_date}: retrying {len(retry_users)} failed users")
+        await _generate_chunk(retry_users, tip_date, limiter, counters, failed_user_ids)
+        checkpoint("running")
+
+    while True:
+        users = crud.get_users_after_db(cursor, settings.DAILY_TIPS_BATCH_SIZE)
+        if not users:
+            break
+        pending = [user for user in users if user.user_id not in done_user_ids]
+        counters["skipped"] += len(users) - len(pending)
+        await _generate_chunk(pending, tip_date, limiter, counters, failed_user_ids)
+        cursor = users[-1].user_id
+        checkpoint("running")
+
+    checkpoint("incomplete" if failed_user_ids else "completed", **counters)
+    print(f"Daily tips job for {tip_date}: done {counters}")
+    return counters
+
+
+def seconds_until_next_run(now: datetime) -> float:
+    next_run = now.replace(hour=settings.DAILY_TIPS_RUN_HOUR_UTC, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+async def daily_tips_scheduler() -> None:
+    """Runs the job daily at DAILY_TIPS_RUN_HOUR_UTC; on startup, resumes/catches up today's run if it is due."""
+    while True:
+        now = datetime.now(timezone.utc)
+        if now.hour >= settings.DAILY_TIPS_RUN_HOUR_UTC:
+            try:
+                await run_daily_tips_job(now.date())
+            except Exception as exc:
+                print(f"Daily tips job failed (will resume from its checkpoint): {exc}")
+        await asyncio.sleep(seconds_until_next_run(datetime.now(timezone.utc)))
+
+
+if __name__ == "__main__":
+    asyncio.run(run_daily_tips_job())
@@ -0,0 +1,88 @@
+"""
+Rule-based AI coach answers computed locally.
+
+Used when DeepSeek misses the AI coach latency budget or fails (see ai_coach_service), so a
+chat always gets a useful, personalised answer in bounded time instead of an apology. The
+reply combines one curated tip for the topic of the user's message with a line based on
+their own activity totals and goals. Arabic messages get Arabic tips, matching the model's
+language rule.
+"""
+import re
+from typing import Dict, List, Tuple
+
+from .. import models
+
+ARABIC_CHARS = re.compile(r"[؀-ۿ]")
+
+# (English keyword patterns, Arabic keywords, English tip, Arabic tip), checked in order.
+# English keywords must match whole words (so "great" is not "eat" and "feedback" is not
+# "back"); their patterns spell out the inflections. Arabic attaches articles and
+# prepositions to the word (الجري، بالركبة), so Arabic keywords match anywhere in a word.
+CURATED_TIPS: List[Tuple[Tuple[str, ...], Tuple[str, ...], str, str]] = [
+    ((r"injur(?:y|ies|ed)", r"pain(?:s|ful)?", r"hurts?", r"hurting", r"knees?", r"back pain"),
+     ("ألم", "إصابة", "ركبة"),
+     "Pain is a signal to back off: rest the area, keep other training light, and see a physio or doctor if it lasts more than a few days.",
+     "الألم إشارة للتخفيف: أرح المنطقة المصابة، وخفف باقي التمارين، واستشر أخصائي علاج طبيعي أو طبيباً إذا استمر أكثر من بضعة أيام."),
+    ((r"run(?:s|ning|ners?)?", r"jog(?:s|ging|gers?)?", r"marathons?", r"5k", r"10k", r"cardio"),
+     ("جري", "ركض"),
+     "Keep most runs at an easy, conversational pace and raise your weekly distance by no more than about 10% per week.",
+     "اجعل معظم جريك بوتيرة سهلة تسمح لك بالكلام، ولا تزد مسافتك الأسبوعية بأكثر من 10٪ تقريباً كل أسبوع."),
+    ((r"muscles?", r"strength", r"lift(?:s|ing)?", r"gym", r"weights", r"squats?", r"bench(?:ing)?"),
+     ("عضل", "قوة", "جيم", "أثقال"),
+     "Train each muscle group about twice a week with 2-3 hard sets per exercise, adding a little weight or a rep when the last set feels easy.",
+     "درّب كل مجموعة عضلية مرتين أسبوعياً تقريباً بمجموعتين إلى ثلاث مجموعات قوية لكل تمرين، وزد الوزن أو التكرار قليلاً عندما تصبح المجموعة الأخيرة سهلة."),
+    ((r"weight loss", r"los(?:e|ing) weight", r"fat", r"diet(?:s|ing)?", r"calories?"),
+     ("وزن", "دهون", "رجيم", "سعرات"),
+     "Aim for a small daily calorie deficit, build meals around protein and vegetables, and keep walking every day.",
+     "استهدف عجزاً بسيطاً في السعرات يومياً، واجعل البروتين والخضروات أساس وجباتك، وحافظ على المشي يومياً."),
+    ((r"eat(?:s|ing)?", r"food", r"nutrition", r"protein", r"meals?"),
+     ("أكل", "تغذية", "بروتين", "وجبة"),
+     "Include a palm-sized portion of protein in every meal and drink water regularly through the day.",
+     "أضف حصة بروتين بحجم كف اليد إلى كل وجبة، واشرب الماء بانتظام طوال اليوم."),
+    ((r"sleep(?:ing)?", r"rest(?:ing)?", r"recover(?:y|ing)?", r"tired", r"sore(?:ness)?"),
+     ("نوم", "راحة", "تعب", "استشفاء"),
+     "Recovery is where progress happens: aim for 7-9 hours of sleep and keep at least one easy day between hard sessions.",
+     "التقدم يحدث أثناء الاستشفاء: احرص على النوم من 7 إلى 9 ساعات، واترك يوماً خفيفاً على الأقل بين الحصص الصعبة."),
+]
+TOPIC_PATTERNS = [
+    re.compile(r"\b(?:" + "|".join(english) + r")\b|" + "|".join(map(re.escape, arabic)))
+    for english, arabic, _, _ in CURATED_TIPS
+]
+GENERAL_TIP = (
+    "Consistency beats intensity: pick a routine you can keep 3-4 days a week and build from there.",
+    "الاستمرارية أهم من الشدة: اختر روتيناً تستطيع الالتزام به 3-4 أيام أسبوعياً وابنِ عليه.",
+)
+
+
+def _activity_totals(user: models.User) -> Dict[str, float]:
+    totals = {"running": 0.0, "steps": 0.0, "gym_time": 0.0}
+    for activity in user.tracked_activities:
+        if activity.activity_type in totals:
+            totals[activity.activity_type] += activity.value
+    return totals
+
+
+def _personal_line(user: models.User, arabic: bool) -> str:
+    totals = _activity_totals(user)
+    if arabic:
+        line = f"حتى الآن سجلت {totals['running']:.1f} كم جري و{int(totals['gym_time'])} دقيقة في الجيم."
+        return line + (f" ركز على هدفك: {user.fitness_goals[0]}." if user.fitness_goals else "")
+    if not any(totals.values()):
+        line = f"{user.name}, start by logging your activities so your plan can build on them."
+    else:
+        line = (f"{user.name}, you've logged {totals['running']:.1f} km of running, {int(totals['steps'])} steps "
+                f"and {int(totals['gym_time'])} gym minutes so far.")
+    return line + (f" Keep your goal in focus: {user.fitness_goals[0]}." if user.fitness_goals else "")
+
+
+def fallback_reply(user: models.User, last_message: str) -> str:
+    """A short local answer to `last_message`, personalised with the user's stats."""
+    arabic = len(ARABIC_CHARS.findall(last_message)) > len(last_message) / 2 if last_message else False
+    text = last_message.lower()
+    english_tip, arabic_tip = GENERAL_TIP
+    for pattern, (_, _, topic_english, topic_arabic) in zip(TOPIC_PATTERNS, CURATED_TIPS):
+        if pattern.search(text):
+            english_tip, arabic_tip = topic_english, topic_arabic
+            break
+    tip = arabic_tip if arabic else english_tip
+    return f"{tip}\n\n{_personal_line(user, arabic)}"
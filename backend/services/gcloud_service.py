@@ -1,11 +1,31 @@
-from typing import List, Optional
-from math import radians, sin, cos, sqrt, atan2
-import httpx # Import httpx for asynchronous HTTP requests
-from fuzzywuzzy import fuzz # For fuzzy string matching
+import asyncio
+from typing import List, Optional, Set
 
 from ..config import settings # Corrected relative import
 from ..schemas import GymNearbyResponse, Subscription # For structuring the output
 from .. import crud # Import crud to access database operations
+from . import http_clients # Shared, lifespan-managed connection pools
+from . import places_cache
+from .places_cache import CachedPlace
+from .single_flight import SingleFlight
+from .circuit_breaker import CircuitBreaker
+from .geo_utils import calculate_distance_haversine, nearest_within # Scalar version re-exported for existing callers
+from .gym_geo_index import gym_geo_index
+from .gym_name_index import gym_name_index
+
+# Concurrent searches for the same (geohash cell, radius bucket) share one Places call
+places_flight = SingleFlight("google_places")
+# Places searches that fill the cache after the request that started them has been answered
+pending: Set[asyncio.Task] = set()
+# Stops calling Google while it is slow or failing; searches then use local/stale data right away
+places_breaker = CircuitBreaker(
+    "google_places",
+    latency_budget_seconds=settings.PLACES_LATENCY_BUDGET_SECONDS,
+    window_size=settings.PLACES_BREAKER_WINDOW,
+    min_calls=settings.PLACES_BREAKER_MIN_CALLS,
+    error_rate_threshold=settings.PLACES_BREAKER_ERROR_RATE,
+    open_seconds=settings.PLACES_BREAKER_OPEN_SECONDS,
+)
 
 def get_mock_gyms() -> List[GymNearbyResponse]:
     """Returns a list of mock gyms for testing/fallback."""
@@ -26,38 +46,119 @@ def get_mock_gyms() -> List[GymNearbyResponse]:
         )
     ]
 
-def calculate_distance_haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """
-    Calculate the great circle distance between two points
-    on the earth (specified in decimal degrees) using Haversine formula.
-    Returns distance in kilometers.
-    """
-    R = 6371  # Radius of earth in kilometers.
-    
-    lat1_rad = radians(lat1)
-    lon1_rad = radians(lon1)
-    lat2_rad = radians(lat2)
-    lon2_rad = radians(lon2)
-    
-    dlon = lon2_rad - lon1_rad
-    dlat = lat2_rad - lat1_rad
-    
-    a = sin(dlat / 2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    
-    distance = R * c
-    return round(distance, 2)
-
 async def find_nearby_gyms(latitude: float, longitude: float, radius_meters: int = 5000) -> List[GymNearbyResponse]:
     """
-    Connects to Google Places API to find gyms, with a fallback to mock data.
+    Answers registered gyms from the local geo index, then adds unregistered venues from
+    the Google Places API, served from the geohash-bucketed places cache.
+
+    Latency: a request never waits on Google while it has something to show. On a cache miss
+    the Places search starts in the background (see refresh_places) and the request is
+    answered right away from the last cached result for the area (even if expired) or, if
+    there is none, from the local gyms alone; later requests get the refreshed entry. Only
+    when neither source has anything does it wait for Places, which the circuit breaker
+    bounds to PLACES_LATENCY_BUDGET_SECONDS (no wait at all while the circuit is open).
+    Falls back to mock data when that search fails too.
     """
+    radius_km = radius_meters / 1000
+    local_gyms = find_registered_gyms_nearby(latitude, longitude, radius_km)
+
     if not settings.GOOGLE_API_KEY or settings.GOOGLE_API_KEY == "your_google_maps_api_key":
+        if local_gyms:
+            return local_gyms
         print("GCloud service: Using MOCK DATA because GOOGLE_API_KEY is not set.")
         mock_list = get_mock_gyms()
-        return [gym for gym in mock_list if gym.distance and gym.distance <= (radius_meters / 1000)]
+        return [gym for gym in mock_list if gym.distance and gym.distance <= radius_km]
+
+    key = places_cache.cache_key(latitude, longitude, radius_meters)
+    cached_places = places_cache.places_cache.get(key)
+    if cached_places is None:
+        refresh = refresh_places(latitude, longitude, radius_meters)
+        cached_places = places_cache.places_cache.get_stale(key)
+        if cached_places is None:
+            if local_gyms:
+                return local_gyms
+            cached_places = await asyncio.shield(refresh) # Nothing to show yet: wait, within the breaker's budget
+            if cached_places is None:
+                return get_mock_gyms()
+
+    # Places only contributes venues the local index did not already return
+    local_ids = {gym.gym_id for gym in local_gyms}
+    extra_places = [place for place in cached_places if place.gym.gym_id not in local_ids]
+    processed_gyms = local_gyms + with_distances(extra_places, latitude, longitude, radius_km=radius_km)
 
-    # Actual Google Places API call
+    # If after processing there are no gyms, or if the status was not OK, return mock data as a fallback.
+    if not processed_gyms:
+        print("Google Places API did not return usable results. Falling back to mock data.")
+        return get_mock_gyms()
+    return processed_gyms
+
+def refresh_places(latitude: float, longitude: float, radius_meters: int) -> "asyncio.Task[Optional[List[CachedPlace]]]":
+    """
+    Starts the Places search for this point's cache key in a background task (joining one
+    already in flight) that stores a non-empty result in the places cache. The task returns
+    the places, or None if Places failed.
+    """
+    key = places_cache.cache_key(latitude, longitude, radius_meters)
+
+    async def search_and_cache() -> List[CachedPlace]:
+        # Search around the cell, not this caller, so the entry serves every point and radius mapped to it
+        search_latitude, search_longitude, search_radius = places_cache.search_area(key)
+        places = await places_breaker.call(lambda: fetch_places(search_latitude, search_longitude, radius_meters=search_radius))
+        if places:
+            places_cache.places_cache.put(key, places)
+        return places
+
+    async def run() -> Optional[List[CachedPlace]]:
+        try:
+            return await places_flight.do(key, search_and_cache)
+        except Exception as e:
+            print(f"Google Places API unavailable ({type(e).__name__}: {e}). Serving local/cached data.")
+            return None
+
+    task = asyncio.get_running_loop().create_task(run())
+    pending.add(task)
+    task.add_done_callback(pending.discard)
+    return task
+
+async def drain() -> None:
+    """Waits for every background Places search (tests, shutdown)."""
+    while pending:
+        await asyncio.gather(*list(pending), return_exceptions=True)
+
+def find_registered_gyms_nearby(latitude: float, longitude: float, radius_km: float) -> List[GymNearbyResponse]:
+    """Registered gyms with coordinates within radius_km, nearest first, from the in-memory index."""
+    gym_geo_index.ensure_built(crud.get_all_gyms_db)
+    return [
+        GymNearbyResponse(**gym.model_dump(), distance=dist_km)
+        for gym, dist_km in gym_geo_index.query(latitude, longitude, radius_km)
+    ]
+
+def with_distances(places: List[CachedPlace], latitude: float, longitude: float, radius_km: float) -> List[GymNearbyResponse]:
+    """
+    Computes every place's distance from the caller in one batch and keeps those within radius_km.
+    Places matched to a registered gym get that gym's current details, which may have been edited since caching.
+    """
+    gym_name_index.ensure_built(crud.get_all_gyms_db)
+    nearby = nearest_within(
+        latitude, longitude,
+        [place.latitude for place in places], [place.longitude for place in places],
+        radius_km,
+    )
+    # Keep Google's relevance order for the places that are in range
+    return [
+        current_details(places[position].gym).model_copy(update={"distance": dist_km})
+        for position, dist_km in sorted(nearby)
+    ]
+
+def current_details(gym: GymNearbyResponse) -> GymNearbyResponse:
+    registered = gym_name_index.gym_by_id(gym.gym_id)
+    return GymNearbyResponse(**registered.model_dump()) if registered else gym
+
+async def fetch_places(latitude: float, longitude: float, radius_meters: int) -> List[CachedPlace]:
+    """
+    Calls the Places nearby search and matches each result against registered gyms.
+    Returns places without distances (see with_distances); raises on transport/HTTP errors.
+    """
     BASE_URL = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
     params = {
         "location": f"{latitude},{longitude}",
@@ -66,74 +167,70 @@ async def find_nearby_gyms(latitude: float, longitude: float, radius_meters: int
         "key": settings.GOOGLE_API_KEY,
     }
 
-    processed_gyms: List[GymNearbyResponse] = []
-    db_gyms = crud.get_all_gyms_db()
-    FUZZY_MATCH_THRESHOLD = 70
-
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(BASE_URL, params=params, timeout=10.0)
-            response.raise_for_status()
-            data = response.json()
-
-            if data.get("status") == "OK":
-                for place in data.get("results", []):
-                    place_name = place.get("name", "N/A")
-                    place_address = place.get("vicinity", "Address not available")
-                    
-                    geometry = place.get("geometry", {}).get("location", {})
-                    place_lat = geometry.get("lat")
-                    place_lng = geometry.get("lng")
-
-                    if place_lat is None or place_lng is None:
-                        continue
-
-                    dist_km = calculate_distance_haversine(latitude, longitude, place_lat, place_lng)
-
-                    matched_db_gym = None
-                    best_score = -1
-                    for db_gym in db_gyms:
-                        score = fuzz.ratio(place_name.lower(), db_gym.name.lower())
-                        if score > best_score and score >= FUZZY_MATCH_THRESHOLD:
-                            best_score = score
-                            matched_db_gym = db_gym
-                    
-                    if matched_db_gym:
-                        gym_response = GymNearbyResponse(
-                            gym_id=matched_db_gym.gym_id,
-                            name=matched_db_gym.name,
-                            location=matched_db_gym.location,
-                            location_url=matched_db_gym.location_url,
-                            token_per_visit=matched_db_gym.token_per_visit,
-                            genders_accepted=matched_db_gym.genders_accepted,
-                            subscriptions=matched_db_gym.subscriptions,
-                            services=matched_db_gym.services,
-                            distance=dist_km
-                        )
-                    else:
-                        gym_response = GymNearbyResponse(
-                            gym_id=place.get("place_id", ""), 
-                            name=place_name,
-                            location=place_address,
-                            location_url=f"https://maps.google.com/?q={place_name},{place_address}", 
-                            token_per_visit=None,
-                            genders_accepted=[],
-                            subscriptions=[],
-                            services=[],
-                            distance=dist_km
-                        )
-                    processed_gyms.append(gym_response)
-
-            # If after processing there are no gyms, or if the status was not OK, return mock data as a fallback.
-            if not processed_gyms:
-                 print(f"Google Places API did not return usable results (status: {data.get('status')}). Falling back to mock data.")
-                 return get_mock_gyms()
-
-    except Exception as e:
-        print(f"An unexpected error occurred during Google Places API call: {e}. Falling back to mock data.")
-        return get_mock_gyms()
-    
-    return processed_gyms
+    places: List[CachedPlace] = []
+    gym_name_index.ensure_built(crud.get_all_gyms_db)
+    known_matches = crud.get_all_place_matches_db()
+    new_matches = []
+
+    client = http_clients.get_client("google_places")
+    response = await client.get(BASE_URL, params=params)
+    response.raise_for_status()
+    data = response.json()
+
+    if data.get("status") != "OK":
+        print(f"Google Places API returned status: {data.get('status')}")
+        return places
+
+    for place in data.get("results", []):
+        place_name = place.get("name", "N/A")
+        place_address = place.get("vicinity", "Address not available")
+        
+        geometry = place.get("geometry", {}).get("location", {})
+        place_lat = geometry.get("lat")
+        place_lng = geometry.get("lng")
+
+        if place_lat is None or place_lng is None:
+            continue
+
+        place_id = place.get("place_id", "")
+        known = known_matches.get(place_id) if place_id else None
+        if known is not None and known["place_name"] == place_name:
+            matched_db_gym = gym_name_index.gym_by_id(known["gym_id"]) if known["gym_id"] else None
+        else:
+            # Best fuzz.ratio match >= FUZZY_MATCH_THRESHOLD, scoring only pruned candidates
+            matched_db_gym = gym_name_index.best_match(place_name)
+            if place_id:
+                new_matches.append({
+                    "place_id": place_id, "place_name": place_name,
+                    "gym_id": matched_db_gym.gym_id if matched_db_gym else None,
+                })
+        
+        if matched_db_gym:
+            gym_response = GymNearbyResponse(
+                gym_id=matched_db_gym.gym_id,
+                name=matched_db_gym.name,
+                location=matched_db_gym.location,
+                location_url=matched_db_gym.location_url,
+                token_per_visit=matched_db_gym.token_per_visit,
+                genders_accepted=matched_db_gym.genders_accepted,
+                subscriptions=matched_db_gym.subscriptions,
+                services=matched_db_gym.services,
+            )
+        else:
+            gym_response = GymNearbyResponse(
+                gym_id=place_id, 
+                name=place_name,
+                location=place_address,
+                location_url=f"https://maps.google.com/?q={place_name},{place_address}", 
+                token_per_visit=None,
+                genders_accepted=[],
+                subscriptions=[],
+                services=[],
+            )
+        places.append(CachedPlace(gym=gym_response, latitude=place_lat, longitude=place_lng))
+
+    crud.save_place_matches_db(new_matches)
+    return places
 
 # Note on Google Places API:
 # The 'google-api-python-client' is more suited for APIs like Drive, Calendar, etc.
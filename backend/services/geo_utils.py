@@ -0,0 +1,121 @@
+"""Small geospatial helpers shared by the nearby-gym search paths."""
+from math import radians, sin, cos, sqrt, atan2
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int = 7) -> str:
+    """
+    Encodes a coordinate as a geohash string. Points in the same cell share the string.
+    Approximate cell sizes: precision 5 ~ 4.9 x 4.9 km, 6 ~ 1.2 x 0.6 km, 7 ~ 153 x 153 m.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bit = 0
+    char_index = 0
+    even_bit = True # Geohash interleaves bits, starting with longitude
+    while len(chars) < precision:
+        if even_bit:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                char_index = (char_index << 1) | 1
+                lon_range[0] = mid
+            else:
+                char_index <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                char_index = (char_index << 1) | 1
+                lat_range[0] = mid
+            else:
+                char_index <<= 1
+                lat_range[1] = mid
+        even_bit = not even_bit
+        bit += 1
+        if bit == 5:
+            chars.append(_GEOHASH_BASE32[char_index])
+            bit = 0
+            char_index = 0
+    return "".join(chars)
+
+
+def geohash_bounds(geohash: str) -> Tuple[float, float, float, float]:
+    """(min_latitude, max_latitude, min_longitude, max_longitude) of a geohash cell."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even_bit = True
+    for char in geohash:
+        char_index = _GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            value_range = lon_range if even_bit else lat_range
+            mid = (value_range[0] + value_range[1]) / 2
+            if (char_index >> shift) & 1:
+                value_range[0] = mid
+            else:
+                value_range[1] = mid
+            even_bit = not even_bit
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def calculate_distance_haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Calculate the great circle distance between two points
+    on the earth (specified in decimal degrees) using Haversine formula.
+    Returns distance in kilometers.
+    """
+    R = EARTH_RADIUS_KM
+    
+    lat1_rad = radians(lat1)
+    lon1_rad = radians(lon1)
+    lat2_rad = radians(lat2)
+    lon2_rad = radians(lon2)
+    
+    dlon = lon2_rad - lon1_rad
+    dlat = lat2_rad - lat1_rad
+    
+    a = sin(dlat / 2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(dlon / 2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    
+    distance = R * c
+    return round(distance, 2)
+
+
+def haversine_distances(latitude: float, longitude: float, latitudes: Sequence[float], longitudes: Sequence[float]) -> np.ndarray:
+    """
+    Vectorized calculate_distance_haversine: distances in km (rounded to 2 decimals, like the
+    scalar version) from one point to every (latitudes[i], longitudes[i]), in a single NumPy pass.
+    """
+    lat1_rad = np.radians(latitude)
+    lat2_rad = np.radians(np.asarray(latitudes, dtype=np.float64))
+    dlat = lat2_rad - lat1_rad
+    dlon = np.radians(np.asarray(longitudes, dtype=np.float64)) - np.radians(longitude)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return np.round(EARTH_RADIUS_KM * c, 2)
+
+
+def nearest_within(
+    latitude: float, longitude: float, latitudes: Sequence[float], longitudes: Sequence[float],
+    radius_km: float, limit: Optional[int] = None,
+) -> List[Tuple[int, float]]:
+    """
+    Returns (position, distance_km) for the points within radius_km, nearest first. Ties keep
+    input order, so the result equals a stable sort of the scalar loop, truncated to `limit`.
+    """
+    distances = haversine_distances(latitude, longitude, latitudes, longitudes)
+    positions = np.flatnonzero(distances <= radius_km)
+    if limit is not None and limit < len(positions):
+        if limit <= 0:
+            return []
+        # Top-N without sorting everything: keep points up to the limit-th smallest distance
+        cutoff = np.partition(distances[positions], limit - 1)[limit - 1]
+        positions = positions[distances[positions] <= cutoff]
+    positions = positions[np.argsort(distances[positions], kind="stable")][:limit]
+    return list(zip(positions.tolist(), distances[positions].tolist()))
@@ -0,0 +1,119 @@
+"""
+In-memory spatial index of registered gyms that have coordinates.
+
+Gyms are bucketed into a fixed lat/lng grid (GRID_CELL_DEGREES per side). A radius query
+only scans the cells overlapping the query's bounding box and computes exact haversine
+distances for the gyms in them in one vectorized pass (each cell keeps its coordinates as
+NumPy arrays), so "around you" for registered gyms never needs Google.
+
+The index is built at startup (see main.py lifespan) and kept current by crud on gym
+create/update. If it has not been built yet, callers build it lazily via `ensure_built`.
+"""
+import math
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from ..models import Gym
+from .geo_utils import nearest_within
+
+GRID_CELL_DEGREES = 0.05 # ~5.5 km of latitude per cell
+KM_PER_DEGREE_LAT = 111.32
+
+Cell = Tuple[int, int]
+
+
+class GymGeoIndex:
+    def __init__(self, cell_degrees: float = GRID_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.cells: Dict[Cell, Dict[str, Gym]] = {}
+        self.gym_cells: Dict[str, Cell] = {} # gym_id -> cell, for moves and removals
+        # cell -> (gyms, latitudes, longitudes), built on first query and dropped when the cell changes
+        self.cell_arrays: Dict[Cell, Tuple[List[Gym], np.ndarray, np.ndarray]] = {}
+        self.is_built = False
+
+    def _cell_for(self, latitude: float, longitude: float) -> Cell:
+        return (math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees))
+
+    def rebuild(self, gyms: Iterable[Gym]) -> None:
+        self.cells.clear()
+        self.gym_cells.clear()
+        self.cell_arrays.clear()
+        for gym in gyms:
+            self.upsert(gym)
+        self.is_built = True
+
+    def ensure_built(self, load_gyms: Callable[[], Iterable[Gym]]) -> None:
+        if not self.is_built:
+            self.rebuild(load_gyms())
+
+    def upsert(self, gym: Gym) -> None:
+        """Adds or moves a gym. Gyms without coordinates are removed from the index."""
+        self.remove(gym.gym_id)
+        if gym.latitude is None or gym.longitude is None:
+            return
+        cell = self._cell_for(gym.latitude, gym.longitude)
+        self.cells.setdefault(cell, {})[gym.gym_id] = gym
+        self.gym_cells[gym.gym_id] = cell
+        self.cell_arrays.pop(cell, None)
+
+    def remove(self, gym_id: str) -> None:
+        cell = self.gym_cells.pop(gym_id, None)
+        if cell is None:
+            return
+        self.cell_arrays.pop(cell, None)
+        bucket = self.cells.get(cell)
+        if bucket is not None:
+            bucket.pop(gym_id, None)
+            if not bucket:
+                del self.cells[cell]
+
+    def clear(self) -> None:
+        self.cells.clear()
+        self.gym_cells.clear()
+        self.cell_arrays.clear()
+        self.is_built = False
+
+    def _arrays_for(self, cell: Cell) -> Tuple[List[Gym], np.ndarray, np.ndarray]:
+        arrays = self.cell_arrays.get(cell)
+        if arrays is None:
+            gyms = list(self.cells[cell].values())
+            arrays = (
+                gyms,
+                np.fromiter((gym.latitude for gym in gyms), dtype=np.float64, count=len(gyms)),
+                np.fromiter((gym.longitude for gym in gyms), dtype=np.float64, count=len(gyms)),
+            )
+            self.cell_arrays[cell] = arrays
+        return arrays
+
+    def _candidates(self, latitude: float, longitude: float, radius_km: float) -> Tuple[List[Gym], np.ndarray, np.ndarray]:
+        lat_delta = radius_km / KM_PER_DEGREE_LAT
+        lon_delta = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(latitude)), 0.01))
+        min_lat_cell, min_lon_cell = self._cell_for(latitude - lat_delta, longitude - lon_delta)
+        max_lat_cell, max_lon_cell = self._cell_for(latitude + lat_delta, longitude + lon_delta)
+        gyms: List[Gym] = []
+        latitudes, longitudes = [], []
+        for lat_cell in range(min_lat_cell, max_lat_cell + 1):
+            for lon_cell in range(min_lon_cell, max_lon_cell + 1):
+                if (lat_cell, lon_cell) in self.cells:
+                    cell_gyms, cell_lats, cell_lons = self._arrays_for((lat_cell, lon_cell))
+                    gyms.extend(cell_gyms)
+                    latitudes.append(cell_lats)
+                    longitudes.append(cell_lons)
+        if not gyms:
+            return gyms, np.empty(0), np.empty(0)
+        return gyms, np.concatenate(latitudes), np.concatenate(longitudes)
+
+    def query(self, latitude: float, longitude: float, radius_km: float, limit: Optional[int] = None) -> List[Tuple[Gym, float]]:
+        """Returns (gym, distance_km) pairs within radius_km, nearest first."""
+        gyms, latitudes, longitudes = self._candidates(latitude, longitude, radius_km)
+        return [
+            (gyms[position], dist_km)
+            for position, dist_km in nearest_within(latitude, longitude, latitudes, longitudes, radius_km, limit)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.gym_cells)
+
+
+gym_geo_index = GymGeoIndex()
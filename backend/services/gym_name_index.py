@@ -0,0 +1,120 @@
+"""
+Candidate pruning for fuzzy Places-to-DB gym name matching.
+
+`fuzz.ratio(a, b)` is round(100 * 2 * LCS(a, b) / (len(a) + len(b))) (python-Levenshtein's
+indel ratio). The LCS can never exceed the multiset overlap of the two strings' characters,
+so that overlap gives an upper bound on the score. The index keeps every gym name as a row of
+character counts in one NumPy matrix (CHAR_COLUMNS columns: a-z, 0-9, space, and the other
+characters hashed into shared columns; sharing a column can only raise the overlap, so the
+bound stays safe). A lookup then:
+
+1. computes the overlap bound against every gym in one vectorized np.minimum().sum(),
+2. keeps the gyms whose bound reaches the threshold (this also implies the length filter),
+3. scores the survivors, in catalog order, with Levenshtein.ratio: the function fuzz.ratio
+   wraps, without fuzzywuzzy's per-call SequenceMatcher and decorator overhead.
+
+Every gym that could score >= threshold survives, so the best match is the same one a full
+fuzz.ratio scan of the catalog returns, including tie-breaking by catalog order. On typical
+names about 3% of the catalog survives; see backend/benchmarks/bench_gym_name_index.py.
+"""
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from Levenshtein import ratio as levenshtein_ratio
+
+from ..models import Gym
+
+FUZZY_MATCH_THRESHOLD = 70
+CHAR_COLUMNS = 64
+_HASHED_COLUMNS = CHAR_COLUMNS - 37 # after a-z, 0-9 and space
+
+
+def _column(char: str) -> int:
+    code = ord(char)
+    if 97 <= code <= 122: # a-z
+        return code - 97
+    if 48 <= code <= 57: # 0-9
+        return 26 + code - 48
+    if char == " ":
+        return 36
+    return 37 + code % _HASHED_COLUMNS
+
+
+def _char_counts(name: str) -> np.ndarray:
+    counts = np.zeros(CHAR_COLUMNS, dtype=np.uint16)
+    for char in name:
+        counts[_column(char)] += 1
+    return counts
+
+
+def _score(a: str, b: str) -> int:
+    """fuzz.ratio(a, b) for already lower-cased strings."""
+    if a == b:
+        return 100
+    if not a or not b:
+        return 0
+    return int(round(100 * levenshtein_ratio(a, b)))
+
+
+class GymNameIndex:
+    def __init__(self, threshold: int = 70):
+        self.threshold = threshold
+        # Smallest score (before rounding) that can still round up to `threshold`
+        self.min_score = threshold - 0.5
+        self.gyms: List[Gym] = []
+        self.gyms_by_id: Dict[str, Gym] = {}
+        self.names: List[str] = []
+        self.char_counts = np.zeros((0, CHAR_COLUMNS), dtype=np.uint16)
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.is_built = False
+
+    def rebuild(self, gyms: Iterable[Gym]) -> None:
+        self.gyms = list(gyms)
+        self.gyms_by_id = {gym.gym_id: gym for gym in self.gyms}
+        self.names = [gym.name.lower() for gym in self.gyms]
+        if self.names:
+            self.char_counts = np.stack([_char_counts(name) for name in self.names])
+        else:
+            self.char_counts = np.zeros((0, CHAR_COLUMNS), dtype=np.uint16)
+        self.lengths = np.array([len(name) for name in self.names], dtype=np.int64)
+        self.is_built = True
+
+    def ensure_built(self, load_gyms: Callable[[], Iterable[Gym]]) -> None:
+        if not self.is_built:
+            self.rebuild(load_gyms())
+
+    def invalidate(self) -> None:
+        """Marks the index stale; the next ensure_built() reloads the catalog."""
+        self.is_built = False
+
+    def gym_by_id(self, gym_id: str) -> Optional[Gym]:
+        return self.gyms_by_id.get(gym_id)
+
+    def clear(self) -> None:
+        self.rebuild([])
+        self.is_built = False
+
+    def candidates(self, name: str) -> List[int]:
+        """Catalog positions (ascending) of gyms whose score against `name` could reach the threshold."""
+        query = name.lower()
+        if not query or not self.names:
+            return []
+        overlap = np.minimum(self.char_counts, _char_counts(query)).sum(axis=1, dtype=np.int64)
+        # 100 * 2 * overlap / (len(query) + len(gym)) >= min_score, kept in integers/floats without division
+        possible = 200 * overlap >= (self.min_score - 1e-9) * (len(query) + self.lengths)
+        return np.flatnonzero(possible).tolist()
+
+    def best_match(self, name: str) -> Optional[Gym]:
+        """Same result as scanning every gym with fuzz.ratio and keeping the first best score >= threshold."""
+        query = name.lower()
+        matched_gym = None
+        best_score = -1
+        for position in self.candidates(name):
+            score = _score(query, self.names[position])
+            if score > best_score and score >= self.threshold:
+                best_score = score
+                matched_gym = self.gyms[position]
+        return matched_gym
+
+
+gym_name_index = GymNameIndex(threshold=FUZZY_MATCH_THRESHOLD)
@@ -0,0 +1,87 @@
+"""
+Shared outbound HTTP clients, one pooled httpx.AsyncClient per upstream.
+
+Clients are created in the FastAPI lifespan handler (see main.py) and reused by every
+request, so outbound calls ride warm keep-alive connections instead of paying DNS, TCP
+and TLS setup each time. If a client is requested outside the lifespan (scripts, tests
+using TestClient without a context manager) it is created lazily.
+
+Tests can swap in a local transport with `set_transport("google_places", httpx.MockTransport(handler))`.
+"""
+import importlib.util
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import httpx
+
+from ..config import settings
+
+
+@dataclass(frozen=True)
+class UpstreamConfig:
+    timeout: httpx.Timeout
+    limits: httpx.Limits
+    http2: bool = False
+
+
+UPSTREAMS: Dict[str, UpstreamConfig] = {
+    "google_places": UpstreamConfig(
+        timeout=httpx.Timeout(10.0, connect=3.0),
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60.0),
+        http2=True,
+    ),
+    "deepseek": UpstreamConfig(
+        timeout=httpx.Timeout(30.0, connect=5.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0),
+        http2=True,
+    ),
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_transports: Dict[str, httpx.AsyncBaseTransport] = {}
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def _create_client(name: str) -> httpx.AsyncClient:
+    config = UPSTREAMS[name]
+    use_http2 = settings.OUTBOUND_HTTP2 and config.http2
+    if use_http2 and not _http2_available():
+        print(f"HTTP clients: OUTBOUND_HTTP2 is enabled but the 'h2' package is missing; using HTTP/1.1 for {name}.")
+        use_http2 = False
+    transport = _transports.get(name)
+    if transport is not None:
+        return httpx.AsyncClient(transport=transport, timeout=config.timeout)
+    return httpx.AsyncClient(timeout=config.timeout, limits=config.limits, http2=use_http2)
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    """Returns the shared client for an upstream (see UPSTREAMS), creating it if needed."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _create_client(name)
+        _clients[name] = client
+    return client
+
+
+def set_transport(name: str, transport: Optional[httpx.AsyncBaseTransport]) -> None:
+    """Routes an upstream through a custom transport (e.g. httpx.MockTransport); None restores the network."""
+    if transport is None:
+        _transports.pop(name, None)
+    else:
+        _transports[name] = transport
+    # Drop the current client; the next get_client() builds one with the new transport
+    _clients.pop(name, None)
+
+
+async def startup() -> None:
+    for name in UPSTREAMS:
+        get_client(name)
+
+
+async def shutdown() -> None:
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
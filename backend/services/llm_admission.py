@@ -0,0 +1,165 @@
+"""
+Admission control for outbound LLM calls.
+
+At most `max_concurrent` calls run at once. Callers beyond that wait in a per-user FIFO
+queue, and freed slots are handed out round-robin across users, so one user firing many
+chats cannot starve everyone else. Admission fails fast with AdmissionRejected (mapped to
+503 by the router) when the queue is full overall or for that user, or when a caller has
+waited `max_wait_seconds`, which keeps tail latency bounded under load.
+
+Batch work (e.g. daily tips) uses `background_slot()` instead: it only takes a slot while no
+interactive call is queued and LLM_BACKGROUND_RESERVED_SLOTS slots stay free, so it never
+competes with interactive chats.
+
+Queue waits are recorded for the metrics endpoint (p50/p95/max over recent admissions).
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict
+
+from ..config import settings
+
+WAIT_SAMPLES = 1000 # most recent queue waits kept for percentiles
+BACKGROUND_POLL_SECONDS = 0.05
+
+
+class AdmissionRejected(Exception):
+    """The call was not admitted (queue full or waited too long); retry later."""
+
+    def __init__(self, reason: str, retry_after_seconds: float = 1.0):
+        super().__init__(reason)
+        self.retry_after_seconds = retry_after_seconds
+
+
+class FairShareLimiter:
+    def __init__(self, name: str, max_concurrent: int, max_queue_depth: int, max_queue_per_user: int, max_wait_seconds: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_per_user = max_queue_per_user
+        self.max_wait_seconds = max_wait_seconds
+        self.active = 0
+        # user -> waiters in arrival order; dict order is the round-robin order over users
+        self.queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.background_admitted = 0
+        self.waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        self.rejected += 1
+        return AdmissionRejected(reason)
+
+    def _dequeue(self, user: str, waiter: asyncio.Future) -> None:
+        queue = self.queues.get(user)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.queued -= 1
+            if not queue:
+                del self.queues[user]
+
+    async def acquire(self, user: str) -> None:
+        """Waits for a slot for `user`. Raises AdmissionRejected instead of queueing past the limits."""
+        if self.active < self.max_concurrent and not self.queued:
+            self.active += 1
+            self.admitted += 1
+            self.waits.append(0.0)
+            return
+        if self.queued >= self.max_queue_depth:
+            raise self._reject("LLM queue is full")
+        queue = self.queues.get(user)
+        if queue is not None and len(queue) >= self.max_queue_per_user:
+            raise self._reject("Too many queued requests for this user")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(user, deque()).append(waiter)
+        self.queued += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, timeout=self.max_wait_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if waiter.done() and not waiter.cancelled():
+                self.release() # The slot was handed over just as the caller gave up
+            else:
+                self._dequeue(user, waiter)
+            if isinstance(exc, asyncio.TimeoutError):
+                raise self._reject("Timed out waiting for an LLM slot")
+            raise
+        self.admitted += 1
+        self.waits.append(time.monotonic() - started)
+
+    def release(self) -> None:
+        """Frees a slot, handing it straight to the next user in round-robin order if anyone waits."""
+        while self.queues:
+            user, queue = next(iter(self.queues.items()))
+            waiter = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self.queues.move_to_end(user) # This user goes to the back of the line
+            else:
+                del self.queues[user]
+            if not waiter.done():
+                waiter.set_result(None) # `active` is unchanged: the slot moves to the waiter
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, user: str) -> AsyncIterator[None]:
+        await self.acquire(user)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire_background(self, reserved: int) -> None:
+        """
+        Low-priority admission: waits (never rejected) until no interactive call is queued and
+        taking a slot still leaves `reserved` slots free. Polls, as batch work is not latency sensitive.
+        """
+        background_limit = max(1, self.max_concurrent - reserved)
+        while self.queued or self.active >= background_limit:
+            await asyncio.sleep(BACKGROUND_POLL_SECONDS)
+        self.active += 1
+        self.background_admitted += 1
+
+    @asynccontextmanager
+    async def background_slot(self) -> AsyncIterator[None]:
+        await self.acquire_background(settings.LLM_BACKGROUND_RESERVED_SLOTS)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def reset(self) -> None:
+        """Clears counters and wait samples (not active slots or queued waiters)."""
+        self.admitted = self.rejected = self.background_admitted = 0
+        self.waits.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+
+        def percentile(p: float) -> float:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 4) if waits else 0.0
+
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "background_admitted": self.background_admitted,
+            "wait_p50_seconds": percentile(0.50),
+            "wait_p95_seconds": percentile(0.95),
+            "wait_max_seconds": round(waits[-1], 4) if waits else 0.0,
+        }
+
+
+llm_admission = FairShareLimiter(
+    "deepseek",
+    max_concurrent=settings.LLM_MAX_CONCURRENT,
+    max_queue_depth=settings.LLM_MAX_QUEUE_DEPTH,
+    max_queue_per_user=settings.LLM_MAX_QUEUE_PER_USER,
+    max_wait_seconds=settings.LLM_MAX_QUEUE_WAIT_SECONDS,
+)
@@ -0,0 +1,47 @@
+"""
+CPU-bound rendering of team photo renditions, run in photo_renditions' worker processes.
+
+Deliberately imports nothing from the backend besides Pillow: spawned workers import this
+module fresh, and pulling in crud or config would make every worker load settings and open
+the database. All bookkeeping stays in the parent (photo_renditions).
+"""
+import os
+import tempfile
+from typing import Dict
+
+from PIL import Image, ImageOps
+
+RENDITIONS = {"thumb": 160, "card": 640, "full": 1600} # name -> longest edge (px)
+FORMATS = {"webp": ("WEBP", ".webp", {"quality": 80, "method": 4}), "jpeg": ("JPEG", ".jpg", {"quality": 82, "optimize": True, "progressive": True})}
+
+
+def rendition_filename(original: str, name: str, fmt: str) -> str:
+    stem, _ = os.path.splitext(original)
+    return f"{stem}_{name}{FORMATS[fmt][1]}"
+
+
+def render_renditions(source_path: str, fmt: str) -> Dict[str, str]:
+    """Writes every rendition of `source_path` next to it; returns name -> file name. Runs in a worker process."""
+    pil_format, _, save_options = FORMATS[fmt]
+    directory, original = os.path.split(source_path)
+    largest = max(RENDITIONS.values())
+    with Image.open(source_path) as source:
+        source.draft("RGB", (largest, largest)) # JPEG only: decode at 1/2, 1/4 or 1/8 scale when big enough
+        image = ImageOps.exif_transpose(source) # Honour camera orientation; also loads the first frame
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha and pil_format == "WEBP" else "RGB")
+
+    written = {}
+    for name, max_edge in sorted(RENDITIONS.items(), key=lambda item: -item[1]):
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS) # Shrinks in place, largest first
+        filename = rendition_filename(original, name, fmt)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                image.save(temp_file, pil_format, **save_options)
+            os.replace(temp_path, os.path.join(directory, filename))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        written[name] = filename
+    return written
@@ -0,0 +1,84 @@
+"""
+Resized renditions of uploaded team photos, so list screens don't download full-size originals.
+
+After an upload, `schedule_renditions` renders every entry of RENDITIONS (longest edge in
+pixels, never upscaled) next to the original as `<stem>_<name>.webp` (or `.jpg` with
+TEAM_PHOTO_RENDITION_FORMAT=jpeg), then stores their URLs on the team's `photo_renditions`.
+Until that finishes, clients keep using `photo_url`.
+
+Decoding and encoding are CPU-bound and hold the GIL, so they run in a process pool of
+TEAM_PHOTO_WORKERS processes rather than on the event loop or in threads; the rendering itself
+lives in photo_render, which workers import without the rest of the backend. JPEG sources are
+decoded at reduced scale (Pillow draft mode) when the largest rendition allows it. Each file
+is written to a temp name and renamed into place, so a URL never points at a partial image.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Set
+
+from .. import crud
+from ..config import settings
+from . import photo_storage
+from .photo_render import RENDITIONS, render_renditions, rendition_filename
+
+pending: Set[asyncio.Task] = set()
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking the multi-threaded server process can deadlock the child
+        _pool = ProcessPoolExecutor(max_workers=settings.TEAM_PHOTO_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def create_renditions(team_id: str, original: str) -> Optional[Dict[str, str]]:
+    """Renders the renditions of uploaded file `original` and records their URLs on the team."""
+    fmt = settings.TEAM_PHOTO_RENDITION_FORMAT
+    written = {name: rendition_filename(original, name, fmt) for name in RENDITIONS}
+    if not await asyncio.to_thread(_all_stored, written.values()):
+        # Photos are content-addressed, so a photo already used by another team is rendered only once
+        source_path = os.path.join(photo_storage.UPLOAD_DIR, original)
+        written = await asyncio.get_running_loop().run_in_executor(_get_pool(), render_renditions, source_path, fmt)
+    urls = {name: photo_storage.photo_url(filename) for name, filename in written.items()}
+    if crud.update_group_activity_team_db(team_id, {"photo_renditions": urls}) is None:
+        # The team was deleted while we were rendering; drop the renditions unless another team uses the photo
+        if crud.get_photo_ref_count_db(original) == 0:
+            for filename in written.values():
+                await asyncio.to_thread(photo_storage.remove_file, filename)
+        return None
+    return urls
+
+
+def _all_stored(filenames) -> bool:
+    return all(os.path.exists(os.path.join(photo_storage.UPLOAD_DIR, filename)) for filename in filenames)
+
+
+def schedule_renditions(team_id: str, original: str) -> None:
+    """Creates the renditions in the background; failures are logged and leave only the original."""
+
+    async def run() -> None:
+        try:
+            await create_renditions(team_id, original)
+        except Exception as exc:
+            print(f"Photo renditions failed for team {team_id}: {exc}")
+
+    task = asyncio.get_running_loop().create_task(run())
+    pending.add(task)
+    task.add_done_callback(pending.discard)
+
+
+async def drain() -> None:
+    """Waits for every running rendition task (tests, shutdown)."""
+    while pending:
+        await asyncio.gather(*list(pending), return_exceptions=True)
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
@@ -0,0 +1,211 @@
+"""
+Team photo uploads, stored under backend/static/uploads/team_photos and served via /static.
+
+The store is content-addressed: a photo's file name is the SHA-256 of its bytes plus the
+sniffed extension, so the same image uploaded for many teams is stored (and rendered, and
+cached by clients) once. Teams hold references counted in the photo_refs table (see crud);
+deleting the last team that uses a photo removes the file and its renditions (`collect_photo`).
+Placing a file and recording its reference happen with no await in between, and an upload of a
+photo that is being collected waits for the collection to finish and then stores a fresh copy,
+so a team never ends up pointing at a deleted file.
+
+`save_upload` streams the upload in TEAM_PHOTO_CHUNK_BYTES chunks into a temp file in the
+upload directory, with every file write done in a worker thread so a large or slow upload
+never blocks the event loop. The size limit (TEAM_PHOTO_MAX_BYTES) is enforced while reading,
+the image type is sniffed from the first bytes (the client's filename and content type are
+not trusted), the content hash is computed on the way, and the finished file is moved into
+place atomically with os.replace, so a half-written photo is never visible under its final name.
+
+Photos that arrive as bytes rather than uploads (legacy `photo_base64` fields, see
+crud.create_group_activity_team_db and database_data/migrate_team_photos.py) go through
+`store_photo_bytes`, so team documents only ever hold a `photo_url` reference.
+"""
+import asyncio
+import base64
+import glob
+import hashlib
+import os
+import tempfile
+from typing import Any, Dict, Optional
+
+from fastapi import UploadFile
+
+from ..config import settings
+
+UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static", "uploads", "team_photos")
+UPLOAD_URL_PREFIX = "/static/uploads/team_photos"
+TEAM_PHOTO_CHUNK_BYTES = 64 * 1024
+SNIFF_BYTES = 12 # enough for every signature below
+
+stats_counters = {"stored": 0, "deduplicated": 0, "removed": 0}
+_collecting: Dict[str, asyncio.Event] = {} # file name -> set once collect_photo has deleted it
+
+
+class PhotoTooLarge(ValueError):
+    """The upload exceeds TEAM_PHOTO_MAX_BYTES."""
+
+
+class UnsupportedPhotoType(ValueError):
+    """The upload is not a JPEG, PNG, GIF or WebP image."""
+
+
+def sniff_image_extension(head: bytes) -> Optional[str]:
+    """File extension for the image format whose magic bytes start `head`, else None."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def photo_url(filename: str) -> str:
+    return f"{UPLOAD_URL_PREFIX}/{filename}"
+
+
+def filename_from_url(url: Optional[str]) -> Optional[str]:
+    """The stored file name behind a photo_url, or None for URLs outside the photo store."""
+    if not url or not url.startswith(f"{UPLOAD_URL_PREFIX}/"):
+        return None
+    return url[len(UPLOAD_URL_PREFIX) + 1:]
+
+
+def _place(temp_path: str, digest: str, extension: str) -> str:
+    """Moves a complete temp file to its content-addressed name, or drops it if that photo is already stored."""
+    filename = f"{digest}{extension}"
+    final_path = os.path.join(UPLOAD_DIR, filename)
+    if os.path.exists(final_path):
+        _remove_quietly(temp_path)
+        stats_counters["deduplicated"] += 1
+    else:
+        os.replace(temp_path, final_path)
+        stats_counters["stored"] += 1
+    return filename
+
+
+async def save_upload(upload: UploadFile, max_bytes: Optional[int] = None) -> str:
+    """
+    Stores `upload` under UPLOAD_DIR (unless identical content is already stored) and returns its file name.
+
+    Raises:
+        PhotoTooLarge: if the upload is bigger than `max_bytes` (default TEAM_PHOTO_MAX_BYTES).
+        UnsupportedPhotoType: if the content is not a supported image format.
+    """
+    max_bytes = settings.TEAM_PHOTO_MAX_BYTES if max_bytes is None else max_bytes
+    if upload.size is not None and upload.size > max_bytes:
+        raise PhotoTooLarge(f"Photo is larger than {max_bytes} bytes")
+
+    await asyncio.to_thread(os.makedirs, UPLOAD_DIR, exist_ok=True)
+    # Same directory as the destination, so the final os.replace is an atomic rename
+    fd, temp_path = await asyncio.to_thread(tempfile.mkstemp, dir=UPLOAD_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            head = b""
+            extension = None
+            size = 0
+            digest = hashlib.sha256()
+            while chunk := await upload.read(TEAM_PHOTO_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise PhotoTooLarge(f"Photo is larger than {max_bytes} bytes")
+                if extension is None:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                    if len(head) >= SNIFF_BYTES:
+                        extension = sniff_image_extension(head)
+                        if extension is None:
+                            raise UnsupportedPhotoType("Photo must be a JPEG, PNG, GIF or WebP image")
+                digest.update(chunk)
+                await asyncio.to_thread(temp_file.write, chunk)
+            if extension is None:
+                extension = sniff_image_extension(head) # Uploads shorter than SNIFF_BYTES
+                if extension is None:
+                    raise UnsupportedPhotoType("Photo must be a JPEG, PNG, GIF or WebP image")
+        await upload.close() # Closing a spooled upload awaits a thread, so it must happen before placing
+        filename = f"{digest.hexdigest()}{extension}"
+        while filename in _collecting:
+            await _collecting[filename].wait() # Don't deduplicate onto a file that is being deleted
+        # A rename/unlink is cheap, and doing it on the loop means no other request runs between
+        # the photo landing under its name and the caller recording its team's reference to it
+        return _place(temp_path, digest.hexdigest(), extension)
+    except BaseException:
+        await asyncio.to_thread(_remove_quietly, temp_path)
+        await upload.close()
+        raise
+
+
+def decode_base64_photo(data: str) -> bytes:
+    """Raw bytes of a base64 photo, with or without a `data:image/...;base64,` prefix."""
+    if data.startswith("data:"):
+        data = data.split(",", 1)[1]
+    return base64.b64decode(data, validate=True)
+
+
+def store_photo_bytes(data: bytes) -> str:
+    """
+    Stores an in-memory photo (e.g. decoded photo_base64) under UPLOAD_DIR, unless identical
+    content is already stored, and returns its file name. Blocking.
+
+    Raises:
+        UnsupportedPhotoType: if the content is not a supported image format.
+    """
+    extension = sniff_image_extension(data[:SNIFF_BYTES])
+    if extension is None:
+        raise UnsupportedPhotoType("Photo must be a JPEG, PNG, GIF or WebP image")
+    digest = hashlib.sha256(data).hexdigest()
+    if os.path.exists(os.path.join(UPLOAD_DIR, f"{digest}{extension}")):
+        stats_counters["deduplicated"] += 1
+        return f"{digest}{extension}"
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(data)
+        return _place(temp_path, digest, extension)
+    except BaseException:
+        _remove_quietly(temp_path)
+        raise
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_file(filename: str) -> None:
+    """Deletes one stored file (blocking; call via asyncio.to_thread from async code)."""
+    _remove_quietly(os.path.join(UPLOAD_DIR, filename))
+
+
+def remove_photo(filename: str) -> None:
+    """Deletes a stored photo and all its renditions (`<stem>_<name>.*`). Blocking."""
+    stem, _ = os.path.splitext(filename)
+    for path in [os.path.join(UPLOAD_DIR, filename)] + glob.glob(os.path.join(glob.escape(UPLOAD_DIR), f"{glob.escape(stem)}_*")):
+        _remove_quietly(path)
+    stats_counters["removed"] += 1
+
+
+async def collect_photo(filename: str) -> None:
+    """
+    Deletes a photo whose last reference was just released, with its renditions, in a worker
+    thread. Call it right after the release, with no await in between.
+    """
+    _collecting[filename] = asyncio.Event()
+    try:
+        await asyncio.to_thread(remove_photo, filename)
+    finally:
+        _collecting.pop(filename).set()
+
+
+def reset() -> None:
+    _collecting.clear()
+    for key in stats_counters:
+        stats_counters[key] = 0
+
+
+def stats() -> Dict[str, Any]:
+    return dict(stats_counters)
@@ -0,0 +1,114 @@
+"""
+Cache for Google Places nearby searches.
+
+Users a few metres apart produce the same upstream search, so results are cached per
+(geohash cell, radius bucket) rather than per exact coordinate. Each cached place keeps its
+own coordinates, which lets a hit for any point in the cell recompute `distance` locally
+and filter to the caller's exact radius. The upstream search (see `search_area`) is centred
+on the cell, not on whichever caller missed first, with the bucket radius (rounded up) plus
+the cell's half-diagonal, so a cached entry covers every point in the cell and every radius
+that maps to its bucket.
+
+Entries expire after PLACES_CACHE_TTL_SECONDS and the least recently used entry is evicted
+beyond PLACES_CACHE_MAX_ENTRIES. Expired entries are not served by `get()` but stay until
+evicted or refreshed, so `get_stale()` can still answer while Google is unavailable.
+Hit/miss counters are exposed via `stats()`.
+"""
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..config import settings
+from ..schemas import GymNearbyResponse
+from .geo_utils import geohash_encode, geohash_bounds, calculate_distance_haversine
+
+PLACES_CACHE_GEOHASH_PRECISION = 7 # ~153 m cells
+RADIUS_BUCKETS_METERS = (1000, 2000, 5000, 10000, 20000, 50000) # 50 km is the Places API maximum
+
+
+@dataclass(frozen=True)
+class CachedPlace:
+    gym: GymNearbyResponse # Everything except `distance`, which depends on the caller's position
+    latitude: float
+    longitude: float
+
+
+def radius_bucket(radius_meters: int) -> int:
+    """Rounds a search radius up to the nearest cache bucket."""
+    for bucket in RADIUS_BUCKETS_METERS:
+        if radius_meters <= bucket:
+            return bucket
+    return RADIUS_BUCKETS_METERS[-1]
+
+
+def cache_key(latitude: float, longitude: float, radius_meters: int) -> Tuple[str, int]:
+    return geohash_encode(latitude, longitude, PLACES_CACHE_GEOHASH_PRECISION), radius_bucket(radius_meters)
+
+
+def search_area(key: Tuple[str, int]) -> Tuple[float, float, int]:
+    """(latitude, longitude, radius_meters) of the Places search that fills the entry for `key`."""
+    min_lat, max_lat, min_lon, max_lon = geohash_bounds(key[0])
+    latitude, longitude = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+    half_diagonal_km = max(calculate_distance_haversine(latitude, longitude, corner, max_lon) for corner in (min_lat, max_lat))
+    radius_meters = key[1] + math.ceil(half_diagonal_km * 1000) + 10 # The haversine helper rounds to 10 m
+    # The largest bucket is already the Places maximum; it can only be searched as is
+    return latitude, longitude, min(radius_meters, RADIUS_BUCKETS_METERS[-1])
+
+
+class PlacesCache:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[Tuple[str, int], Tuple[float, List[CachedPlace]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+
+    def get(self, key: Tuple[str, int]) -> Optional[List[CachedPlace]]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def get_stale(self, key: Tuple[str, int]) -> Optional[List[CachedPlace]]:
+        """Last result stored for `key`, even if expired (fallback when the upstream is down)."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.stale_hits += 1
+        return entry[1]
+
+    def put(self, key: Tuple[str, int], places: List[CachedPlace]) -> None:
+        self.entries[key] = (time.monotonic() + self.ttl_seconds, places)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def reset(self) -> None:
+        """Clears entries and counters."""
+        self.clear()
+        self.hits = self.misses = self.evictions = self.stale_hits = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.entries),
+            "evictions": self.evictions,
+            "stale_hits": self.stale_hits,
+        }
+
+
+places_cache = PlacesCache(max_entries=settings.PLACES_CACHE_MAX_ENTRIES, ttl_seconds=settings.PLACES_CACHE_TTL_SECONDS)
@@ -0,0 +1,69 @@
+"""
+Single-flight coalescing for upstream calls.
+
+When several requests need the same upstream result at the same time (e.g. many users opening
+"around you" from one venue), only the first caller runs the call; callers arriving while it
+is in flight await the same task and receive its result or exception. Nothing is cached once
+the call completes; pair this with a cache (see places_cache) for that.
+
+The shared call runs as its own task, so a cancelled caller (client disconnect) does not
+cancel the call for everyone else. By default it keeps running even once every caller has
+gone away (it may still fill a cache); calls made with keep_running=False are cancelled then
+instead, so they stop holding upstream capacity nobody will use.
+Results are shared objects: callers must not mutate them.
+"""
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self.in_flight: Dict[Hashable, "asyncio.Task[Any]"] = {}
+        self.calls = 0 # Upstream calls actually made
+        self.coalesced = 0 # Callers served by another caller's in-flight call
+        self._waiters: Counter = Counter() # task -> callers awaiting it
+        self._kept: Set["asyncio.Task[Any]"] = set() # tasks some caller asked to keep running
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]], keep_running: bool = True) -> T:
+        """
+        Runs fn() unless a call for `key` is already in flight, in which case it awaits that one.
+        With keep_running=False the call is cancelled once all its callers are gone, unless
+        another caller asked to keep it.
+        """
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done, key=key: self._finished(key, done))
+        if keep_running:
+            self._kept.add(task)
+        self._waiters[task] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done() and task not in self._kept:
+                    task.cancel()
+
+    def _finished(self, key: Hashable, task: "asyncio.Task[Any]") -> None:
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        self._kept.discard(task)
+        if not task.cancelled():
+            task.exception() # Mark retrieved even if every caller went away
+
+    def reset(self) -> None:
+        """Clears counters. In-flight calls keep running and still deliver to their callers."""
+        self.calls = self.coalesced = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self.in_flight)}
@@ -1,27 +1,72 @@
+import base64
 import pytest
+import httpx
 from fastapi.testclient import TestClient
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 from unittest.mock import patch, AsyncMock
+from tinydb import Query
 
 from backend.main import app
-from backend.database import UserTable, GymTable, GroupActivityTeamTable
+from backend.database import UserTable, GymTable, GroupActivityTeamTable, RefreshTokenTable, RevokedTokenTable, PlaceMatchTable, DailyTipTable, BatchJobTable, PhotoRefTable
 from backend.models import Gym, GroupActivityTeam
-from backend import crud, auth
+from backend import crud, auth, revocation, rate_limiter
+from backend.services import http_clients, gcloud_service, ai_coach_service, places_cache, photo_storage
+from backend.services.gym_geo_index import gym_geo_index, GymGeoIndex
+from backend.services.gym_name_index import gym_name_index, GymNameIndex
+from backend.services.coach_sessions import coach_sessions, CoachSessionStore
+from backend.services.coach_response_cache import coach_response_cache
+from backend.services.llm_admission import llm_admission, FairShareLimiter, AdmissionRejected
 
 client = TestClient(app)
 
 @pytest.fixture(scope="function")
-def clean_db():
+def clean_db(tmp_path):
     """Clean database and in-memory code store before each test"""
     UserTable.truncate()
     GymTable.truncate()
     GroupActivityTeamTable.truncate()
+    RefreshTokenTable.truncate()
+    RevokedTokenTable.truncate()
+    PlaceMatchTable.truncate()
+    DailyTipTable.truncate()
+    BatchJobTable.truncate()
+    PhotoRefTable.truncate()
+    rate_limiter.reset_rate_limiters()
+    places_cache.places_cache.reset()
+    gcloud_service.places_flight.reset()
+    gcloud_service.places_breaker.reset()
+    ai_coach_service.completion_flight.reset()
+    coach_sessions.clear()
+    coach_response_cache.reset()
+    llm_admission.reset()
+    gym_geo_index.clear()
+    gym_name_index.clear()
+    photo_storage.reset()
     auth.temp_code_store.clear()
-    yield
+    auth.token_cache.clear()
+    with patch.object(photo_storage, "UPLOAD_DIR", str(tmp_path)): # Keep test photos out of backend/static
+        yield
     UserTable.truncate()
     GymTable.truncate()
     GroupActivityTeamTable.truncate()
+    RefreshTokenTable.truncate()
+    RevokedTokenTable.truncate()
+    PlaceMatchTable.truncate()
+    DailyTipTable.truncate()
+    BatchJobTable.truncate()
+    PhotoRefTable.truncate()
+    rate_limiter.reset_rate_limiters()
+    places_cache.places_cache.reset()
+    gcloud_service.places_flight.reset()
+    gcloud_service.places_breaker.reset()
+    ai_coach_service.completion_flight.reset()
+    coach_sessions.clear()
+    coach_response_cache.reset()
+    llm_admission.reset()
+    gym_geo_index.clear()
+    gym_name_index.clear()
     auth.temp_code_store.clear()
+    auth.token_cache.clear()
 
 @pytest.fixture
 def sample_user_data():
@@ -87,6 +132,7 @@ def authenticated_user(clean_db, sample_user_data):
     token_data = verify_response.json()
     return {
         "token": token_data["access_token"],
+        "refresh_token": token_data["refresh_token"],
         "user_id": user_details_from_signup["user_id"],
         "email": sample_user_data["email"]
     }
@@ -744,5 +790,1693 @@ class TestErrorHandling:
         response = client.post("/api/v1/auth/signup", json=incomplete_data)
         assert response.status_code == 422
 
+class TestTokenCache:
+
+    def test_reused_token_skips_jwt_decode(self, authenticated_user):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        assert client.get("/api/v1/users/me", headers=headers).status_code == 200
+
+        with patch('backend.dependencies.jwt.decode') as mock_decode:
+            response = client.get("/api/v1/users/me", headers=headers)
+            assert response.status_code == 200
+            mock_decode.assert_not_called()
+
+    def test_user_update_invalidates_cached_principal(self, authenticated_user):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        client.get("/api/v1/users/me", headers=headers)
+        client.put("/api/v1/users/me/profile", json={"name": "Renamed"}, headers=headers)
+
+        response = client.get("/api/v1/users/me", headers=headers)
+        assert response.json()["name"] == "Renamed"
+
+    def test_password_reset_invalidates_cached_principal(self, authenticated_user):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        client.get("/api/v1/users/me", headers=headers)
+        assert len(auth.token_cache) == 1
+
+        reset_code = auth.create_email_verification_code(email=authenticated_user["email"], code_type="password_reset_code")
+        client.post("/api/v1/auth/confirm-password-reset", json={
+            "email": authenticated_user["email"],
+            "code": reset_code,
+            "new_password": "newpassword123"
+        })
+        assert len(auth.token_cache) == 0
+
+    def test_expired_cache_entry_is_dropped(self, authenticated_user):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        client.get("/api/v1/users/me", headers=headers)
+        entry = next(iter(auth.token_cache.values()))
+        entry["exp"] = 0
+
+        assert auth.get_cached_token_user(authenticated_user["token"]) is None
+        assert len(auth.token_cache) == 0
+
+class TestRefreshTokens:
+
+    def test_verify_2fa_returns_refresh_token(self, authenticated_user):
+        assert authenticated_user["refresh_token"]
+        assert RefreshTokenTable.count(Query().email == authenticated_user["email"]) == 1
+
+    def test_refresh_issues_new_pair_without_bcrypt_or_email(self, authenticated_user):
+        with patch('backend.auth.verify_password') as mock_verify, \
+             patch('backend.services.email_service.send_2fa_login_email', new_callable=AsyncMock) as mock_send_email:
+            response = client.post("/api/v1/auth/refresh", json={"refresh_token": authenticated_user["refresh_token"]})
+            assert response.status_code == 200
+            mock_verify.assert_not_called()
+            mock_send_email.assert_not_called()
+
+        data = response.json()
+        assert data["refresh_token"] != authenticated_user["refresh_token"]
+        me_response = client.get("/api/v1/users/me", headers={"Authorization": f"Bearer {data['access_token']}"})
+        assert me_response.status_code == 200
+
+    def test_refresh_token_reuse_revokes_family(self, authenticated_user):
+        first = client.post("/api/v1/auth/refresh", json={"refresh_token": authenticated_user["refresh_token"]})
+        assert first.status_code == 200
+
+        reuse = client.post("/api/v1/auth/refresh", json={"refresh_token": authenticated_user["refresh_token"]})
+        assert reuse.status_code == 401
+        # The legitimately rotated token is revoked along with the rest of the family
+        second = client.post("/api/v1/auth/refresh", json={"refresh_token": first.json()["refresh_token"]})
+        assert second.status_code == 401
+
+    def test_expired_refresh_token_records_are_purged(self, authenticated_user):
+        email = authenticated_user["email"]
+        past = datetime.now(timezone.utc) - timedelta(days=1)
+        crud.create_refresh_token_record_db(jti="old-rotated", email=email, expires_at=past)
+        crud.mark_refresh_token_rotated_db("old-rotated")
+        crud.create_refresh_token_record_db(jti="other-user", email="other@example.com", expires_at=past)
+        assert RefreshTokenTable.count(Query().email == email) == 2
+
+        response = client.post("/api/v1/auth/refresh", json={"refresh_token": authenticated_user["refresh_token"]})
+        assert response.status_code == 200
+        # Issuing drops the user's expired records; the rotated live one stays for reuse detection
+        assert crud.get_refresh_token_record_db("old-rotated") is None
+        assert RefreshTokenTable.count(Query().email == email) == 2
+        assert crud.purge_expired_refresh_tokens_db() == 1 # Startup purge: other users' records
+        assert crud.get_refresh_token_record_db("other-user") is None
+
+    def test_refresh_token_is_not_a_bearer_token(self, authenticated_user):
+        headers = {"Authorization": f"Bearer {authenticated_user['refresh_token']}"}
+        response = client.get("/api/v1/users/me", headers=headers)
+        assert response.status_code == 401
+
+    def test_access_token_cannot_refresh(self, authenticated_user):
+        response = client.post("/api/v1/auth/refresh", json={"refresh_token": authenticated_user["token"]})
+        assert response.status_code == 401
+
+    def test_password_reset_revokes_refresh_tokens(self, authenticated_user):
+        reset_code = auth.create_email_verification_code(email=authenticated_user["email"], code_type="password_reset_code")
+        client.post("/api/v1/auth/confirm-password-reset", json={
+            "email": authenticated_user["email"],
+            "code": reset_code,
+            "new_password": "newpassword123"
+        })
+        response = client.post("/api/v1/auth/refresh", json={"refresh_token": authenticated_user["refresh_token"]})
+        assert response.status_code == 401
+
+class TestTokenRevocation:
+
+    def test_logout_revokes_access_and_refresh_tokens(self, authenticated_user):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        assert client.get("/api/v1/users/me", headers=headers).status_code == 200
+
+        response = client.post("/api/v1/auth/logout", json={"refresh_token": authenticated_user["refresh_token"]}, headers=headers)
+        assert response.status_code == 200
+
+        assert client.get("/api/v1/users/me", headers=headers).status_code == 401
+        refresh_response = client.post("/api/v1/auth/refresh", json={"refresh_token": authenticated_user["refresh_token"]})
+        assert refresh_response.status_code == 401
+
+    def test_revocation_survives_filter_rebuild(self, authenticated_user):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        client.post("/api/v1/auth/logout", headers=headers)
+
+        revocation.rebuild_revocation_filter()
+        auth.token_cache.clear()
+        assert client.get("/api/v1/users/me", headers=headers).status_code == 401
+
+    def test_non_revoked_token_skips_table_lookup(self, authenticated_user):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        revocation.rebuild_revocation_filter()
+        auth.token_cache.clear()
+
+        with patch('backend.crud.is_token_revoked_db') as mock_lookup:
+            assert client.get("/api/v1/users/me", headers=headers).status_code == 200
+            mock_lookup.assert_not_called()
+
+    def test_password_reset_revokes_issued_access_tokens(self, authenticated_user):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        reset_code = auth.create_email_verification_code(email=authenticated_user["email"], code_type="password_reset_code")
+        client.post("/api/v1/auth/confirm-password-reset", json={
+            "email": authenticated_user["email"],
+            "code": reset_code,
+            "new_password": "newpassword123"
+        })
+        assert client.get("/api/v1/users/me", headers=headers).status_code == 401
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = revocation.BloomFilter(capacity=1000, error_rate=0.01)
+        items = [f"jti-{i}" for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        assert all(item in bloom for item in items)
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        assert false_positives < 500
+
+class TestRateLimiting:
+
+    def test_login_is_throttled_per_email(self, clean_db, sample_user_data):
+        client.post("/api/v1/auth/signup", json=sample_user_data)
+        bad_login = {"email": sample_user_data["email"], "password": "wrongpassword"}
+        for _ in range(int(rate_limiter.login_email_limiter.capacity)):
+            assert client.post("/api/v1/auth/login", json=bad_login).status_code == 401
+
+        with patch('backend.auth.verify_password') as mock_verify:
+            response = client.post("/api/v1/auth/login", json=bad_login)
+            mock_verify.assert_not_called() # Rejected before bcrypt runs
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+
+    def test_verify_2fa_is_throttled_per_email(self, clean_db, sample_user_data):
+        payload = {"email": sample_user_data["email"], "code": "000000"}
+        for _ in range(int(rate_limiter.verify_2fa_limiter.capacity)):
+            assert client.post("/api/v1/auth/verify-2fa-code", json=payload).status_code == 400
+        assert client.post("/api/v1/auth/verify-2fa-code", json=payload).status_code == 429
+
+    @patch('backend.routers.ai_coach_router.get_ai_coach_response', new_callable=AsyncMock)
+    def test_ai_coach_is_throttled_per_user(self, mock_ai, authenticated_user):
+        mock_ai.return_value = "Keep going!"
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        payload = {"messages": [{"role": "user", "content": "How do I start running?"}]}
+        for _ in range(int(rate_limiter.ai_coach_limiter.capacity)):
+            assert client.post("/api/v1/ai-coach/", json=payload, headers=headers).status_code == 200
+
+        response = client.post("/api/v1/ai-coach/", json=payload, headers=headers)
+        assert response.status_code == 429
+        assert "Retry-After" in response.headers
+
+    def test_client_ip_honours_forwarded_for_only_from_trusted_proxies(self):
+        from starlette.requests import Request
+
+        def request(peer, forwarded=None):
+            headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+            return Request({"type": "http", "client": (peer, 1234), "headers": headers})
+
+        assert rate_limiter.client_ip(request("203.0.113.9", "1.2.3.4")) == "203.0.113.9" # No trusted proxies by default
+        with patch('backend.config.settings.RATE_LIMIT_TRUSTED_PROXIES', "10.0.0.2, 10.0.0.3"):
+            assert rate_limiter.client_ip(request("203.0.113.9", "1.2.3.4")) == "203.0.113.9" # Untrusted peer: header ignored
+            assert rate_limiter.client_ip(request("10.0.0.2", "1.2.3.4, 198.51.100.7, 10.0.0.3")) == "198.51.100.7" # Spoofed left entry ignored
+            assert rate_limiter.client_ip(request("10.0.0.2")) == "10.0.0.2"
+
+    def test_token_bucket_refills_and_evicts(self):
+        limiter = rate_limiter.TokenBucketLimiter("test", capacity=2, refill_per_second=1000.0, max_keys=2)
+        assert limiter.hit("a") == 0.0
+        assert limiter.hit("a") == 0.0
+        assert limiter.hit("a") > 0.0
+        limiter.buckets["a"][1] -= 1.0 # Pretend a second has passed
+        assert limiter.hit("a") == 0.0
+
+        limiter.hit("b")
+        limiter.hit("c")
+        assert "a" not in limiter.buckets
+        assert len(limiter.buckets) == 2
+
+@pytest.fixture
+def mock_upstream():
+    """Route an upstream's shared HTTP client through an in-process httpx.MockTransport"""
+    routed = []
+
+    def _route(name, handler):
+        routed.append(name)
+        http_clients.set_transport(name, httpx.MockTransport(handler))
+
+    yield _route
+    for name in routed:
+        http_clients.set_transport(name, None)
+
+def places_payload(*places):
+    return {
+        "status": "OK",
+        "results": [
+            {"place_id": place_id, "name": name, "vicinity": f"{name} street",
+             "geometry": {"location": {"lat": lat, "lng": lng}}}
+            for place_id, name, lat, lng in places
+        ],
+    }
+
+class TestOutboundHttpClients:
+
+    def test_lifespan_creates_and_closes_shared_clients(self):
+        with TestClient(app):
+            assert set(http_clients._clients) == set(http_clients.UPSTREAMS)
+            places_client = http_clients.get_client("google_places")
+            assert http_clients.get_client("google_places") is places_client
+        assert http_clients._clients == {}
+
+    @pytest.mark.asyncio
+    async def test_places_calls_reuse_shared_client(self, clean_db, mock_upstream):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json=places_payload(("place_1", "Iron Temple", 30.0450, 31.2360)))
+
+        mock_upstream("google_places", handler)
+        first = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357, radius_meters=5000)
+        client_after_first = http_clients.get_client("google_places")
+        await gcloud_service.find_nearby_gyms(latitude=40.0, longitude=-73.0, radius_meters=5000)
+
+        assert first[0].name == "Iron Temple"
+        assert http_clients.get_client("google_places") is client_after_first
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_ai_coach_uses_mock_transport(self, mock_upstream):
+        def handler(request):
+            return httpx.Response(200, json={"choices": [{"message": {"content": " Stay hydrated. "}}]})
+
+        mock_upstream("deepseek", handler)
+        reply = await ai_coach_service.get_ai_coach_response(messages=[{"role": "user", "content": "hi"}])
+        assert reply == "Stay hydrated."
+
+class TestPlacesCache:
+
+    @pytest.mark.asyncio
+    async def test_nearby_points_share_cached_search(self, clean_db, mock_upstream):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json=places_payload(
+                ("place_1", "Iron Temple", 30.0500, 31.2400),
+                ("place_2", "Far Away Fitness", 30.3000, 31.5000),
+            ))
+
+        mock_upstream("google_places", handler)
+        first = await gcloud_service.find_nearby_gyms(latitude=30.04440, longitude=31.23570, radius_meters=5000)
+        # A few metres away, same geohash cell and radius bucket
+        second = await gcloud_service.find_nearby_gyms(latitude=30.04445, longitude=31.23575, radius_meters=4000)
+
+        assert len(calls) == 1
+        assert calls[0].url.params["radius"] == str(places_cache.search_area(places_cache.cache_key(30.0444, 31.2357, 5000))[2])
+        assert [gym.name for gym in first] == ["Iron Temple"] # Far Away Fitness is outside 5 km
+        assert second[0].distance == gcloud_service.calculate_distance_haversine(30.04445, 31.23575, 30.05, 31.24)
+        stats = places_cache.places_cache.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 1
+
+    @pytest.mark.asyncio
+    async def test_cached_search_covers_every_point_of_the_cell(self, clean_db, mock_upstream):
+        from backend.services.geo_utils import geohash_bounds
+        key = places_cache.cache_key(30.0444, 31.2357, 5000)
+        min_lat, max_lat, min_lon, max_lon = geohash_bounds(key[0])
+        first_corner = (min_lat + 1e-7, min_lon + 1e-7)
+        second_corner = (max_lat - 1e-7, max_lon - 1e-7)
+        # 4.9 km north-east of the second corner, about 5.1 km from the first one
+        place = (second_corner[0] + 4.9 / 111.2 * 0.7071, second_corner[1] + 4.9 / (111.2 * 0.866) * 0.7071)
+        assert gcloud_service.calculate_distance_haversine(*first_corner, *place) > 5.0
+        calls = []
+
+        def handler(request):
+            # Like Google: only places within the requested radius of the requested location
+            calls.append(request)
+            lat, lng = map(float, request.url.params["location"].split(","))
+            radius_km = int(request.url.params["radius"]) / 1000
+            inside = gcloud_service.calculate_distance_haversine(lat, lng, *place) <= radius_km
+            return httpx.Response(200, json=places_payload(*([("place_1", "Corner Gym", *place)] if inside else [])))
+
+        mock_upstream("google_places", handler)
+        await gcloud_service.find_nearby_gyms(*first_corner, radius_meters=5000)
+        second = await gcloud_service.find_nearby_gyms(*second_corner, radius_meters=5000)
+        assert len(calls) == 1
+        assert [gym.name for gym in second] == ["Corner Gym"]
+        center = f"{(min_lat + max_lat) / 2},{(min_lon + max_lon) / 2}"
+        assert calls[0].url.params["location"] == center
+
+    @pytest.mark.asyncio
+    async def test_failed_search_is_not_cached(self, clean_db, mock_upstream):
+        mock_upstream("google_places", lambda request: httpx.Response(500))
+        result = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357)
+        assert result == gcloud_service.get_mock_gyms()
+        assert places_cache.places_cache.stats()["entries"] == 0
+
+    def test_cache_evicts_least_recently_used_and_expires(self):
+        cache = places_cache.PlacesCache(max_entries=2, ttl_seconds=60)
+        cache.put(("a", 1000), [])
+        cache.put(("b", 1000), [])
+        cache.get(("a", 1000))
+        cache.put(("c", 1000), [])
+        assert ("b", 1000) not in cache.entries
+        assert cache.stats()["evictions"] == 1
+
+        cache.ttl_seconds = -1
+        cache.put(("d", 1000), [])
+        assert cache.get(("d", 1000)) is None
+
+    def test_metrics_endpoint_reports_places_cache(self):
+        response = client.get("/api/v1/metrics/")
+        assert response.status_code == 200
+        assert "hit_rate" in response.json()["places_cache"]
+
+class TestLocalGymGeoIndex:
+
+    def test_around_you_answers_registered_gyms_without_places(self, clean_db, mock_upstream):
+        near = Gym(name="Campus Gym", location="Giza", latitude=30.0260, longitude=31.2080)
+        far = Gym(name="Alexandria Gym", location="Alexandria", latitude=31.2001, longitude=29.9187)
+        no_coords = Gym(name="Unknown Gym", location="Somewhere")
+        for gym in (near, far, no_coords):
+            crud.create_gym_db(gym)
+
+        with patch('backend.config.settings.GOOGLE_API_KEY', 'your_google_maps_api_key'):
+            response = client.get("/api/v1/gyms/around-you?latitude=30.0270&longitude=31.2090&radius_meters=2000")
+        assert response.status_code == 200
+        data = response.json()
+        assert [gym["gym_id"] for gym in data] == [near.gym_id]
+        assert data[0]["distance"] < 0.5
+
+    @pytest.mark.asyncio
+    async def test_places_only_adds_unregistered_venues(self, clean_db, mock_upstream):
+        registered = Gym(name="Iron Temple", location="Cairo", latitude=30.0500, longitude=31.2400)
+        crud.create_gym_db(registered)
+        mock_upstream("google_places", lambda request: httpx.Response(200, json=places_payload(
+            ("place_1", "Iron Temple", 30.0500, 31.2400),
+            ("place_2", "Nile Boxing Club", 30.0460, 31.2370),
+        )))
+
+        first = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357, radius_meters=5000)
+        assert [gym.gym_id for gym in first] == [registered.gym_id] # Answered locally while Places fills the cache
+        await gcloud_service.drain()
+        results = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357, radius_meters=5000)
+        assert [gym.gym_id for gym in results] == [registered.gym_id, "place_2"]
+
+    @pytest.mark.asyncio
+    async def test_cache_miss_does_not_wait_on_places_when_local_gyms_answer(self, clean_db, mock_upstream):
+        import asyncio
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            await asyncio.sleep(0.5)
+            return httpx.Response(200, json=places_payload(("place_2", "Nile Boxing Club", 30.0460, 31.2370)))
+
+        mock_upstream("google_places", handler)
+        crud.create_gym_db(Gym(name="Campus Gym", location="Giza", latitude=30.0450, longitude=31.2360))
+        loop = asyncio.get_running_loop()
+
+        started = loop.time()
+        first = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357)
+        assert loop.time() - started < 0.2
+        assert [gym.name for gym in first] == ["Campus Gym"]
+
+        # Until the search lands, further requests join it instead of calling again
+        await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357)
+        await gcloud_service.drain()
+        assert len(calls) == 1
+
+        started = loop.time()
+        second = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357)
+        assert loop.time() - started < 0.2
+        assert [gym.name for gym in second] == ["Campus Gym", "Nile Boxing Club"]
+
+    def test_index_tracks_gym_updates(self, clean_db):
+        gym = Gym(name="Moving Gym", location="Cairo", latitude=30.0444, longitude=31.2357)
+        crud.create_gym_db(gym)
+        gym_geo_index.ensure_built(crud.get_all_gyms_db)
+        assert gym_geo_index.query(30.0444, 31.2357, 1.0)[0][0].gym_id == gym.gym_id
+
+        crud.update_gym_db(gym.gym_id, {"latitude": 31.2001, "longitude": 29.9187})
+        assert gym_geo_index.query(30.0444, 31.2357, 1.0) == []
+        assert gym_geo_index.query(31.2001, 29.9187, 1.0)[0][0].gym_id == gym.gym_id
+
+    def test_grid_query_matches_brute_force(self):
+        import random
+        rng = random.Random(42)
+        gyms = [Gym(name=f"Gym {i}", location="x", latitude=30 + rng.uniform(-0.5, 0.5), longitude=31 + rng.uniform(-0.5, 0.5))
+                for i in range(500)]
+        index = GymGeoIndex()
+        index.rebuild(gyms)
+        expected = sorted(
+            (gcloud_service.calculate_distance_haversine(30.1, 31.1, g.latitude, g.longitude), g.gym_id)
+            for g in gyms
+            if gcloud_service.calculate_distance_haversine(30.1, 31.1, g.latitude, g.longitude) <= 12.0
+        )
+        got = [(dist, gym.gym_id) for gym, dist in index.query(30.1, 31.1, 12.0)]
+        assert sorted(got) == expected
+
+class TestGymNameIndex:
+
+    def test_matches_full_scan_at_threshold(self):
+        from fuzzywuzzy import fuzz
+        import random
+        rng = random.Random(7)
+        words = ["gold's", "gym", "fitness", "first", "iron", "temple", "power", "house", "zen", "yoga",
+                 "crossfit", "cairo", "nile", "club", "24/7", "elite", "strength", "studio", "box", "x",
+                 "نادي", "الحديد", "جيم", "café"] # Non-ASCII characters share hashed count columns
+        gyms = [Gym(name=" ".join(rng.sample(words, rng.randint(1, 4))), location="x") for _ in range(300)]
+        index = GymNameIndex(threshold=70)
+        index.rebuild(gyms)
+
+        def full_scan(place_name):
+            matched, best_score = None, -1
+            for gym in gyms:
+                score = fuzz.ratio(place_name.lower(), gym.name.lower())
+                if score > best_score and score >= 70:
+                    best_score, matched = score, gym
+            return matched
+
+        queries = [" ".join(rng.sample(words, rng.randint(1, 4))) for _ in range(300)]
+        queries += [gym.name.upper() for gym in gyms[:20]] + ["Gold's Gym Cairo", "", "N/A"]
+        for query in queries:
+            assert index.best_match(query) is full_scan(query), query
+
+    def test_prunes_unrelated_names(self):
+        gyms = [Gym(name=f"Zumba Studio {i}", location="x") for i in range(200)] + [Gym(name="Iron Temple", location="x")]
+        index = GymNameIndex(threshold=70)
+        index.rebuild(gyms)
+        assert len(index.candidates("Iron Temple Gym")) < 10
+        assert index.best_match("Iron Temple Gym").name == "Iron Temple"
+
+    def test_index_reloads_after_gym_writes(self, clean_db):
+        crud.create_gym_db(Gym(name="Iron Temple", location="x"))
+        gym_name_index.ensure_built(crud.get_all_gyms_db)
+        assert gym_name_index.best_match("Iron Temple").name == "Iron Temple"
+
+        crud.create_gym_db(Gym(name="Nile Boxing Club", location="x"))
+        gym_name_index.ensure_built(crud.get_all_gyms_db)
+        assert gym_name_index.best_match("Nile Boxing").name == "Nile Boxing Club"
+
+class TestPlaceMatchCache:
+
+    @pytest.mark.asyncio
+    async def test_resolved_places_skip_fuzzy_matching(self, clean_db, mock_upstream):
+        crud.create_gym_db(Gym(name="Iron Temple", location="Zamalek"))
+        mock_upstream("google_places", lambda request: httpx.Response(200, json=places_payload(
+            ("place_1", "Iron Temple Gym", 30.05, 31.24),
+            ("place_2", "Nile Yoga Loft", 30.05, 31.24),
+        )))
+
+        first = await gcloud_service.fetch_places(30.0444, 31.2357, radius_meters=5000)
+        matches = crud.get_all_place_matches_db()
+        assert matches["place_1"]["gym_id"] == first[0].gym.gym_id
+        assert matches["place_2"]["gym_id"] is None
+
+        with patch.object(gym_name_index, "best_match", side_effect=AssertionError("fuzzy matched again")):
+            second = await gcloud_service.fetch_places(30.0444, 31.2357, radius_meters=5000)
+        assert [place.gym for place in second] == [place.gym for place in first]
+
+    @pytest.mark.asyncio
+    async def test_gym_writes_invalidate_matches(self, clean_db, mock_upstream):
+        mock_upstream("google_places", lambda request: httpx.Response(200, json=places_payload(
+            ("place_1", "Nile Yoga Loft", 30.05, 31.24),
+        )))
+        await gcloud_service.fetch_places(30.0444, 31.2357, radius_meters=5000)
+        assert crud.get_all_place_matches_db()["place_1"]["gym_id"] is None
+
+        gym = Gym(name="Nile Yoga", location="Maadi")
+        crud.create_gym_db(gym)
+        assert crud.get_all_place_matches_db() == {}
+        places = await gcloud_service.fetch_places(30.0444, 31.2357, radius_meters=5000)
+        assert places[0].gym.gym_id == gym.gym_id
+
+        crud.update_gym_db(gym.gym_id, {"location": "Zamalek"})
+        assert "place_1" in crud.get_all_place_matches_db() # Non-name edits keep matches
+        crud.update_gym_db(gym.gym_id, {"name": "Heliopolis Boxing"})
+        assert crud.get_all_place_matches_db() == {}
+        places = await gcloud_service.fetch_places(30.0444, 31.2357, radius_meters=5000)
+        assert places[0].gym.gym_id == "place_1"
+
+    @pytest.mark.asyncio
+    async def test_registering_a_cached_place_does_not_list_it_twice(self, clean_db, mock_upstream):
+        mock_upstream("google_places", lambda request: httpx.Response(200, json=places_payload(
+            ("place_1", "Iron Temple", 30.0450, 31.2360),
+        )))
+        first = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357)
+        assert [gym.gym_id for gym in first] == ["place_1"]
+
+        gym = Gym(name="Iron Temple", location="Cairo", latitude=30.0450, longitude=31.2360)
+        crud.create_gym_db(gym)
+        for _ in range(2): # Before and after the background refresh
+            results = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357)
+            assert [result.gym_id for result in results] == [gym.gym_id]
+            await gcloud_service.drain()
+
+    @pytest.mark.asyncio
+    async def test_cached_matches_serve_current_gym_details(self, clean_db, mock_upstream):
+        gym = Gym(name="Iron Temple", location="Zamalek", token_per_visit=10.0) # No coordinates: only Places finds it
+        crud.create_gym_db(gym)
+        mock_upstream("google_places", lambda request: httpx.Response(200, json=places_payload(
+            ("place_1", "Iron Temple", 30.0450, 31.2360),
+        )))
+        await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357)
+        crud.update_gym_db(gym.gym_id, {"token_per_visit": 25.0})
+        [result] = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357)
+        assert result.gym_id == gym.gym_id and result.token_per_visit == 25.0
+        assert places_cache.places_cache.stats()["hits"] == 1
+
+class TestBatchDistances:
+
+    def test_batch_matches_scalar_loop(self):
+        import random
+        from backend.services import geo_utils
+        rng = random.Random(3)
+        lats = [30.0444 + rng.uniform(-0.1, 0.1) for _ in range(500)]
+        lons = [31.2357 + rng.uniform(-0.1, 0.1) for _ in range(500)]
+        lats += lats[:50] # Exact ties must keep input order
+        lons += lons[:50]
+
+        expected = []
+        for position, (lat, lon) in enumerate(zip(lats, lons)):
+            dist_km = geo_utils.calculate_distance_haversine(30.0444, 31.2357, lat, lon)
+            if dist_km <= 5:
+                expected.append((position, dist_km))
+        expected.sort(key=lambda pair: pair[1])
+
+        assert geo_utils.nearest_within(30.0444, 31.2357, lats, lons, radius_km=5) == expected
+        assert geo_utils.nearest_within(30.0444, 31.2357, lats, lons, radius_km=5, limit=25) == expected[:25]
+        assert geo_utils.nearest_within(30.0444, 31.2357, [], [], radius_km=5) == []
+
+    def test_geo_index_query_limit(self):
+        index = GymGeoIndex()
+        gyms = [Gym(name=f"Gym {i}", location="Cairo", latitude=30.0 + i * 0.001, longitude=31.2) for i in range(100)]
+        index.rebuild(gyms)
+        nearest = index.query(30.0, 31.2, radius_km=50, limit=3)
+        assert [gym.name for gym, _ in nearest] == ["Gym 0", "Gym 1", "Gym 2"]
+
+        index.upsert(gyms[0].model_copy(update={"latitude": 31.0}))
+        index.upsert(gyms[50].model_copy(update={"latitude": 30.0005}))
+        assert [gym.name for gym, _ in index.query(30.0, 31.2, radius_km=50, limit=2)] == ["Gym 50", "Gym 1"]
+
+class TestSingleFlight:
+
+    @pytest.mark.asyncio
+    async def test_concurrent_nearby_searches_share_one_places_call(self, clean_db, mock_upstream):
+        import asyncio
+        calls = []
+        release = asyncio.Event()
+
+        async def handler(request):
+            calls.append(request)
+            await release.wait()
+            return httpx.Response(200, json=places_payload(("place_1", "Iron Temple", 30.0500, 31.2400)))
+
+        mock_upstream("google_places", handler)
+        searches = [
+            asyncio.ensure_future(gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357))
+            for _ in range(10)
+        ]
+        await asyncio.sleep(0.05)
+        release.set()
+        results = await asyncio.gather(*searches)
+
+        assert len(calls) == 1
+        assert all([gym.name for gym in result] == ["Iron Temple"] for result in results)
+        assert gcloud_service.places_flight.stats() == {"calls": 1, "coalesced": 9, "in_flight": 0}
+
+    @pytest.mark.asyncio
+    async def test_errors_fan_out_and_cancelled_caller_does_not_cancel_others(self):
+        import asyncio
+        from backend.services.single_flight import SingleFlight
+        flight = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def upstream():
+            await release.wait()
+            raise RuntimeError("upstream down")
+
+        leader = asyncio.ensure_future(flight.do("key", upstream))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(flight.do("key", upstream)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+        results = await asyncio.gather(*followers, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert flight.stats() == {"calls": 1, "coalesced": 3, "in_flight": 0}
+
+        # Once finished, the next call goes upstream again
+        async def ok():
+            return "fresh"
+        assert await flight.do("key", ok) == "fresh"
+
+    @pytest.mark.asyncio
+    async def test_identical_ai_coach_payloads_share_one_completion(self, mock_upstream):
+        import asyncio
+        calls = []
+        release = asyncio.Event()
+
+        async def handler(request):
+            calls.append(request)
+            await release.wait()
+            return httpx.Response(200, json={"choices": [{"message": {"content": "Warm up first."}}]})
+
+        mock_upstream("deepseek", handler)
+        messages = [{"role": "user", "content": "leg day tips?"}]
+        pending = [asyncio.ensure_future(ai_coach_service.get_ai_coach_response(messages=messages)) for _ in range(3)]
+        other = asyncio.ensure_future(ai_coach_service.get_ai_coach_response(messages=[{"role": "user", "content": "arm day?"}]))
+        await asyncio.sleep(0.05)
+        release.set()
+        replies = await asyncio.gather(*pending, other)
+
+        assert replies == ["Warm up first."] * 4
+        assert len(calls) == 2
+
+class TestPlacesCircuitBreaker:
+
+    @pytest.mark.asyncio
+    async def test_slow_places_opens_circuit_and_skips_upstream(self, clean_db, mock_upstream):
+        import asyncio
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            await asyncio.sleep(1)
+            return httpx.Response(200, json=places_payload(("place_1", "Iron Temple", 30.05, 31.24)))
+
+        mock_upstream("google_places", handler)
+        breaker = gcloud_service.places_breaker
+        crud.create_gym_db(Gym(name="Campus Gym", location="Giza", latitude=30.0450, longitude=31.2360))
+
+        with patch.object(breaker, "latency_budget_seconds", 0.05), patch.object(breaker, "min_calls", 2):
+            for lng in (31.2357, 31.2557): # Different cells, so neither search is cached or coalesced
+                result = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=lng)
+                assert [gym.name for gym in result] == ["Campus Gym"]
+            await gcloud_service.drain()
+            assert breaker.state == "open" and breaker.timeouts == 2
+
+            started = asyncio.get_running_loop().time()
+            result = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2757)
+            assert asyncio.get_running_loop().time() - started < 0.05
+            await gcloud_service.drain()
+        assert [gym.name for gym in result] == ["Campus Gym"]
+        assert len(calls) == 2
+        assert breaker.stats()["rejected"] == 1
+
+    @pytest.mark.asyncio
+    async def test_open_circuit_serves_stale_cache_then_probe_closes_it(self, clean_db, mock_upstream):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json=places_payload(("place_1", "Iron Temple", 30.0500, 31.2400)))
+
+        mock_upstream("google_places", handler)
+        breaker = gcloud_service.places_breaker
+        cache = places_cache.places_cache
+        await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357)
+        key = places_cache.cache_key(30.0444, 31.2357, 5000)
+        cache.entries[key] = (0.0, cache.entries[key][1]) # Expire the entry
+        breaker._open()
+
+        stale = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357)
+        await gcloud_service.drain()
+        assert [gym.name for gym in stale] == ["Iron Temple"]
+        assert len(calls) == 1 and cache.stats()["stale_hits"] == 1
+
+        breaker.opened_at -= breaker.open_seconds # Open period over: next call is the probe
+        fresh = await gcloud_service.find_nearby_gyms(latitude=30.0444, longitude=31.2357)
+        await gcloud_service.drain()
+        assert [gym.name for gym in fresh] == ["Iron Temple"]
+        assert len(calls) == 2 and breaker.state == "closed"
+
+        response = client.get("/api/v1/metrics/")
+        assert response.json()["circuit_breakers"]["google_places"]["times_opened"] == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_probe_reopens_and_only_one_probe_runs(self):
+        import asyncio
+        from backend.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+        breaker = CircuitBreaker("test", latency_budget_seconds=1, window_size=4, min_calls=2,
+                                 error_rate_threshold=0.5, open_seconds=0)
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise RuntimeError("boom")
+
+        breaker._open()
+        probe = asyncio.ensure_future(breaker.call(failing))
+        await asyncio.sleep(0)
+        assert breaker.state == "half_open"
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(failing)
+        release.set()
+        with pytest.raises(RuntimeError):
+            await probe
+        assert breaker.state == "open" and breaker.times_opened == 2
+
+def sse_events(body: str):
+    """Parses a text/event-stream body into (event, data) pairs"""
+    import json
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+class TestAICoachStreaming:
+
+    def test_stream_proxies_upstream_deltas(self, authenticated_user, mock_upstream):
+        import json
+        upstream_requests = []
+
+        def handler(request):
+            upstream_requests.append(json.loads(request.content))
+            chunks = ["Warm", " up", " first."]
+            body = ": keep-alive\n\n" + "".join(
+                f"data: {json.dumps({'choices': [{'delta': {'content': chunk}}]})}\n\n" for chunk in chunks
+            ) + "data: [DONE]\n\n"
+            return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+
+        mock_upstream("deepseek", handler)
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        payload = {"messages": [{"role": "user", "content": "leg day tips?"}]}
+        with client.stream("POST", "/api/v1/ai-coach/stream", json=payload, headers=headers) as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/event-stream")
+            body = response.read().decode()
+
+        assert sse_events(body) == [
+            ("message", {"delta": "Warm"}), ("message", {"delta": " up"}),
+            ("message", {"delta": " first."}), ("done", {}),
+        ]
+        assert upstream_requests[0]["stream"] is True
+        assert upstream_requests[0]["messages"][0]["role"] == "system"
+
+    def test_stream_reports_upstream_failure_as_error_event(self, authenticated_user, mock_upstream):
+        mock_upstream("deepseek", lambda request: httpx.Response(503))
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        response = client.post("/api/v1/ai-coach/stream", json={"messages": [{"role": "user", "content": "hi"}]}, headers=headers)
+        assert response.status_code == 200
+        [(event, data)] = sse_events(response.text)
+        assert event == "error" and "try again" in data["detail"]
+
+    def test_stream_requires_auth(self):
+        response = client.post("/api/v1/ai-coach/stream", json={"messages": [{"role": "user", "content": "hi"}]})
+        assert response.status_code == 401
+
+class TestAICoachSessions:
+
+    def test_session_keeps_history_server_side(self, authenticated_user, mock_upstream):
+        import json
+        upstream_messages = []
+
+        def handler(request):
+            upstream_messages.append(json.loads(request.content)["messages"])
+            return httpx.Response(200, json={"choices": [{"message": {"content": f"reply {len(upstream_messages)}"}}]})
+
+        mock_upstream("deepseek", handler)
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        session_id = client.post("/api/v1/ai-coach/sessions", headers=headers).json()["session_id"]
+
+        for text in ("leg day?", "and arms?"):
+            response = client.post(f"/api/v1/ai-coach/sessions/{session_id}/messages", json={"content": text}, headers=headers)
+            assert response.status_code == 200
+
+        assert response.json()["assistant_response"] == "reply 2"
+        assert [m["content"] for m in upstream_messages[1][1:]] == ["leg day?", "reply 1", "and arms?"]
+        history = client.get(f"/api/v1/ai-coach/sessions/{session_id}", headers=headers).json()["messages"]
+        assert [m["role"] for m in history] == ["user", "assistant", "user", "assistant"]
+
+    def test_streamed_turn_is_stored_and_failed_turn_is_not(self, authenticated_user, mock_upstream):
+        import json
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        session_id = client.post("/api/v1/ai-coach/sessions", headers=headers).json()["session_id"]
+
+        mock_upstream("deepseek", lambda request: httpx.Response(503))
+        client.post(f"/api/v1/ai-coach/sessions/{session_id}/messages", json={"content": "hi"}, headers=headers)
+        assert client.get(f"/api/v1/ai-coach/sessions/{session_id}", headers=headers).json()["messages"] == []
+
+        body = "".join(f"data: {json.dumps({'choices': [{'delta': {'content': c}}]})}\n\n" for c in ("Sq", "uats")) + "data: [DONE]\n\n"
+        mock_upstream("deepseek", lambda request: httpx.Response(200, text=body))
+        client.post(f"/api/v1/ai-coach/sessions/{session_id}/messages/stream", json={"content": "leg day?"}, headers=headers)
+        history = client.get(f"/api/v1/ai-coach/sessions/{session_id}", headers=headers).json()["messages"]
+        assert history == [{"role": "user", "content": "leg day?"}, {"role": "assistant", "content": "Squats"}]
+
+    def test_sessions_are_private_and_deletable(self, authenticated_user):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        session_id = client.post("/api/v1/ai-coach/sessions", headers=headers).json()["session_id"]
+        other = coach_sessions.create("someone-else")
+
+        assert client.get(f"/api/v1/ai-coach/sessions/{other.session_id}", headers=headers).status_code == 404
+        assert client.delete(f"/api/v1/ai-coach/sessions/{session_id}", headers=headers).status_code == 204
+        response = client.post(f"/api/v1/ai-coach/sessions/{session_id}/messages", json={"content": "hi"}, headers=headers)
+        assert response.status_code == 404
+
+    def test_one_user_cannot_evict_other_users_sessions(self, authenticated_user):
+        store = CoachSessionStore(max_sessions=10, max_turns=2, ttl_seconds=60, max_sessions_per_user=3)
+        victim = store.create("victim")
+        flood = [store.create("flooder") for _ in range(20)]
+        assert store.get(victim.session_id, "victim") is victim
+        assert [s.session_id for s in store.sessions.values() if s.user_id == "flooder"] == [s.session_id for s in flood[-3:]]
+
+        store.get(flood[-3].session_id, "flooder") # Recently used: the next create evicts flood[-2] instead
+        store.create("flooder")
+        assert store.get(flood[-3].session_id, "flooder") is not None
+        assert store.get(flood[-2].session_id, "flooder") is None
+        assert store.stats()["sessions"] == 4
+
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        with patch.object(rate_limiter.ai_coach_limiter, "capacity", 2):
+            codes = [client.post("/api/v1/ai-coach/sessions", headers=headers).status_code for _ in range(3)]
+        assert codes == [201, 201, 429]
+
+    def test_store_bounds_turns_sessions_and_idle_time(self):
+        store = CoachSessionStore(max_sessions=2, max_turns=2, ttl_seconds=60, max_sessions_per_user=5)
+        session = store.create("u1")
+        for i in range(5):
+            store.append_turn(session, f"q{i}", f"a{i}")
+        assert [m["content"] for m in session.history()] == ["q3", "a3", "q4", "a4"]
+
+        store.create("u2")
+        store.create("u3")
+        assert store.get(session.session_id, "u1") is None # Least recently used was evicted
+        assert store.stats() == {"sessions": 2, "evictions": 1}
+
+        idle = next(iter(store.sessions.values()))
+        idle.last_used -= 61
+        assert store.get(idle.session_id, idle.user_id) is None
+
+class TestCoachContextBudget:
+
+    def test_packs_recent_turns_within_budget(self):
+        from backend.services import coach_context
+        history = []
+        for i in range(10):
+            history += [{"role": "user", "content": f"question {i} " + "x" * 400},
+                        {"role": "assistant", "content": f"answer {i} " + "y" * 400}]
+
+        packed = coach_context.pack_history(history, token_budget=500, max_message_tokens=1000)
+        assert sum(coach_context.message_tokens(m) for m in packed) <= 500
+        assert packed[-1] == history[-1]
+        assert packed == history[-len(packed):] # Contiguous window of the newest turns
+        assert packed[0]["role"] == "user"
+
+    def test_truncates_oversized_messages(self):
+        from backend.services import coach_context
+        huge = "تمرين " * 5000 # Multi-byte text must not be cut mid-character
+        packed = coach_context.pack_history([{"role": "user", "content": huge}], token_budget=100, max_message_tokens=200)
+        assert len(packed) == 1
+        assert packed[0]["content"].endswith(coach_context.TRUNCATION_MARKER)
+        assert coach_context.estimate_tokens(packed[0]["content"]) <= 200
+
+    def test_chat_prompt_respects_configured_budget(self, authenticated_user, mock_upstream):
+        import json
+        from backend.services import coach_context
+        sent = []
+
+        def handler(request):
+            sent.append(json.loads(request.content)["messages"])
+            return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+        mock_upstream("deepseek", handler)
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": "z" * 40000} for i in range(19)]
+        with patch('backend.config.settings.AI_COACH_CONTEXT_TOKEN_BUDGET', 2500), \
+             patch('backend.config.settings.AI_COACH_MAX_MESSAGE_TOKENS', 1000):
+            response = client.post("/api/v1/ai-coach/", json={"messages": messages}, headers=headers)
+
+        assert response.status_code == 200
+        prompt = sent[0]
+        assert prompt[0]["role"] == "system" and "User name:" in prompt[0]["content"]
+        assert sum(coach_context.message_tokens(m) for m in prompt) <= 2500
+        # Only the newest exchange fits; the reply before it is dropped so the window starts on a user turn
+        assert [m["role"] for m in prompt] == ["system", "user"]
+        assert prompt[1]["content"].endswith(coach_context.TRUNCATION_MARKER)
+
+class TestAICoachResponseCache:
+
+    @pytest.mark.asyncio
+    async def test_repeated_prompt_is_served_from_cache(self, clean_db, mock_upstream):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json={"choices": [{"message": {"content": "Start with 20 minute jogs."}}]})
+
+        mock_upstream("deepseek", handler)
+        first = await ai_coach_service.get_ai_coach_response([{"role": "user", "content": "how do I start running?"}])
+        # Whitespace differences normalize to the same key
+        second = await ai_coach_service.get_ai_coach_response([{"role": "user", "content": "  how do I   start running? "}])
+        assert first == second == "Start with 20 minute jogs."
+        assert len(calls) == 1
+        assert coach_response_cache.stats()["hits"] == 1
+
+        await ai_coach_service.get_ai_coach_response([{"role": "user", "content": "how do I start running?"}], use_cache=False)
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_users_with_similar_profiles_share_entries(self, clean_db, mock_upstream):
+        from backend.models import ActivityLog
+        from backend.services.coach_context import build_coach_messages
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json={"choices": [{"message": {"content": "Add one tempo run a week."}}]})
+
+        mock_upstream("deepseek", handler)
+        users = []
+        for name, km in (("Alice", 62.5), ("Bob", 71.0)):
+            user = models_user_for_prompt()
+            user.name, user.age, user.fitness_goals = name, 30, ["Run a 10k"]
+            user.tracked_activities = [ActivityLog(date=date.today(), activity_type="running", value=km, unit="km")]
+            users.append(user)
+        history = [{"role": "user", "content": "How do I get faster?"}]
+
+        prompts = [build_coach_messages(user, history, shared=True) for user in users]
+        assert prompts[0] == prompts[1]
+        assert "Alice" not in prompts[0][0]["content"] and "50-100" in prompts[0][0]["content"]
+        for prompt in prompts:
+            assert await ai_coach_service.get_ai_coach_response(prompt) == "Add one tempo run a week."
+        assert len(calls) == 1 and coach_response_cache.stats()["hits"] == 1
+
+        assert "User name: Alice" in build_coach_messages(users[0], history)[0]["content"]
+
+    def test_chat_sends_exact_profile_unless_shared_profile_enabled(self, authenticated_user, mock_upstream):
+        import json
+        sent = []
+
+        def handler(request):
+            sent.append(json.loads(request.content)["messages"][0]["content"])
+            return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+        mock_upstream("deepseek", handler)
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        client.post("/api/v1/ai-coach/", json={"messages": [{"role": "user", "content": "what's my name?"}]}, headers=headers)
+        with patch('backend.config.settings.AI_COACH_CACHE_SHARED_PROFILE', True):
+            client.post("/api/v1/ai-coach/", json={"messages": [{"role": "user", "content": "how do I start?"}]}, headers=headers)
+            client.post("/api/v1/ai-coach/", json={"messages": [{"role": "user", "content": "how do I stop?"}], "use_cache": False}, headers=headers)
+        assert "User name: Test User" in sent[0] and "Lifetime running km: 0.0" in sent[0]
+        assert "Test User" not in sent[1] and "Lifetime running km: 0-10" in sent[1]
+        assert "User name: Test User" in sent[2]
+
+    @pytest.mark.asyncio
+    async def test_failures_are_not_cached(self, clean_db, mock_upstream):
+        mock_upstream("deepseek", lambda request: httpx.Response(500))
+        reply = await ai_coach_service.get_ai_coach_response([{"role": "user", "content": "hi"}])
+        assert reply == ai_coach_service.FALLBACK_REPLY
+        assert coach_response_cache.stats()["entries"] == 0
+
+    def test_completed_stream_fills_cache_for_both_endpoints(self, authenticated_user, mock_upstream):
+        import json
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            body = "".join(f"data: {json.dumps({'choices': [{'delta': {'content': c}}]})}\n\n" for c in ("Drink ", "water.")) + "data: [DONE]\n\n"
+            return httpx.Response(200, text=body)
+
+        mock_upstream("deepseek", handler)
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        payload = {"messages": [{"role": "user", "content": "hydration?"}]}
+        client.post("/api/v1/ai-coach/stream", json=payload, headers=headers)
+        response = client.post("/api/v1/ai-coach/", json=payload, headers=headers)
+        assert response.json()["assistant_response"] == "Drink water."
+        streamed = client.post("/api/v1/ai-coach/stream", json=payload, headers=headers)
+        assert sse_events(streamed.text) == [("message", {"delta": "Drink water."}), ("done", {})]
+        assert len(calls) == 1
+
+        client.post("/api/v1/ai-coach/stream", json={**payload, "use_cache": False}, headers=headers)
+        assert len(calls) == 2
+
+    def test_cache_expires_and_evicts(self):
+        from backend.services.coach_response_cache import ResponseCache
+        cache = ResponseCache(max_entries=2, ttl_seconds=60)
+        cache.put("a", "1")
+        cache.put("b", "2")
+        cache.get("a")
+        cache.put("c", "3")
+        assert cache.get("b") is None and cache.get("a") == "1"
+        cache.ttl_seconds = -1
+        cache.put("d", "4")
+        assert cache.get("d") is None
+
+class TestLLMAdmission:
+
+    @pytest.mark.asyncio
+    async def test_caps_concurrency_and_serves_users_round_robin(self):
+        import asyncio
+        limiter = FairShareLimiter("test", max_concurrent=1, max_queue_depth=10, max_queue_per_user=5, max_wait_seconds=5)
+        order = []
+        release = asyncio.Event()
+
+        async def call(user, tag):
+            async with limiter.slot(user):
+                order.append(tag)
+                if tag == "first":
+                    await release.wait()
+
+        tasks = [asyncio.ensure_future(call("heavy", "first"))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.ensure_future(call("heavy", f"heavy-{i}")) for i in range(3)]
+        tasks += [asyncio.ensure_future(call("light", "light-0"))]
+        await asyncio.sleep(0)
+        assert limiter.stats()["active"] == 1 and limiter.stats()["queued"] == 4
+
+        release.set()
+        await asyncio.gather(*tasks)
+        # The light user does not wait behind the heavy user's whole backlog
+        assert order == ["first", "heavy-0", "light-0", "heavy-1", "heavy-2"]
+        stats = limiter.stats()
+        assert stats["active"] == 0 and stats["queued"] == 0 and stats["admitted"] == 5
+        assert stats["wait_max_seconds"] > 0
+
+    @pytest.mark.asyncio
+    async def test_rejects_fast_when_queue_full_or_wait_too_long(self):
+        import asyncio
+        limiter = FairShareLimiter("test", max_concurrent=1, max_queue_depth=2, max_queue_per_user=1, max_wait_seconds=0.05)
+        await limiter.acquire("a")
+        queued = asyncio.ensure_future(limiter.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            await limiter.acquire("b") # Per-user queue limit
+        queued_c = asyncio.ensure_future(limiter.acquire("c"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            await limiter.acquire("d") # Global queue depth
+
+        with pytest.raises(AdmissionRejected):
+            await queued # Waited past max_wait_seconds
+        with pytest.raises(AdmissionRejected):
+            await queued_c
+        limiter.release()
+        assert limiter.stats()["active"] == 0 and limiter.stats()["queued"] == 0 and limiter.stats()["rejected"] == 4
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_gives_up_its_place(self):
+        import asyncio
+        limiter = FairShareLimiter("test", max_concurrent=1, max_queue_depth=5, max_queue_per_user=5, max_wait_seconds=5)
+        await limiter.acquire("a")
+        waiter = asyncio.ensure_future(limiter.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert limiter.queued == 0
+        limiter.release()
+        assert limiter.active == 0
+
+    def test_chat_returns_503_when_not_admitted(self, authenticated_user):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        with patch('backend.services.ai_coach_service.llm_admission.acquire', new_callable=AsyncMock,
+                   side_effect=AdmissionRejected("LLM queue is full")):
+            with patch('backend.config.settings.AI_COACH_FALLBACK_MODE', "off"):
+                response = client.post("/api/v1/ai-coach/", json={"messages": [{"role": "user", "content": "hi"}]}, headers=headers)
+            assert response.status_code == 503
+            assert "Retry-After" in response.headers
+
+            local = client.post("/api/v1/ai-coach/", json={"messages": [{"role": "user", "content": "hi"}]}, headers=headers)
+            assert local.status_code == 200 and "Test User" in local.json()["assistant_response"]
+
+            streamed = client.post("/api/v1/ai-coach/stream", json={"messages": [{"role": "user", "content": "hi"}]}, headers=headers)
+            [(event, data)] = sse_events(streamed.text)
+            assert event == "error" and "busy" in data["detail"]
+
+def models_user_for_prompt():
+    from backend.models import User
+    return User(email="coach@example.com", name="Coach Test", hashed_password="x")
+
+class TestCoachSummaries:
+
+    @pytest.mark.asyncio
+    async def test_fold_keeps_recent_turns_and_summary_in_prompt(self):
+        from backend.services import coach_summarizer, coach_context
+        store = CoachSessionStore(max_sessions=10, max_turns=10, ttl_seconds=60, max_sessions_per_user=5)
+        session = store.create("u1")
+        for i in range(6):
+            store.append_turn(session, f"My knee hurts on run {i}. It started last week", f"answer {i}")
+
+        with patch('backend.config.settings.AI_COACH_SUMMARY_KEEP_TURNS', 2):
+            assert await coach_summarizer.fold_old_turns(session, coach_summarizer.LocalStubSummarizer())
+        assert [m["content"] for m in session.history()] == [
+            "My knee hurts on run 4. It started last week", "answer 4",
+            "My knee hurts on run 5. It started last week", "answer 5",
+        ]
+        assert session.summary.startswith("My knee hurts on run 0 | My knee hurts on run 1")
+
+        user = models_user_for_prompt()
+        prompt = coach_context.build_coach_messages(user, session.history(), session.summary)
+        assert "Summary of the earlier conversation:\nMy knee hurts on run 0" in prompt[0]["content"]
+        assert len(prompt) == 5
+
+    @pytest.mark.asyncio
+    async def test_failed_summary_keeps_raw_turns(self):
+        from backend.services import coach_summarizer
+
+        class FailingSummarizer:
+            async def summarize(self, previous_summary, turns, user_id):
+                return None
+
+        store = CoachSessionStore(max_sessions=10, max_turns=10, ttl_seconds=60, max_sessions_per_user=5)
+        session = store.create("u1")
+        for i in range(4):
+            store.append_turn(session, f"q{i}", f"a{i}")
+        assert not await coach_summarizer.fold_old_turns(session, FailingSummarizer())
+        assert len(session.messages) == 8 and session.summary == ""
+
+    @pytest.mark.asyncio
+    async def test_llm_summaries_use_background_slots(self, clean_db, mock_upstream):
+        from backend.services import coach_summarizer
+        mock_upstream("deepseek", lambda request: httpx.Response(200, json={"choices": [{"message": {"content": "Knee pain since last week."}}]}))
+        summary = await coach_summarizer.LLMSummarizer().summarize("", [{"role": "user", "content": "My knee hurts"}], "u1")
+        assert summary == "Knee pain since last week."
+        assert llm_admission.stats()["background_admitted"] == 1
+        assert llm_admission.stats()["admitted"] == 0
+
+    def test_long_session_prompt_stays_bounded(self, authenticated_user, mock_upstream):
+        import json
+        from backend.services import coach_summarizer
+        prompt_sizes = []
+
+        def handler(request):
+            prompt_sizes.append(len(json.loads(request.content)["messages"]))
+            return httpx.Response(200, json={"choices": [{"message": {"content": "noted"}}]})
+
+        mock_upstream("deepseek", handler)
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        with patch('backend.config.settings.AI_COACH_SUMMARIZER', 'local'), \
+             patch('backend.config.settings.AI_COACH_SUMMARIZE_AFTER_TURNS', 3), \
+             patch('backend.config.settings.AI_COACH_SUMMARY_KEEP_TURNS', 1), \
+             TestClient(app) as lifespan_client:
+            session_id = lifespan_client.post("/api/v1/ai-coach/sessions", headers=headers).json()["session_id"]
+            for i in range(12):
+                lifespan_client.post(f"/api/v1/ai-coach/sessions/{session_id}/messages",
+                                     json={"content": f"Goal number {i}. Details follow", "use_cache": False}, headers=headers)
+                lifespan_client.portal.call(coach_summarizer.drain)
+            session = lifespan_client.get(f"/api/v1/ai-coach/sessions/{session_id}", headers=headers).json()
+
+        assert max(prompt_sizes) <= 1 + 3 * 2 # System prompt + at most 3 exchanges (incl. the new message)
+        assert "Goal number 0" in session["summary"] and "Goal number 9" in session["summary"]
+        assert len(session["messages"]) < 6
+
+class TestDailyTips:
+
+    def _create_users(self, count):
+        from backend.schemas import UserCreate
+        return [crud.create_user_db(UserCreate(email=f"tips{i}@example.com", name=f"Tipper {i}", password="Password123!"))
+                for i in range(count)]
+
+    @pytest.mark.asyncio
+    async def test_job_generates_and_endpoint_serves_tips(self, clean_db, mock_upstream):
+        import json
+        from backend.services import daily_tips
+
+        def handler(request):
+            system_prompt = json.loads(request.content)["messages"][0]["content"]
+            name = system_prompt.split("User name: ")[1].split("\n")[0]
+            return httpx.Response(200, json={"choices": [{"message": {"content": f"{name}: walk 20 minutes today."}}]})
+
+        mock_upstream("deepseek", handler)
+        users = self._create_users(3)
+        with patch('backend.config.settings.DAILY_TIPS_PER_MINUTE', 60000):
+            counters = await daily_tips.run_daily_tips_job(date(2026, 1, 5))
+        assert counters == {"generated": 3, "skipped": 0, "failed": 0}
+        assert llm_admission.stats()["background_admitted"] == 3
+
+        tip = crud.get_latest_daily_tip_db(users[1].user_id)
+        assert tip["date"] == "2026-01-05" and tip["tip"] == "Tipper 1: walk 20 minutes today."
+
+    @pytest.mark.asyncio
+    async def test_interrupted_job_resumes_from_checkpoint(self, clean_db):
+        from backend.services import daily_tips
+        self._create_users(5)
+        calls = []
+        crash = {"armed": True}
+
+        async def crashing_tip(user):
+            calls.append(user.user_id)
+            if len(calls) == 3 and crash.pop("armed", False):
+                raise RuntimeError("worker died")
+            return f"tip for {user.name}"
+
+        with patch('backend.config.settings.DAILY_TIPS_BATCH_SIZE', 2), \
+             patch('backend.config.settings.DAILY_TIPS_WORKERS', 1), \
+             patch('backend.config.settings.DAILY_TIPS_PER_MINUTE', 60000), \
+             patch.object(daily_tips, "generate_tip", side_effect=crashing_tip):
+            with pytest.raises(RuntimeError):
+                await daily_tips.run_daily_tips_job(date(2026, 1, 5))
+            checkpoint = crud.get_batch_job_state_db("daily_tips")
+            assert checkpoint["status"] == "running" and checkpoint["cursor"] == sorted(calls)[1]
+
+            calls.clear()
+            counters = await daily_tips.run_daily_tips_job(date(2026, 1, 5))
+            assert len(calls) == 3 # Only the users after the checkpoint
+            assert counters["generated"] == 3
+            assert len(crud.get_daily_tip_user_ids_db(date(2026, 1, 5))) == 5
+
+            calls.clear()
+            await daily_tips.run_daily_tips_job(date(2026, 1, 5)) # Completed days are not rerun
+            assert calls == []
+
+    @pytest.mark.asyncio
+    async def test_failed_users_are_retried_by_the_next_run(self, clean_db):
+        from backend.services import daily_tips
+        users = self._create_users(4)
+        flaky = {users[1].user_id, users[3].user_id}
+        calls = []
+
+        async def flaky_tip(user):
+            calls.append(user.user_id)
+            return None if user.user_id in flaky else f"tip for {user.name}"
+
+        with patch('backend.config.settings.DAILY_TIPS_BATCH_SIZE', 2), \
+             patch('backend.config.settings.DAILY_TIPS_PER_MINUTE', 60000), \
+             patch.object(daily_tips, "generate_tip", side_effect=flaky_tip):
+            assert await daily_tips.run_daily_tips_job(date(2026, 1, 5)) == {"generated": 2, "skipped": 0, "failed": 2}
+            checkpoint = crud.get_batch_job_state_db("daily_tips")
+            assert checkpoint["status"] == "incomplete" and set(checkpoint["failed_user_ids"]) == flaky
+
+            flaky.discard(users[1].user_id)
+            calls.clear()
+            assert await daily_tips.run_daily_tips_job(date(2026, 1, 5)) == {"generated": 1, "skipped": 0, "failed": 1}
+            assert sorted(calls) == sorted([users[1].user_id, users[3].user_id]) # Only the failed users
+            assert crud.get_batch_job_state_db("daily_tips")["failed_user_ids"] == [users[3].user_id]
+
+            flaky.clear()
+            calls.clear()
+            assert (await daily_tips.run_daily_tips_job(date(2026, 1, 5)))["generated"] == 1
+            assert calls == [users[3].user_id]
+            assert crud.get_batch_job_state_db("daily_tips")["status"] == "completed"
+            assert len(crud.get_daily_tip_user_ids_db(date(2026, 1, 5))) == 4
+
+    def test_only_the_latest_tip_is_kept_per_user(self, clean_db):
+        crud.save_daily_tip_db("u1", date(2026, 1, 5), "day 5")
+        crud.save_daily_tip_db("u1", date(2026, 1, 6), "day 6")
+        crud.save_daily_tip_db("u1", date(2026, 1, 4), "late rerun") # Older day: ignored
+        crud.save_daily_tip_db("u2", date(2026, 1, 6), "other user")
+        assert DailyTipTable.count(Query().user_id == "u1") == 1
+        assert crud.get_latest_daily_tip_db("u1")["tip"] == "day 6"
+        assert crud.get_daily_tip_user_ids_db(date(2026, 1, 6)) == ["u1", "u2"]
+        assert crud.get_daily_tip_user_ids_db(date(2026, 1, 5)) == []
+
+    @pytest.mark.asyncio
+    async def test_background_calls_yield_to_interactive_traffic(self):
+        import asyncio
+        limiter = FairShareLimiter("test", max_concurrent=2, max_queue_depth=5, max_queue_per_user=5, max_wait_seconds=5)
+        await limiter.acquire("chatter")
+        background = asyncio.ensure_future(limiter.acquire_background(reserved=1))
+        await asyncio.sleep(0.1)
+        assert not background.done() # The remaining slot is reserved for interactive chats
+
+        await limiter.acquire("another-chatter") # Interactive still gets the reserved slot right away
+        limiter.release()
+        limiter.release()
+        await asyncio.wait_for(background, timeout=1)
+        assert limiter.active == 1
+
+    def test_daily_tip_endpoint(self, authenticated_user):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        assert client.get("/api/v1/ai-coach/daily-tip", headers=headers).status_code == 404
+
+        crud.save_daily_tip_db(authenticated_user["user_id"], date(2026, 1, 4), "old tip")
+        crud.save_daily_tip_db(authenticated_user["user_id"], date(2026, 1, 5), "Stretch after your run.")
+        response = client.get("/api/v1/ai-coach/daily-tip", headers=headers)
+        assert response.status_code == 200
+        assert response.json() == {"date": "2026-01-05", "tip": "Stretch after your run."}
+
+class TestFallbackCoach:
+
+    def test_local_reply_uses_topic_and_user_stats(self):
+        from backend.services.fallback_coach import fallback_reply
+        from backend.models import ActivityLog
+        user = models_user_for_prompt()
+        user.fitness_goals = ["Run a 10k"]
+        user.tracked_activities = [ActivityLog(date=date.today(), activity_type="running", value=5.5, unit="km")]
+        reply = fallback_reply(user, "How should I train for a faster run?")
+        assert "weekly distance" in reply
+        assert "5.5 km of running" in reply and "Run a 10k" in reply
+
+        arabic = fallback_reply(user, "كيف أحسن الجري؟")
+        assert "وتيرة" in arabic and "5.5 كم" in arabic
+
+    def test_topics_match_whole_words(self):
+        from backend.services.fallback_coach import fallback_reply, CURATED_TIPS, GENERAL_TIP
+        injury, running, strength, _, nutrition, recovery = (english for _, _, english, _ in CURATED_TIPS)
+        user = models_user_for_prompt()
+        cases = {
+            "I want to get back into running": running,
+            "Any feedback on my squat form?": strength,
+            "What's a great warm-up?": GENERAL_TIP[0],
+            "I'm interested in yoga": GENERAL_TIP[0],
+            "My lower back pain is back": injury,
+            "What should I eat after training?": nutrition,
+            "How long should I rest between runs?": running,
+            "Is soreness normal?": recovery,
+        }
+        for message, tip in cases.items():
+            assert fallback_reply(user, message).startswith(tip), message
+
+    @pytest.mark.asyncio
+    async def test_slow_upstream_is_answered_locally_and_still_cached(self, clean_db, mock_upstream):
+        import asyncio
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            await asyncio.sleep(0.3)
+            return httpx.Response(200, json={"choices": [{"message": {"content": "Model answer"}}]})
+
+        mock_upstream("deepseek", handler)
+        messages = [{"role": "user", "content": "hi"}]
+        with patch('backend.config.settings.AI_COACH_LATENCY_BUDGET_SECONDS', 0.05):
+            reply = await ai_coach_service.get_ai_coach_response(messages, fallback=lambda: "Local answer")
+        assert reply == "Local answer"
+        await asyncio.sleep(0.4)
+        # The abandoned upstream call finished in the background and warmed the cache
+        assert await ai_coach_service.get_ai_coach_response(messages, fallback=lambda: "Local answer") == "Model answer"
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_upstream_uses_fallback_unless_none_given(self, clean_db, mock_upstream):
+        mock_upstream("deepseek", lambda request: httpx.Response(500))
+        messages = [{"role": "user", "content": "hi"}]
+        assert await ai_coach_service.get_ai_coach_response(messages, fallback=lambda: "Local answer") == "Local answer"
+        assert await ai_coach_service.get_ai_coach_response(messages) == ai_coach_service.FALLBACK_REPLY
+
+    @pytest.mark.asyncio
+    async def test_hedged_mode_returns_first_upstream_answer(self, clean_db, mock_upstream):
+        import asyncio
+        calls = []
+
+        async def handler(request):
+            calls.append(request)
+            if len(calls) == 1:
+                await asyncio.sleep(1.0) # The first replica is stuck
+                return httpx.Response(200, json={"choices": [{"message": {"content": "Slow answer"}}]})
+            return httpx.Response(200, json={"choices": [{"message": {"content": "Hedged answer"}}]})
+
+        mock_upstream("deepseek", handler)
+        with patch('backend.config.settings.AI_COACH_FALLBACK_MODE', "hedged"), \
+                patch('backend.config.settings.AI_COACH_HEDGE_AFTER_SECONDS', 0.05), \
+                patch('backend.config.settings.AI_COACH_LATENCY_BUDGET_SECONDS', 0.5):
+            reply = await ai_coach_service.get_ai_coach_response(
+                [{"role": "user", "content": "hi"}], use_cache=False, fallback=lambda: "Local answer",
+            )
+        assert reply == "Hedged answer"
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_abandoned_uncached_calls_free_their_admission_slots(self, clean_db, mock_upstream):
+        import asyncio
+
+        async def handler(request):
+            await asyncio.sleep(5) # Far beyond the budget
+            return httpx.Response(200, json={"choices": [{"message": {"content": "Model answer"}}]})
+
+        mock_upstream("deepseek", handler)
+        limiter = FairShareLimiter("test", max_concurrent=2, max_queue_depth=4, max_queue_per_user=4, max_wait_seconds=10)
+        with patch('backend.services.ai_coach_service.llm_admission', limiter), \
+                patch('backend.config.settings.AI_COACH_LATENCY_BUDGET_SECONDS', 0.05):
+            for i in range(10):
+                reply = await ai_coach_service.get_ai_coach_response(
+                    [{"role": "user", "content": f"question {i}"}], use_cache=False, user_id="u", fallback=lambda: "Local answer",
+                )
+                assert reply == "Local answer"
+                await asyncio.sleep(0) # Let the cancelled call release its slot
+                assert limiter.active == 0 and limiter.queued == 0
+        assert limiter.stats()["rejected"] == 0
+
+    def test_chat_endpoint_answers_locally_when_upstream_is_down(self, authenticated_user, mock_upstream):
+        mock_upstream("deepseek", lambda request: httpx.Response(503))
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        response = client.post("/api/v1/ai-coach/", json={"messages": [{"role": "user", "content": "Any tips for sleep?"}]}, headers=headers)
+        assert response.status_code == 200
+        reply = response.json()["assistant_response"]
+        assert "7-9 hours" in reply and "Test User" in reply
+
+class TestMockLLMServer:
+
+    @pytest.mark.asyncio
+    async def test_coach_talks_to_configured_url_and_mock_replies(self, clean_db):
+        from backend.benchmarks.mock_llm_server import MockLLMConfig, create_app
+        mock = create_app(MockLLMConfig(latency_ms=0, latency_sigma=0, tokens_per_second=0, reply_tokens=5))
+        http_clients.set_transport("deepseek", httpx.ASGITransport(app=mock))
+        try:
+            with patch('backend.config.settings.DEEPSEEK_API_URL', "http://mock-llm/v1/chat/completions"):
+                reply = await ai_coach_service.get_ai_coach_response([{"role": "user", "content": "hi"}], use_cache=False)
+                deltas = [d async for d in ai_coach_service.stream_ai_coach_response([{"role": "user", "content": "hi"}], use_cache=False)]
+            assert reply == "Great question! Start with three"
+            assert "".join(deltas) == reply and len(deltas) == 5
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=mock), base_url="http://mock-llm") as mock_client:
+                stats = (await mock_client.get("/stats")).json()
+            assert stats["requests"] == 2 and stats["streamed"] == 1 and stats["in_flight"] == 0
+        finally:
+            http_clients.set_transport("deepseek", None)
+
+    @pytest.mark.asyncio
+    async def test_mock_error_rate(self, clean_db):
+        from backend.benchmarks.mock_llm_server import MockLLMConfig, create_app
+        mock = create_app(MockLLMConfig(latency_ms=0, latency_sigma=0, error_rate=1.0, error_status=429))
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=mock), base_url="http://mock-llm") as mock_client:
+            response = await mock_client.post("/v1/chat/completions", json={"messages": []})
+            assert response.status_code == 429
+            assert (await mock_client.get("/stats")).json()["in_flight"] == 0
+
+PNG_1PX = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==")
+
+@pytest.fixture
+def upload_dir(clean_db, tmp_path):
+    # Background renditions would outlive the request's event loop; tests call create_renditions directly
+    with patch("backend.services.photo_renditions.schedule_renditions"):
+        yield tmp_path
+
+def team_form(sample_team_data):
+    return {key: value for key, value in sample_team_data.items() if key != "photo_base64"}
+
+class TestTeamPhotoUpload:
+
+    def test_photo_is_stored_and_url_returned(self, authenticated_user, sample_team_data, upload_dir):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        # The client's filename and content type are ignored in favour of the sniffed type
+        files = {"photo": ("team.bin", PNG_1PX, "application/octet-stream")}
+        response = client.post("/api/v1/activity-teams/", data=team_form(sample_team_data), files=files, headers=headers)
+        assert response.status_code == 201
+        photo_url = response.json()["photo_url"]
+        assert photo_url.startswith("/static/uploads/team_photos/") and photo_url.endswith(".png")
+
+        stored = upload_dir / photo_url.rsplit("/", 1)[1]
+        assert stored.read_bytes() == PNG_1PX
+        assert [p.name for p in upload_dir.iterdir()] == [stored.name] # No temp files left behind
+        listed = client.get("/api/v1/activity-teams/").json()
+        assert listed[0]["photo_url"] == photo_url
+
+    def test_oversized_photo_is_rejected_while_reading(self, authenticated_user, sample_team_data, upload_dir):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        files = {"photo": ("big.png", PNG_1PX + b"\0" * 5000, "image/png")}
+        with patch('backend.config.settings.TEAM_PHOTO_MAX_BYTES', 1024):
+            response = client.post("/api/v1/activity-teams/", data=team_form(sample_team_data), files=files, headers=headers)
+        assert response.status_code == 413
+        assert list(upload_dir.iterdir()) == []
+        assert client.get("/api/v1/activity-teams/").json() == []
+
+    def test_non_image_is_rejected(self, authenticated_user, sample_team_data, upload_dir):
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        files = {"photo": ("photo.png", b"<html>not an image</html>", "image/png")}
+        response = client.post("/api/v1/activity-teams/", data=team_form(sample_team_data), files=files, headers=headers)
+        assert response.status_code == 415
+        assert list(upload_dir.iterdir()) == []
+
+    @pytest.mark.asyncio
+    async def test_size_limit_applies_when_size_is_unknown(self, upload_dir):
+        import io
+        from fastapi import UploadFile
+        from backend.services import photo_storage
+        upload = UploadFile(file=io.BytesIO(PNG_1PX * 1000), filename="big.png") # No declared size
+        with pytest.raises(photo_storage.PhotoTooLarge):
+            await photo_storage.save_upload(upload, max_bytes=10 * 1024)
+        assert list(upload_dir.iterdir()) == []
+
+    def test_sniff_image_extension(self):
+        from backend.services.photo_storage import sniff_image_extension
+        assert sniff_image_extension(b"\xff\xd8\xff\xe0" + b"\0" * 8) == ".jpg"
+        assert sniff_image_extension(b"RIFF\x24\0\0\0WEBPVP8 ") == ".webp"
+        assert sniff_image_extension(b"GIF89a\x01\0") == ".gif"
+        assert sniff_image_extension(b"%PDF-1.7") is None
+
+def make_jpeg(width, height):
+    import io
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 80, 40)).save(buffer, "JPEG", quality=95)
+    return buffer.getvalue()
+
+class TestTeamPhotoRenditions:
+
+    def test_upload_schedules_renditions(self, authenticated_user, sample_team_data, upload_dir):
+        from backend.services import photo_renditions
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        with patch.object(photo_renditions, "schedule_renditions") as schedule:
+            response = client.post(
+                "/api/v1/activity-teams/", data=team_form(sample_team_data),
+                files={"photo": ("team.jpg", make_jpeg(32, 32), "image/jpeg")}, headers=headers,
+            )
+        team = response.json()
+        assert team["photo_renditions"] == {}
+        schedule.assert_called_once_with(team["team_id"], team["photo_url"].rsplit("/", 1)[1])
+
+    @pytest.mark.asyncio
+    async def test_renditions_are_resized_and_recorded_on_team(self, clean_db, sample_team_data, upload_dir):
+        from PIL import Image
+        from backend.services import photo_renditions
+        (upload_dir / "orig.jpg").write_bytes(make_jpeg(3000, 2000))
+        team = GroupActivityTeam(**{**sample_team_data, "date_and_time": datetime.fromisoformat(sample_team_data["date_and_time"])}, lister_id="lister")
+        crud.create_group_activity_team_db(team)
+
+        urls = await photo_renditions.create_renditions(team.team_id, "orig.jpg")
+        assert urls == {name: f"/static/uploads/team_photos/orig_{name}.webp" for name in ("thumb", "card", "full")}
+        sizes = {}
+        for name, expected_edge in photo_renditions.RENDITIONS.items():
+            with Image.open(upload_dir / f"orig_{name}.webp") as image:
+                assert image.format == "WEBP" and max(image.size) == expected_edge
+                sizes[name] = (upload_dir / f"orig_{name}.webp").stat().st_size
+        assert sizes["thumb"] < sizes["card"] < sizes["full"]
+        assert crud.get_group_activity_team_by_id(team.team_id).photo_renditions == urls
+
+    @pytest.mark.asyncio
+    async def test_renditions_for_deleted_team_are_removed(self, clean_db, upload_dir):
+        from backend.services import photo_renditions
+        (upload_dir / "orig.jpg").write_bytes(make_jpeg(100, 50))
+        assert await photo_renditions.create_renditions("no-such-team", "orig.jpg") is None
+        assert [p.name for p in upload_dir.iterdir()] == ["orig.jpg"]
+
+    def test_worker_module_does_not_import_the_backend(self):
+        import os
+        import subprocess
+        import sys
+        # Spawned workers import photo_render fresh; it must not load settings or open the database
+        check = "import sys, backend.services.photo_render; assert not [m for m in sys.modules if m in ('backend.crud', 'backend.config', 'backend.database')]"
+        repo_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        assert subprocess.run([sys.executable, "-c", check], cwd=repo_root).returncode == 0
+
+class TestTeamPhotoBlobs:
+
+    def test_inline_photo_is_moved_out_of_team_document(self, clean_db, sample_team_data, tmp_path):
+        import json
+        team = GroupActivityTeam(**{**sample_team_data, "date_and_time": datetime.fromisoformat(sample_team_data["date_and_time"])}, lister_id="lister")
+        created = crud.create_group_activity_team_db(team)
+        assert created.photo_base64 is None
+        doc = GroupActivityTeamTable.get(Query().team_id == team.team_id)
+        assert "photo_base64" not in doc
+        assert (tmp_path / doc["photo_url"].rsplit("/", 1)[1]).read_bytes() == PNG_1PX
+        assert crud.get_group_activity_team_by_id(team.team_id).photo_url == doc["photo_url"]
+        description_size = len(json.dumps(doc["description"]))
+        assert len(json.dumps(doc, default=str)) - description_size < 600
+
+    def test_migration_moves_existing_base64_photos(self, clean_db, sample_team_data, tmp_path):
+        from backend.database_data.migrate_team_photos import migrate_team_photos
+        legacy = {**sample_team_data, "team_id": "legacy", "lister_id": "lister", "photo_base64": "data:image/png;base64," + sample_team_data["photo_base64"]}
+        broken = {**legacy, "team_id": "broken", "photo_base64": base64.b64encode(b"not an image").decode()}
+        GroupActivityTeamTable.insert(legacy)
+        GroupActivityTeamTable.insert(broken)
+
+        assert migrate_team_photos() == {"migrated": 1, "failed": 1}
+        doc = GroupActivityTeamTable.get(Query().team_id == "legacy")
+        assert "photo_base64" not in doc
+        assert (tmp_path / doc["photo_url"].rsplit("/", 1)[1]).read_bytes() == PNG_1PX
+        assert "photo_base64" in GroupActivityTeamTable.get(Query().team_id == "broken")
+        # Re-running only retries what failed
+        assert migrate_team_photos() == {"migrated": 0, "failed": 1}
+
+class TestPhotoDedup:
+
+    def test_same_photo_is_stored_once_and_collected_with_last_team(self, authenticated_user, sample_team_data, upload_dir):
+        import hashlib
+        headers = {"Authorization": f"Bearer {authenticated_user['token']}"}
+        team_ids, urls = [], set()
+        for _ in range(3):
+            response = client.post(
+                "/api/v1/activity-teams/", data=team_form(sample_team_data),
+                files={"photo": ("team.png", PNG_1PX, "image/png")}, headers=headers,
+            )
+            team_ids.append(response.json()["team_id"])
+            urls.add(response.json()["photo_url"])
+        filename = f"{hashlib.sha256(PNG_1PX).hexdigest()}.png"
+        assert urls == {f"/static/uploads/team_photos/{filename}"}
+        assert [p.name for p in upload_dir.iterdir()] == [filename]
+        assert crud.get_photo_ref_count_db(filename) == 3
+        assert photo_storage.stats() == {"stored": 1, "deduplicated": 2, "removed": 0}
+        (upload_dir / f"{filename[:-4]}_thumb.webp").write_bytes(b"rendition")
+
+        for team_id in team_ids[:2]:
+            assert client.delete(f"/api/v1/activity-teams/{team_id}", headers=headers).status_code == 204
+        assert (upload_dir / filename).exists() and crud.get_photo_ref_count_db(filename) == 1
+        assert client.delete(f"/api/v1/activity-teams/{team_ids[2]}", headers=headers).status_code == 204
+        assert list(upload_dir.iterdir()) == []
+        assert crud.get_photo_ref_count_db(filename) == 0
+
+    def test_inline_photos_share_the_uploaded_file(self, clean_db, sample_team_data, tmp_path):
+        for lister in ("a", "b"):
+            team = GroupActivityTeam(**{**sample_team_data, "date_and_time": datetime.fromisoformat(sample_team_data["date_and_time"])}, lister_id=lister)
+            crud.create_group_activity_team_db(team)
+        assert len(list(tmp_path.iterdir())) == 1
+        assert crud.get_photo_ref_count_db(next(tmp_path.iterdir()).name) == 2
+
+    @pytest.mark.asyncio
+    async def test_renditions_of_a_stored_photo_are_reused(self, clean_db, sample_team_data, upload_dir):
+        from backend.services import photo_renditions
+        (upload_dir / "orig.jpg").write_bytes(make_jpeg(800, 600))
+        teams = []
+        for lister in ("a", "b"):
+            team = GroupActivityTeam(**{**sample_team_data, "photo_base64": None, "date_and_time": datetime.fromisoformat(sample_team_data["date_and_time"])}, lister_id=lister)
+            teams.append(crud.create_group_activity_team_db(team))
+        first = await photo_renditions.create_renditions(teams[0].team_id, "orig.jpg")
+        with patch.object(photo_renditions, "_get_pool", side_effect=AssertionError("rendered twice")):
+            second = await photo_renditions.create_renditions(teams[1].team_id, "orig.jpg")
+        assert first == second
+        assert crud.get_group_activity_team_by_id(teams[1].team_id).photo_renditions == first
+
+class TestPhotoCollectionRace:
+
+    def _team_with_inline_photo(self, sample_team_data):
+        team = GroupActivityTeam(**{**sample_team_data, "date_and_time": datetime.fromisoformat(sample_team_data["date_and_time"])}, lister_id="lister")
+        return crud.create_group_activity_team_db(team)
+
+    async def _delete(self, team_id):
+        from types import SimpleNamespace
+        from backend.routers.activity_teams_router import delete_activity_team
+        await delete_activity_team(team_id, current_user=SimpleNamespace(user_id="lister"))
+
+    def _upload(self):
+        import io
+        from fastapi import UploadFile
+        return UploadFile(file=io.BytesIO(PNG_1PX), size=len(PNG_1PX), filename="team.png")
+
+    @pytest.mark.asyncio
+    async def test_last_team_deleted_while_upload_closes(self, clean_db, sample_team_data, tmp_path):
+        old = self._team_with_inline_photo(sample_team_data)
+        filename = photo_storage.filename_from_url(old.photo_url)
+        upload = self._upload()
+        close = upload.close
+
+        async def close_while_team_is_deleted():
+            await self._delete(old.team_id) # Runs while the upload yields to the event loop
+            await close()
+
+        upload.close = close_while_team_is_deleted
+        assert await photo_storage.save_upload(upload) == filename
+        crud.acquire_photo_ref_db(filename)
+        assert (tmp_path / filename).read_bytes() == PNG_1PX
+        assert crud.get_photo_ref_count_db(filename) == 1
+
+    @pytest.mark.asyncio
+    async def test_upload_waits_for_collection_of_same_photo(self, clean_db, sample_team_data, tmp_path):
+        import asyncio
+        import time
+        old = self._team_with_inline_photo(sample_team_data)
+        filename = photo_storage.filename_from_url(old.photo_url)
+        remove_photo = photo_storage.remove_photo
+
+        def slow_remove_photo(name):
+            time.sleep(0.2)
+            remove_photo(name)
+
+        with patch.object(photo_storage, "remove_photo", slow_remove_photo):
+            deletion = asyncio.create_task(self._delete(old.team_id))
+            await asyncio.sleep(0.05) # Collection has started
+            assert await photo_storage.save_upload(self._upload()) == filename
+            crud.acquire_photo_ref_db(filename)
+            await deletion
+        assert (tmp_path / filename).read_bytes() == PNG_1PX
+        assert photo_storage.stats() == {"stored": 2, "deduplicated": 0, "removed": 1}
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"]) 
\ No newline at end of file